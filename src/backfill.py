@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Backfill: writes the readings stored in local files, i.e. the JSON lines
+written by the local file sink (--output-file) or by the spill files of the
+sinks, into the InfluxDB of the handler. The files are read in chunks, in
+constant memory, and each chunk is sent as a gzip compressed line protocol
+request, with a bounded number of requests in flight.
+
+The offset up to which a file is written is saved in a checkpoint file, so an
+interrupted backfill resumes from there. The options after '--' are passed to
+the handler, e.g.:
+
+    python src/backfill.py readings.jsonl -- -c /etc/tdm/handler.ini
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+import signal
+import logging
+import argparse
+import threading
+import collections
+import concurrent.futures
+
+import derived
+import htu21d_publisher
+import logging_utils
+import pipeline
+import sinks
+
+APPLICATION_NAME = 'HTU21D_backfill'
+
+CHUNK_SIZE = 10000      # Default readings of a request
+CONCURRENCY = 4         # Default requests in flight
+REPORT_INTERVAL = 10    # Seconds between two progress reports
+
+
+def read_chunks(f, offset, size, precision='s'):
+    """
+    Yields the records of a file opened in binary mode, starting from the
+    given offset, in chunks of the given size, each one with the offset
+    after its last line. An incomplete last line is left out. The timestamps
+    are converted to the given precision.
+    """
+    f.seek(offset)
+    _chunk = list()
+
+    for _line in f:
+        if not _line.endswith(b'\n'):
+            break
+        offset += len(_line)
+
+        if _line.strip():
+            _chunk.append(pipeline.load_reading(_line, precision))
+        if len(_chunk) == size:
+            yield _chunk, offset
+            _chunk = list()
+
+    if _chunk:
+        yield _chunk, offset
+
+
+class Checkpoint(object):
+    """
+    Offset of a file up to which the readings are written, saved atomically
+    in a JSON file.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self.offset = 0
+
+        if os.path.exists(path):
+            with open(path, 'r') as _f:
+                self.offset = json.load(_f)['offset']
+
+    def save(self, offset):
+        with open(self._path + '.tmp', 'w') as _f:
+            json.dump({'offset': offset}, _f)
+        os.replace(self._path + '.tmp', self._path)
+        self.offset = offset
+
+
+class Backfill(object):
+    """
+    Writes the chunks of readings from a pool of threads, each one with its
+    own InfluxDB sink. The derived metrics missing from the readings, e.g.
+    written by an older release, are computed for each chunk.
+    """
+
+    def __init__(self, logger, sink_factory, metrics,
+                 chunk_size=CHUNK_SIZE, concurrency=CONCURRENCY,
+                 precision='s'):
+        self._logger = logger
+        self._sink_factory = sink_factory
+        self._metrics = metrics
+        self._precision = precision
+        self._chunk_size = chunk_size
+        self._concurrency = concurrency
+
+        self._local = threading.local()
+        self._sinks = list()
+        self._lock = threading.Lock()
+
+        self.written = 0
+
+    def _write(self, chunk):
+        _sink = getattr(self._local, 'sink', None)
+        if _sink is None:
+            _sink = self._local.sink = self._sink_factory()
+            with self._lock:
+                self._sinks.append(_sink)
+
+        derived.apply([
+            _r for _r in chunk
+            if isinstance(_r, htu21d_publisher.HTU21DRecord) and any(
+                getattr(_r, _m) is None for _m in self._metrics)],
+            self._metrics)
+
+        _sink.write(chunk)
+        return len(chunk)
+
+    def run(self, path, checkpoint):
+        """
+        Writes the readings of a file from the checkpoint. The checkpoint
+        advances when all the chunks before it are written, a failed chunk
+        stops the backfill of the file.
+        """
+        # The offsets of a compressed file are in the uncompressed data
+        _compressed = path.endswith('.gz')
+        _opener = gzip.open if _compressed else open
+        _size = None if _compressed else os.path.getsize(path)
+
+        if _size is not None and checkpoint.offset > _size:
+            self._logger.warning(
+                "Checkpoint beyond the end of '%s', starting over", path)
+            checkpoint.save(0)
+
+        self._logger.info(
+            "Backfill of '%s' from offset %d", path, checkpoint.offset)
+
+        _pending = collections.deque()
+        _last_report = time.monotonic()
+
+        def _complete():
+            _future, _offset = _pending.popleft()
+            self.written += _future.result()
+            checkpoint.save(_offset)
+
+        with _opener(path, 'rb') as _f, \
+                concurrent.futures.ThreadPoolExecutor(
+                    self._concurrency,
+                    thread_name_prefix='backfill') as _executor:
+            try:
+                for _chunk, _offset in read_chunks(
+                        _f, checkpoint.offset, self._chunk_size,
+                        self._precision):
+                    if len(_pending) == self._concurrency:
+                        _complete()
+                    _pending.append(
+                        (_executor.submit(self._write, _chunk), _offset))
+
+                    if time.monotonic() - _last_report >= REPORT_INTERVAL:
+                        self._logger.info(
+                            "%d readings written, offset %d",
+                            self.written, checkpoint.offset)
+                        _last_report = time.monotonic()
+
+                while _pending:
+                    _complete()
+            finally:
+                for _future, _offset in _pending:
+                    _future.cancel()
+
+    def close(self):
+        for _sink in self._sinks:
+            _sink.close()
+
+
+def configuration_parser(p_args=None):
+    parser = argparse.ArgumentParser(
+        description=(
+            'Write the readings stored in local files into the InfluxDB of '
+            'the handler. The options after \'--\' are passed to the '
+            'handler.'),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument(
+        'files', nargs='+', metavar='FILE',
+        help=(
+            'JSON lines written by the local file sink or by a spill file, '
+            'optionally gzip compressed (.gz)'))
+    parser.add_argument(
+        '--chunk-size', dest='chunk_size', action='store',
+        type=int, metavar='READINGS', default=CHUNK_SIZE,
+        help='readings written by each request (default: {})'
+             .format(CHUNK_SIZE))
+    parser.add_argument(
+        '--concurrency', dest='concurrency', action='store',
+        type=int, metavar='REQUESTS', default=CONCURRENCY,
+        help='requests in flight (default: {})'.format(CONCURRENCY))
+    parser.add_argument(
+        '--checkpoint-dir', dest='checkpoint_dir', action='store',
+        type=str, metavar='DIR',
+        help=(
+            'directory of the checkpoint files, FILE.checkpoint (default: '
+            'the directory of each file)'))
+    parser.add_argument(
+        '--device-tag', dest='device_tag', action='store_true',
+        help='tag the points with the name of the device')
+
+    # The list of files would take the options of the handler too
+    p_args = sys.argv[1:] if p_args is None else list(p_args)
+    _handler_args = list()
+    if '--' in p_args:
+        _handler_args = p_args[p_args.index('--') + 1:]
+        p_args = p_args[:p_args.index('--')]
+
+    args = parser.parse_args(p_args)
+    args.handler = htu21d_publisher.configuration_parser(_handler_args)
+
+    return args
+
+
+def checkpoint_path(path, directory=None):
+    if directory is None:
+        return path + '.checkpoint'
+    return os.path.join(
+        directory, os.path.basename(path) + '.checkpoint')
+
+
+def main():
+    args = configuration_parser()
+    v_handler = args.handler
+
+    _log_listener = logging_utils.start_logging(
+        logging.INFO, rate_limit=v_handler.log_rate_limit)
+    logger = logging.getLogger(APPLICATION_NAME)
+    logger.setLevel(v_handler.logging_level)
+
+    signal.signal(signal.SIGINT, htu21d_publisher.signal_handler)
+
+    _selection = htu21d_publisher.select_derived_metrics(
+        v_handler.influxdb_derived, '')
+
+    def _sink():
+        return sinks.InfluxDBSink(
+            logger,
+            host=v_handler.influxdb_host,
+            port=v_handler.influxdb_port,
+            username=v_handler.influxdb_username,
+            password=v_handler.influxdb_password,
+            database=v_handler.influxdb_database,
+            precision=v_handler.timestamp_precision,
+            device_tag=args.device_tag,
+            gzip=True,
+            fields=_selection.influxdb_fields)
+
+    _backfill = Backfill(
+        logger, _sink, _selection.metrics, args.chunk_size,
+        args.concurrency, v_handler.timestamp_precision)
+
+    _start = time.monotonic()
+    try:
+        for _path in args.files:
+            _backfill.run(_path, Checkpoint(
+                checkpoint_path(_path, args.checkpoint_dir)))
+    except Exception as ex:
+        logger.error("Backfill stopped: %s", ex)
+        sys.exit(-1)
+    finally:
+        _backfill.close()
+        _elapsed = time.monotonic() - _start
+        logger.info(
+            "%d readings written in %.1f secs (%.1f/s)", _backfill.written,
+            _elapsed, _backfill.written / _elapsed if _elapsed else 0)
+        _log_listener.stop()
+
+
+if __name__ == "__main__":
+    main()
+
+# vim:ts=4:expandtab
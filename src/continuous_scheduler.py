@@ -15,6 +15,7 @@
 #  limitations under the License.
 #
 
+import math
 import time
 import sched
 
@@ -24,23 +25,66 @@ class TaskWrapper(object):
         self._period    = period
         self._priority  = priority
         self._scheduler = scheduler
+        self._deadline  = None
 
         self._args   = args
         self._kwargs = kwargs
 
+    @property
+    def deadline(self):
+        """
+        Time the current run, or the next one between two runs, is due.
+        """
+        return self._deadline
+
+    def schedule(self, delay):
+        self._deadline = self._scheduler.timefunc() + delay
+        self._scheduler.enterabs(
+            self._deadline, self._priority, self, self._args, self._kwargs)
+
     def __call__(self, *args, **kwargs):
         self._task(*self._args, **self._kwargs)
-        self._scheduler.enter(self._period, self._priority, self, *self._args, **self._kwargs)
+
+        # The next run is due one period after the start of this one, not
+        # after its end, so the task duration does not drift the schedule.
+        # When late by more than a period, the missed runs are skipped.
+        self._deadline += self._period
+        _late = self._scheduler.timefunc() - self._deadline
+        if _late > 0:
+            self._deadline += math.ceil(_late / self._period) * self._period
+
+        self._scheduler.enterabs(
+            self._deadline, self._priority, self, self._args, self._kwargs)
 
 
 class MainScheduler(object):
-    def __init__(self):
-        self._scheduler = sched.scheduler(time.time, time.sleep)
+    def __init__(self, timefunc=time.monotonic, delayfunc=time.sleep,
+                 profiler=None):
+        # Monotonic clock: not affected by the wall clock adjustments (NTP)
+        self._scheduler = sched.scheduler(timefunc, delayfunc)
+        self._profiler = profiler
+
+        if profiler is not None:
+            profiler.install_signal()
+            if profiler.memory is not None:
+                _interval = profiler.tracemalloc_interval
+                TaskWrapper(
+                    profiler.memory.snapshot, _interval, 1,
+                    self._scheduler).schedule(_interval)
 
     def add_task(self, task, delay, period, priority, *args, **kwargs):
+        if self._profiler is not None:
+            task = self._profiler.wrap(task)
+
         _task = TaskWrapper(task, period, priority, self._scheduler, *args, **kwargs)
-        self._scheduler.enter(delay, priority, _task, *args, **kwargs)
+        _task.schedule(delay)
+        return _task
 
-    def start(self):
-        self._scheduler.run()
+    def stop(self):
+        for _event in self._scheduler.queue:
+            self._scheduler.cancel(_event)
 
+    def start(self, duration=None):
+        if duration is not None:
+            self._scheduler.enter(duration, -1, self.stop)
+        self._scheduler.run()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Derived metrics: quantities computed from the temperature (Celsius) and the
+relative humidity (%) of the readings, over a whole batch at once:
+    * dewpoint: dew point in Celsius (Magnus formula);
+    * absoluteHumidity: water vapour density in g/m3;
+    * heatIndex: apparent temperature in Celsius (NOAA regression);
+    * vaporPressureDeficit: saturation minus actual vapour pressure in kPa.
+
+Each formula is written once over array operations: the batches are computed
+with NumPy when it is installed and large enough to pay off, otherwise value
+by value with the math module.
+"""
+
+import math
+
+# NumPy is optional, the batches are computed value by value without it
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+NUMPY_MIN_BATCH = 32    # Values below which the math module is faster
+
+MAGNUS_B = 17.62        # Magnus coefficients over water (WMO)
+MAGNUS_C = 243.12       # Celsius
+MAGNUS_E0 = 6.112       # Saturation vapour pressure at 0 Celsius in hPa
+
+
+class _Math(object):
+    """
+    Value by value counterpart of the NumPy functions used by the formulas.
+    """
+    exp = staticmethod(math.exp)
+    log = staticmethod(math.log)
+    sqrt = staticmethod(math.sqrt)
+    trunc = staticmethod(math.trunc)
+    abs = staticmethod(abs)
+    minimum = staticmethod(min)
+    maximum = staticmethod(max)
+
+    @staticmethod
+    def where(condition, x, y):
+        return x if condition else y
+
+
+def saturation_pressure(t, xp=_Math):
+    """
+    Returns the saturation vapour pressure in hPa at temperature t.
+    """
+    return MAGNUS_E0 * xp.exp(MAGNUS_B * t / (MAGNUS_C + t))
+
+
+def dewpoint(t, rh, es, xp=_Math):
+    # The humidity is clamped to keep the logarithm finite
+    _gamma = xp.log(xp.maximum(rh, 0.01) / 100) + MAGNUS_B * t / (MAGNUS_C + t)
+    return MAGNUS_C * _gamma / (MAGNUS_B - _gamma)
+
+
+def absolute_humidity(t, rh, es, xp=_Math):
+    return 216.7 * (rh / 100 * es) / (273.15 + t)
+
+
+def heat_index(t, rh, es, xp=_Math):
+    # Steadman's approximation below 80 F, Rothfusz regression with the NOAA
+    # adjustments above
+    _f = t * 1.8 + 32
+    _simple = 0.5 * (_f + 61 + (_f - 68) * 1.2 + rh * 0.094)
+    _hi = (
+        -42.379 + 2.04901523 * _f + 10.14333127 * rh
+        - 0.22475541 * _f * rh - 6.83783e-3 * _f * _f - 5.481717e-2 * rh * rh
+        + 1.22874e-3 * _f * _f * rh + 8.5282e-4 * _f * rh * rh
+        - 1.99e-6 * _f * _f * rh * rh)
+    _hi = _hi - xp.where(
+        (rh < 13) & (_f >= 80) & (_f <= 112),
+        (13 - rh) / 4 * xp.sqrt(xp.maximum(17 - xp.abs(_f - 95), 0) / 17), 0)
+    _hi = _hi + xp.where(
+        (rh > 85) & (_f >= 80) & (_f <= 87),
+        (rh - 85) / 10 * (87 - _f) / 5, 0)
+    _hi = xp.where((_simple + _f) / 2 >= 80, _hi, _simple)
+    return (_hi - 32) / 1.8
+
+
+def vapor_pressure_deficit(t, rh, es, xp=_Math):
+    return es * (1 - xp.minimum(rh, 100) / 100) / 10
+
+
+METRICS = {             # Formula of each metric, by field name
+    'dewpoint': dewpoint,
+    'absoluteHumidity': absolute_humidity,
+    'heatIndex': heat_index,
+    'vaporPressureDeficit': vapor_pressure_deficit
+}
+
+
+def parse_metrics(metrics):
+    """
+    Parses a list of metrics separated by commas, checking their names.
+    """
+    _metrics = [_m.strip() for _m in metrics.split(',') if _m.strip()]
+    for _metric in _metrics:
+        if _metric not in METRICS:
+            raise ValueError("Unknown derived metric '{:s}'".format(_metric))
+    return _metrics
+
+
+def compute(temperatures, humidities, metrics=tuple(METRICS)):
+    """
+    Returns the list of values of each metric for the given temperatures and
+    humidities, truncated to two decimals as the sensor values.
+    """
+    if numpy is not None and len(temperatures) >= NUMPY_MIN_BATCH:
+        _t = numpy.asarray(temperatures, dtype=float)
+        _rh = numpy.asarray(humidities, dtype=float)
+        _es = saturation_pressure(_t, numpy)
+
+        return {
+            _m: (numpy.trunc(
+                METRICS[_m](_t, _rh, _es, numpy) * 100) / 100).tolist()
+            for _m in metrics}
+
+    _values = {_m: list() for _m in metrics}
+    _formulas = [(_values[_m], METRICS[_m]) for _m in metrics]
+
+    for _t, _rh in zip(temperatures, humidities):
+        _es = saturation_pressure(_t)
+        for _list, _formula in _formulas:
+            _list.append(math.trunc(_formula(_t, _rh, _es) * 100) / 100)
+
+    return _values
+
+
+def apply(readings, metrics=tuple(METRICS)):
+    """
+    Sets the metrics on the readings, a single acquisition or a backlog,
+    which must have a field for each one. The readings without temperature
+    or humidity are left unchanged.
+    """
+    if not metrics:
+        return
+
+    _valid = [
+        _r for _r in readings
+        if _r.temperature is not None and _r.relativeHumidity is not None]
+    if not _valid:
+        return
+
+    _values = compute(
+        [_r.temperature for _r in _valid],
+        [_r.relativeHumidity for _r in _valid], metrics)
+
+    for _metric, _list in _values.items():
+        for _r, _value in zip(_valid, _list):
+            setattr(_r, _metric, _value)
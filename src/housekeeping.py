@@ -16,18 +16,21 @@
 #  limitations under the License.
 #
 
-import influxdb
 import statistics
 import tcp_latency
 import os
-import json
+import time
 import shutil
-import socket
 import platform
 import datetime
 import psutil
 import subprocess as subp
-import paho.mqtt.publish as publish
+import concurrent.futures
+
+import pipeline
+import records
+
+COLLECTOR_TIMEOUT = 5.0     # Default time budget (secs) of a collector
 
 
 def memoryTotal():
@@ -155,6 +158,13 @@ PARAMETER_FUNCTION_MAP = {
 }
 
 
+# Collectors with a time budget tighter than the default one
+COLLECTOR_TIMEOUTS = {
+    "signal": 2.0,
+    "tcpLatency": 3.0
+}
+
+
 TO_SEND = [
     "dateObserved",
     "timestamp",
@@ -169,68 +179,127 @@ TO_SEND = [
     "memoryTotal",
     "memoryFree",
     "swapTotal",
-    "swapFree"
+    "swapFree",
+    "staleParameters"
 ]
 
 
-def acquire(userdata):
-    v_logger = userdata['LOGGER']
-    v_mqtt_topic = userdata['MQTT_TOPIC'] + '.HOUSEKEEPING'
-    v_mqtt_host = userdata['MQTT_LOCAL_HOST']
-    v_mqtt_port = userdata['MQTT_LOCAL_PORT']
+class HousekeepingRecord(records.Record):
+    FIELDS = (
+        ('dateObserved', 'timestamp', 'latitude', 'longitude') +
+        tuple(PARAMETER_FUNCTION_MAP) + ('staleParameters',))
+    __slots__ = FIELDS
 
-    _to_save = dict()
+    KIND = 'housekeeping'
 
-    t_now = datetime.datetime.now().timestamp()
-    v_timestamp = int(t_now)
+    INFLUXDB_MEASUREMENT = 'telemetry'
+    INFLUXDB_FIELDS = FIELDS
 
-    _to_save['dateObserved'] = datetime.datetime.fromtimestamp(
-        v_timestamp, tz=datetime.timezone.utc).isoformat()
-    _to_save['timestamp'] = v_timestamp
-    _to_save['latitude'] = userdata['LATITUDE']
-    _to_save['longitude'] = userdata['LONGITUDE']
+    MQTT_TOPIC = 'DeviceStatus/{:s}.HOUSEKEEPING'
+    MQTT_FIELDS = tuple(TO_SEND)
 
-    for _parm in PARAMETER_FUNCTION_MAP:
-        try:
-            _to_save[_parm] = PARAMETER_FUNCTION_MAP[_parm]()
-        except Exception as ex:
-            _to_save[_parm] = None
-            v_logger.error(ex)
 
-    try:
-        _json_data = [{
-            "measurement": "telemetry",
-            # "tags": {
-            #     "sensor": "htu21d",
-            # },
-            "time": _to_save['timestamp'],
-            "fields": _to_save
-        }]
-        _client = influxdb.InfluxDBClient(
-            host=userdata['INFLUXDB_HOST'],
-            port=userdata['INFLUXDB_PORT'],
-            username=userdata['INFLUXDB_USER'],
-            password=userdata['INFLUXDB_PASS'],
-            database=userdata['INFLUXDB_DB']
-        )
-
-        _client.write_points(_json_data, time_precision='s')
-        v_logger.debug(
-            "Insert data into InfluxDB: {:s}".format(str(_json_data)))
-    except Exception as ex:
-        v_logger.error(ex)
-    finally:
-        _client.close()
-
-    _to_send = {_k: _v for _k, _v in _to_save.items() if _k in TO_SEND}
+class Collector(object):
+    """
+    Runs the given collectors concurrently, each one within its own time
+    budget, on a pool of threads of its own or on the given executor, e.g.
+    shared by many simulated devices. The pending runs and the last known
+    values are kept by each instance, call shutdown() when done.
+    """
 
-    try:
-        v_payload = json.dumps(_to_send)
-        v_logger.debug(
-            "Message topic:\'{:s}\', broker:\'{:s}:{:d}\', message:\'{:s}\'".
-            format(v_mqtt_topic, v_mqtt_host, v_mqtt_port, v_payload))
-        publish.single(
-            v_mqtt_topic, v_payload, hostname=v_mqtt_host,
-            port=v_mqtt_port)
-    except socket.error:
-        pass
+    def __init__(self, collectors, timeout, logger, executor=None):
+        self._collectors = collectors
+        self._timeout = timeout
+        self._logger = logger
+
+        self._owned = executor is None
+        if self._owned:
+            executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=len(collectors),
+                thread_name_prefix='housekeeping')
+        self._executor = executor
+
+        self._pending = dict()
+        self._last_values = dict()
+
+    def collect(self):
+        """
+        A collector that misses its budget is left running in background and
+        reported with its last known value (None if it never completed). It
+        is not restarted until it completes, so a hung collector holds at
+        most one worker thread. Returns the collected values and the list of
+        the stale ones.
+        """
+        _start = time.monotonic()
+
+        _futures = dict()
+        for _parm, _func in self._collectors.items():
+            _future = self._pending.get(_parm)
+
+            if _future is not None and _future.done():
+                # Late result from a previous cycle, still useful as cache
+                if _future.exception() is None:
+                    self._last_values[_parm] = _future.result()
+                _future = None
+
+            if _future is None:
+                _future = self._executor.submit(_func)
+                self._pending[_parm] = _future
+
+            _futures[_parm] = _future
+
+        _values = dict()
+        _stale = list()
+        for _parm, _future in _futures.items():
+            _budget = min(
+                COLLECTOR_TIMEOUTS.get(_parm, self._timeout), self._timeout)
+            _remaining = max(0, _start + _budget - time.monotonic())
+
+            try:
+                _values[_parm] = _future.result(timeout=_remaining)
+            except concurrent.futures.TimeoutError:
+                _values[_parm] = self._last_values.get(_parm)
+                _stale.append(_parm)
+                self._logger.warning(
+                    "Collector '%s' exceeded its budget of %s secs",
+                    _parm, _budget)
+                continue
+            except Exception as ex:
+                _values[_parm] = None
+                self._logger.error(ex)
+            else:
+                self._last_values[_parm] = _values[_parm]
+
+            del self._pending[_parm]
+
+        return _values, _stale
+
+    def shutdown(self):
+        """
+        Cancels the runs not started yet and releases the pool of threads, if
+        owned, without waiting for the hung collectors.
+        """
+        for _future in self._pending.values():
+            _future.cancel()
+        self._pending.clear()
+
+        if self._owned:
+            self._executor.shutdown(wait=False)
+
+
+def acquire(userdata):
+    v_pipeline = userdata['PIPELINE']
+
+    _record = HousekeepingRecord(userdata['DEVICE'])
+
+    _record.timestamp, _record.dateObserved = pipeline.wall_clock(
+        userdata['TIMESTAMP_PRECISION'], userdata['WALL_CLOCK'])
+    _record.latitude = userdata['LATITUDE']
+    _record.longitude = userdata['LONGITUDE']
+
+    _values, _stale = userdata['HKP_COLLECTOR'].collect()
+    for _parm, _value in _values.items():
+        setattr(_record, _parm, _value)
+    _record.staleParameters = ','.join(_stale)
+
+    v_pipeline.put(_record)
@@ -16,20 +16,36 @@
 #  limitations under the License.
 #
 
+import os
 import sys
-import json
+import time
 import signal
-import socket
 import logging
-import influxdb
 import argparse
-import datetime
+import threading
+import collections
 import configparser
-import paho.mqtt.publish as publish
+import concurrent.futures
 
-import Adafruit_HTU21D.HTU21D as HTU21D
 import continuous_scheduler
+import derived
 import housekeeping
+import latest_value
+import logging_utils
+import pipeline
+import profiling
+import records
+import simulation
+import sinks
+import supervisor
+
+# The sensor libraries are not needed in simulation mode
+try:
+    import Adafruit_GPIO.I2C as I2C
+    import Adafruit_HTU21D.HTU21D as HTU21D
+except ImportError:
+    I2C = None
+    HTU21D = None
 
 MQTT_LOCAL_HOST = "localhost"   # MQTT Broker address
 MQTT_LOCAL_PORT = 1883          # MQTT Broker port
@@ -39,108 +55,221 @@ INFLUXDB_DB = "edgedevicehandler" # INFLUXDB database
 INFLUXDB_USER = "root"          # INFLUXDB username
 INFLUXDB_PASS = "root"          # INFLUXDB password
 GPS_LOCATION = "0.0,0.0"        # DEFAULT location
+DEVICE_NAME = "EDGE"            # Device name in MQTT topics
 
 I2C_BUS_NUM = 1             # Default I2C Bus Number (RPi2/3)
+I2C_TARGETS = ""            # Default I2C sensor targets (only I2C_BUS_NUM)
+I2C_MUX_ADDRESS = 0x70      # I2C multiplexer address (TCA9548A)
+HTU21D_ADDRESS = 0x40       # Default HTU21D sensor address
 ACQUISITION_INTERVAL = 60   # Seconds between two acquisitions
+HOUSEKEEPING_TIMEOUT = 5    # Seconds of time budget for each collector
+TIMESTAMP_PRECISION = 's'   # Resolution of the timestamps
+LOG_RATE_LIMIT = logging_utils.RATE_LIMIT_INTERVAL  # Secs between repeats
+SIMULATION_SPEED = 1.0      # Speed factor of the simulation mode
+PROFILE_EVERY = profiling.PROFILE_EVERY     # Runs between two stats dumps
+HEARTBEAT_TIMEOUT = supervisor.HEARTBEAT_TIMEOUT    # Secs before a restart
+
+QUEUE_SIZE = pipeline.QUEUE_SIZE    # Readings buffered for each sink
+OVERFLOW_POLICY = pipeline.DROP_OLDEST  # Default sink overflow policy
+SPILL_DIR = "/var/tmp"              # Directory of the sink spill files
+STATS_INTERVAL = 300                # Seconds between two pipeline stats
+
+MQTT_BATCH_THRESHOLD = sinks.MQTT_BATCH_THRESHOLD   # Backlog for batch mode
+MQTT_BATCH_SIZE = sinks.MQTT_BATCH_SIZE             # Bytes of a batch message
+MQTT_BATCH_LAYOUT = sinks.ARRAY                     # Layout of a batch message
+MQTT_QOS = sinks.MQTT_QOS                   # QoS of the MQTT topics
+MQTT_INFLIGHT = sinks.MQTT_INFLIGHT         # Messages waiting for the ack
+MQTT_QUEUE_LIMIT = sinks.MQTT_QUEUE_LIMIT   # Messages queued by the client
+
+LOCAL_SLOTS = latest_value.SLOTS            # Topics of the local region
+LOCAL_SLOT_SIZE = latest_value.SLOT_SIZE    # Bytes of a local region slot
+
+INFLUXDB_UDP_PORT = 0               # InfluxDB UDP listener port (0: no UDP)
+INFLUXDB_UDP_KINDS = "housekeeping" # Readings sent over UDP
+INFLUXDB_UDP_SIZE = sinks.UDP_DATAGRAM_SIZE     # Bytes of a UDP datagram
+
+INFLUXDB_DERIVED = ",".join(derived.METRICS)    # Derived metrics to InfluxDB
+MQTT_DERIVED = ""                               # Derived metrics to MQTT
 
 
 APPLICATION_NAME = 'HTU21D_publisher'
 
+SINGLE = 'single'           # Tasks and sinks in a single process
+SUPERVISED = 'supervised'   # Tasks in worker processes, restarted on failure
+PROCESS_MODES = [SINGLE, SUPERVISED]
 
-PROVIDES = [                # What measures we are providing
+
+MEASURES = [                # What measures the sensor provides
     'temperature',
-    'relativeHumidity',
-    'dewpoint'
+    'relativeHumidity'
 ]
 
+PROVIDES = MEASURES + list(derived.METRICS)     # What measures we provide
+
 
 def signal_handler(sig, frame):
     sys.exit(0)
 
 
-def htu21d_task(userdata):
-    v_logger = userdata['LOGGER']
-    v_mqtt_topic = 'WeatherObserved/EDGE' + '.HTU21D'
-    v_mqtt_local_host = userdata['MQTT_LOCAL_HOST']
-    v_mqtt_local_port = userdata['MQTT_LOCAL_PORT']
-    v_i2c_bus = userdata['I2C_BUS']
+class HTU21DRecord(records.Record):
+    FIELDS = (
+        'dateObserved', 'timestamp', 'longitude', 'latitude', 'temperature',
+        'relativeHumidity', 'dewpoint', 'absoluteHumidity', 'heatIndex',
+        'vaporPressureDeficit', 'target')
+    __slots__ = FIELDS
+
+    KIND = 'htu21d'
+
+    INFLUXDB_MEASUREMENT = 'sensors'
+    INFLUXDB_TAGS = {'sensor': 'htu21d'}
+    INFLUXDB_FIELDS = tuple(PROVIDES)
+
+    MQTT_TOPIC = 'WeatherObserved/{:s}.HTU21D'
+    MQTT_FIELDS = (
+        'dateObserved', 'timestamp', 'longitude', 'latitude', 'temperature',
+        'relativeHumidity', 'target')
+    MQTT_OPTIONAL = ('target',)     # Only with several sensor targets
+
+
+DerivedSelection = collections.namedtuple(
+    'DerivedSelection', ['influxdb_fields', 'mqtt_fields', 'metrics'])
+
+
+def select_derived_metrics(influxdb_metrics, mqtt_metrics):
+    """
+    Selects the derived metrics sent to InfluxDB and to MQTT, given as lists
+    separated by commas. Returns the fields of the HTU21D readings for the
+    sinks of each one (records.SinkFields by kind) and the metrics to
+    compute.
+    """
+    _influxdb = derived.parse_metrics(influxdb_metrics)
+    _mqtt = derived.parse_metrics(mqtt_metrics)
+
+    # The derived metrics go before the optional fields
+    _mqtt_fields = [
+        _f for _f in HTU21DRecord.MQTT_FIELDS
+        if _f not in derived.METRICS and _f not in HTU21DRecord.MQTT_OPTIONAL]
+    _mqtt_fields += _mqtt + list(HTU21DRecord.MQTT_OPTIONAL)
+
+    return DerivedSelection(
+        {HTU21DRecord.KIND: records.SinkFields(
+            HTU21DRecord, MEASURES + _influxdb)},
+        {HTU21DRecord.KIND: records.SinkFields(HTU21DRecord, _mqtt_fields)},
+        tuple(_m for _m in derived.METRICS if _m in _influxdb + _mqtt))
 
-    v_influxdb_host = userdata['INFLUXDB_HOST']
-    v_influxdb_port = userdata['INFLUXDB_PORT']
-    v_influxdb_username = userdata['INFLUXDB_USER']
-    v_influxdb_password = userdata['INFLUXDB_PASS']
-    v_influxdb_database = userdata['INFLUXDB_DB']
 
-    m = dict()
+I2CTarget = collections.namedtuple(
+    'I2CTarget', ['bus', 'channel', 'address'])
 
-    t_now = datetime.datetime.now().timestamp()
-    v_timestamp = int(t_now)
 
-    m['dateObserved'] = datetime.datetime.fromtimestamp(
-        v_timestamp, tz=datetime.timezone.utc).isoformat()
-    m['timestamp'] = v_timestamp
-    m['longitude'] = userdata['LONGITUDE']
-    m['latitude'] = userdata['LATITUDE']
+def parse_i2c_targets(targets, default_bus=I2C_BUS_NUM):
+    """
+    Parses a list of sensor targets separated by commas or spaces, each one as
+    BUS[:CHANNEL][@ADDRESS], where CHANNEL is the channel of the I2C
+    multiplexer the sensor is attached to. An empty list stands for the
+    sensor at the default address on the default bus.
+    """
+    _targets = list()
 
-    htu21d = HTU21D.HTU21D(busnum=v_i2c_bus)
+    for _target in targets.replace(',', ' ').split():
+        _target, _sep, _address = _target.partition('@')
+        _bus, _sep, _channel = _target.partition(':')
 
+        _targets.append(I2CTarget(
+            int(_bus),
+            int(_channel) if _channel else None,
+            int(_address, 0) if _address else HTU21D_ADDRESS))
+
+    if not _targets:
+        _targets.append(
+            I2CTarget(default_bus, None, HTU21D_ADDRESS))
+
+    return _targets
+
+
+def format_i2c_target(target):
+    _target = '{:d}'.format(target.bus)
+    if target.channel is not None:
+        _target += ':{:d}'.format(target.channel)
+    return _target + '@0x{:02x}'.format(target.address)
+
+
+def create_i2c_pollers(targets):
+    """
+    Creates a single thread poller for each I2C bus: sensors on different
+    buses are read concurrently, while the accesses to a bus are serialized.
+    """
+    return {
+        _bus: concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='i2c-{:d}'.format(_bus))
+        for _bus in set(_t.bus for _t in targets)}
+
+
+def read_htu21d(target):
+    """
+    Reads the sensor at the given target, returning temperature and relative
+    humidity (None when the sensor is not responding).
+    """
+    _mux = None
     try:
-        htu21d.reset()
+        if target.channel is not None:
+            _mux = I2C.get_i2c_device(I2C_MUX_ADDRESS, busnum=target.bus)
+            _mux.writeRaw8(1 << target.channel)
 
-        m["temperature"] = int(htu21d.read_temperature() * 100) / 100
-        m["relativeHumidity"] = int(htu21d.read_humidity() * 100) / 100
-        m["dewpoint"] = int(htu21d.read_dewpoint() * 100) / 100
-
-        _json_data = [{
-            "measurement": "sensors",
-            "tags": {
-                "sensor": "htu21d",
-            },
-            "time": m['timestamp'],
-            "fields": {
-                "temperature": m['temperature'],
-                "relativeHumidity": m['relativeHumidity'],
-                "dewpoint": m['dewpoint']
-            }
-        }]
+        htu21d = HTU21D.HTU21D(address=target.address, busnum=target.bus)
+        htu21d.reset()
 
+        return (
+            int(htu21d.read_temperature() * 100) / 100,
+            int(htu21d.read_humidity() * 100) / 100)
     except IOError:
-        m["temperature"] = None
-        m["relativeHumidity"] = None
-        m["dewpoint"] = None
-
-        _json_data = None
-
-    if _json_data is not None:
-        try:
-            _client = influxdb.InfluxDBClient(
-                host=v_influxdb_host,
-                port=v_influxdb_port,
-                username=v_influxdb_username,
-                password=v_influxdb_password,
-                database=v_influxdb_database
-            )
-
-            _client.write_points(_json_data, time_precision='s')
-            v_logger.debug(
-                "Insert data into InfluxDB: {:s}".format(str(_json_data)))
-        except Exception as ex:
-            v_logger.error(ex)
-        finally:
-            _client.close()
+        return None, None
+    finally:
+        # Deselects the channel, so the sensor does not answer at the
+        # address of a target read next on the bus without the multiplexer
+        if _mux is not None:
+            try:
+                _mux.writeRaw8(0)
+            except IOError:
+                pass
 
-    try:
-        del m['dewpoint']
-        v_payload = json.dumps(m)
-        v_logger.debug(
-            "Message topic:\'{:s}\', broker:\'{:s}:{:d}\', "
-            "message:\'{:s}\'".format(
-                v_mqtt_topic, v_mqtt_local_host, v_mqtt_local_port, v_payload))
-        publish.single(
-            v_mqtt_topic, v_payload, hostname=v_mqtt_local_host,
-            port=v_mqtt_local_port)
-    except socket.error:
-        pass
+
+def htu21d_task(userdata):
+    v_pipeline = userdata['PIPELINE']
+    v_reader = userdata['SENSOR_READER']
+    v_targets = userdata['I2C_TARGETS']
+    v_pollers = userdata['I2C_POLLERS']
+    v_tagged = userdata['I2C_TAGGED']
+
+    v_timestamp, v_date = pipeline.wall_clock(
+        userdata['TIMESTAMP_PRECISION'], userdata['WALL_CLOCK'])
+
+    _futures = [
+        (_target, v_pollers[_target.bus].submit(v_reader, _target))
+        for _target in v_targets]
+
+    _records = list()
+    for _target, _future in _futures:
+        m = HTU21DRecord(userdata['DEVICE'])
+
+        m.dateObserved = v_date
+        m.timestamp = v_timestamp
+        m.longitude = userdata['LONGITUDE']
+        m.latitude = userdata['LATITUDE']
+
+        m.temperature, m.relativeHumidity = _future.result()
+
+        if v_tagged:
+            m.target = format_i2c_target(_target)
+            m.tags = {'target': m.target}
+
+        _records.append(m)
+
+    # The derived metrics of all the targets are computed at once
+    derived.apply(_records, userdata['DERIVED_METRICS'])
+
+    for m in _records:
+        v_pipeline.put(m)
 
 
 def configuration_parser(p_args=None):
@@ -157,6 +286,7 @@ def configuration_parser(p_args=None):
         'mqtt_local_host'     : MQTT_LOCAL_HOST,
         'mqtt_local_port'     : MQTT_LOCAL_PORT,
         'logging_level' : logging.INFO,
+        'log_rate_limit' : LOG_RATE_LIMIT,
         'influxdb_host' : INFLUXDB_HOST,
         'influxdb_port' : INFLUXDB_PORT,
         'influxdb_database' : INFLUXDB_DB,
@@ -168,7 +298,41 @@ def configuration_parser(p_args=None):
     v_specific_config_defaults = {
         'htu_interval' : ACQUISITION_INTERVAL,
         'hkp_interval' : ACQUISITION_INTERVAL,
-        'i2c_bus'      : I2C_BUS_NUM
+        'hkp_timeout'  : HOUSEKEEPING_TIMEOUT,
+        'i2c_bus'      : I2C_BUS_NUM,
+        'i2c_targets'  : I2C_TARGETS,
+        'timestamp_precision' : TIMESTAMP_PRECISION,
+        'queue_size'   : QUEUE_SIZE,
+        'influxdb_overflow' : OVERFLOW_POLICY,
+        'influxdb_udp_port'  : INFLUXDB_UDP_PORT,
+        'influxdb_udp_kinds' : INFLUXDB_UDP_KINDS,
+        'influxdb_udp_size'  : INFLUXDB_UDP_SIZE,
+        'influxdb_derived'   : INFLUXDB_DERIVED,
+        'mqtt_overflow'     : OVERFLOW_POLICY,
+        'mqtt_batch_threshold' : MQTT_BATCH_THRESHOLD,
+        'mqtt_batch_size'      : MQTT_BATCH_SIZE,
+        'mqtt_batch_layout'    : MQTT_BATCH_LAYOUT,
+        'mqtt_client_id'   : '',
+        'mqtt_qos'         : MQTT_QOS,
+        'mqtt_inflight'    : MQTT_INFLIGHT,
+        'mqtt_queue_limit' : MQTT_QUEUE_LIMIT,
+        'mqtt_derived'     : MQTT_DERIVED,
+        'output_file'       : '',
+        'output_overflow'   : OVERFLOW_POLICY,
+        'local_region'      : '',
+        'local_slots'       : LOCAL_SLOTS,
+        'local_slot_size'   : LOCAL_SLOT_SIZE,
+        'spill_dir'         : SPILL_DIR,
+        'stats_interval'    : STATS_INTERVAL,
+        'simulate'          : '',
+        'speed'             : SIMULATION_SPEED,
+        'duration'          : 0,
+        'process_mode'      : SINGLE,
+        'heartbeat_timeout' : HEARTBEAT_TIMEOUT,
+        'profile_dir'       : '',
+        'profile_tasks'     : '',
+        'profile_every'     : PROFILE_EVERY,
+        'tracemalloc_interval' : 0
     }
 
     v_config_section_defaults = {
@@ -211,6 +375,12 @@ def configuration_parser(p_args=None):
         type=int,
         help='threshold level for log messages (default: {})'
              .format(logging.INFO))
+    parser.add_argument(
+        '--log-rate-limit', dest='log_rate_limit', action='store',
+        type=int,
+        help=(
+            'seconds a repeated warning or error message is suppressed for, '
+            '0 to disable (default: {})').format(LOG_RATE_LIMIT))
     parser.add_argument(
         '--mqtt-host', dest='mqtt_local_host', action='store',
         type=str,
@@ -225,6 +395,12 @@ def configuration_parser(p_args=None):
         type=int,
         help='I2C bus number to which the sensor is attached '
         '(default: {})'.format(I2C_BUS_NUM))
+    parser.add_argument(
+        '--i2c-targets', dest='i2c_targets', action='store',
+        type=str, metavar='TARGETS',
+        help=(
+            'list of sensors as BUS[:MUX_CHANNEL][@ADDRESS], separated by '
+            'commas, overriding --i2c-bus (default: the sensor on I2C_BUS)'))
     parser.add_argument(
         '--htu-interval', dest='htu_interval', action='store',
         type=int,
@@ -237,6 +413,17 @@ def configuration_parser(p_args=None):
         help=(
             'interval in seconds for Housekeeping data acquisition '
             'and publication (default: {} secs)').format(ACQUISITION_INTERVAL))
+    parser.add_argument(
+        '--hkp-timeout', dest='hkp_timeout', action='store',
+        type=float,
+        help=(
+            'time budget in seconds for each Housekeeping collector '
+            '(default: {} secs)').format(HOUSEKEEPING_TIMEOUT))
+    parser.add_argument(
+        '--timestamp-precision', dest='timestamp_precision', action='store',
+        type=str, choices=list(pipeline.TIMESTAMP_PRECISIONS),
+        help='resolution of the timestamps (default: {})'
+             .format(TIMESTAMP_PRECISION))
     parser.add_argument(
         '--influxdb-host', dest='influxdb_host', action='store',
         type=str,
@@ -252,18 +439,438 @@ def configuration_parser(p_args=None):
         help=(
             'GPS coordinates of the sensor as latitude,longitude '
             '(default: {})').format(GPS_LOCATION))
+    parser.add_argument(
+        '--queue-size', dest='queue_size', action='store',
+        type=int,
+        help='number of readings buffered for each sink (default: {})'
+             .format(QUEUE_SIZE))
+    parser.add_argument(
+        '--influxdb-overflow', dest='influxdb_overflow', action='store',
+        type=str, choices=pipeline.OVERFLOW_POLICIES,
+        help='overflow policy of the InfluxDB sink (default: {})'
+             .format(OVERFLOW_POLICY))
+    parser.add_argument(
+        '--influxdb-udp-port', dest='influxdb_udp_port', action='store',
+        type=int,
+        help=(
+            'port of the UDP listener of the influx database, 0 to write '
+            'only over HTTP (default: {})').format(INFLUXDB_UDP_PORT))
+    parser.add_argument(
+        '--influxdb-udp-kinds', dest='influxdb_udp_kinds', action='store',
+        type=str, metavar='KINDS',
+        help=(
+            'comma separated kinds of readings ({}) sent over UDP, all when '
+            'empty (default: {})').format(
+                ', '.join(sorted(records.RECORD_TYPES)), INFLUXDB_UDP_KINDS))
+    parser.add_argument(
+        '--influxdb-udp-size', dest='influxdb_udp_size', action='store',
+        type=int, metavar='BYTES',
+        help='max size of a UDP datagram (default: {})'
+             .format(INFLUXDB_UDP_SIZE))
+    parser.add_argument(
+        '--influxdb-derived', dest='influxdb_derived', action='store',
+        type=str, metavar='METRICS',
+        help=(
+            'comma separated derived metrics ({}) written to InfluxDB '
+            '(default: all)').format(', '.join(derived.METRICS)))
+    parser.add_argument(
+        '--mqtt-overflow', dest='mqtt_overflow', action='store',
+        type=str, choices=pipeline.OVERFLOW_POLICIES,
+        help='overflow policy of the MQTT sink (default: {})'
+             .format(OVERFLOW_POLICY))
+    parser.add_argument(
+        '--mqtt-batch-threshold', dest='mqtt_batch_threshold',
+        action='store', type=int,
+        help=(
+            'backlog of readings above which they are published in batched '
+            'messages, 0 to disable (default: {})').format(
+                MQTT_BATCH_THRESHOLD))
+    parser.add_argument(
+        '--mqtt-batch-size', dest='mqtt_batch_size', action='store',
+        type=int,
+        help='max size in bytes of a batched message (default: {})'
+             .format(MQTT_BATCH_SIZE))
+    parser.add_argument(
+        '--mqtt-batch-layout', dest='mqtt_batch_layout', action='store',
+        type=str, choices=sinks.MQTT_BATCH_LAYOUTS,
+        help='layout of a batched message (default: {})'
+             .format(MQTT_BATCH_LAYOUT))
+    parser.add_argument(
+        '--mqtt-client-id', dest='mqtt_client_id', action='store',
+        type=str, metavar='ID',
+        help=(
+            'client id of the persistent MQTT session (default: {}-{})'
+            .format(APPLICATION_NAME, DEVICE_NAME)))
+    parser.add_argument(
+        '--mqtt-qos', dest='mqtt_qos', action='store',
+        type=str, metavar='TOPICS',
+        help=(
+            'QoS of the MQTT topics as TOPIC_FILTER=QOS, separated by commas, '
+            '0 for the others (default: {})').format(MQTT_QOS))
+    parser.add_argument(
+        '--mqtt-inflight', dest='mqtt_inflight', action='store',
+        type=int, metavar='MESSAGES',
+        help=(
+            'max QoS 1 and 2 messages waiting for the acknowledgement '
+            '(default: {})').format(MQTT_INFLIGHT))
+    parser.add_argument(
+        '--mqtt-queue-limit', dest='mqtt_queue_limit', action='store',
+        type=int, metavar='MESSAGES',
+        help=(
+            'max QoS 1 and 2 messages queued by the MQTT client, 0 for no '
+            'limit (default: {})').format(MQTT_QUEUE_LIMIT))
+    parser.add_argument(
+        '--mqtt-derived', dest='mqtt_derived', action='store',
+        type=str, metavar='METRICS',
+        help='comma separated derived metrics added to the MQTT messages')
+    parser.add_argument(
+        '--output-file', dest='output_file', action='store',
+        type=str, metavar='FILE',
+        help='also write the readings to a local file as JSON lines')
+    parser.add_argument(
+        '--output-overflow', dest='output_overflow', action='store',
+        type=str, choices=pipeline.OVERFLOW_POLICIES,
+        help='overflow policy of the local file sink (default: {})'
+             .format(OVERFLOW_POLICY))
+    parser.add_argument(
+        '--local-region', dest='local_region', action='store',
+        type=str, metavar='FILE',
+        help=(
+            'also publish the latest MQTT messages in a memory mapped file '
+            'for the local consumers, e.g. in /dev/shm'))
+    parser.add_argument(
+        '--local-slots', dest='local_slots', action='store',
+        type=int, metavar='SLOTS',
+        help='number of topics of the local region (default: {})'
+             .format(LOCAL_SLOTS))
+    parser.add_argument(
+        '--local-slot-size', dest='local_slot_size', action='store',
+        type=int, metavar='BYTES',
+        help='max size of a message in the local region (default: {})'
+             .format(LOCAL_SLOT_SIZE))
+    parser.add_argument(
+        '--spill-dir', dest='spill_dir', action='store',
+        type=str, metavar='DIR',
+        help='directory of the spill files of the sinks (default: {})'
+             .format(SPILL_DIR))
+    parser.add_argument(
+        '--stats-interval', dest='stats_interval', action='store',
+        type=float, metavar='SECONDS',
+        help=(
+            'seconds between two logs of the stats of the sinks, 0 to log '
+            'them only on exit (default: {})').format(STATS_INTERVAL))
+
+    parser.add_argument(
+        '--simulate', dest='simulate', action='store',
+        type=str, metavar='SOURCE',
+        help=(
+            'simulate the sensors and the housekeeping parameters, SOURCE is '
+            '\'{}\' or a trace file written by --output-file').format(
+                simulation.SYNTHETIC))
+    parser.add_argument(
+        '--speed', dest='speed', action='store',
+        type=float,
+        help=(
+            'speed factor of the simulation, 0 for as fast as possible '
+            '(default: {})').format(SIMULATION_SPEED))
+    parser.add_argument(
+        '--duration', dest='duration', action='store',
+        type=float, metavar='SECONDS',
+        help='stop after the given (simulated) time, 0 to run forever')
+    parser.add_argument(
+        '--process-mode', dest='process_mode', action='store',
+        type=str, choices=PROCESS_MODES,
+        help=(
+            'run the sensor and housekeeping tasks in the process of the '
+            'sinks, or each one in a worker process restarted on failure '
+            '(default: {})').format(SINGLE))
+    parser.add_argument(
+        '--heartbeat-timeout', dest='heartbeat_timeout', action='store',
+        type=float, metavar='SECONDS',
+        help=(
+            'seconds without a heartbeat before a worker process is '
+            'restarted (default: {})').format(HEARTBEAT_TIMEOUT))
+    parser.add_argument(
+        '--profile-dir', dest='profile_dir', action='store',
+        type=str, metavar='DIR',
+        help=(
+            'enable the profiling of the tasks, writing into DIR; the '
+            'sampling profiler is toggled by SIGUSR1'))
+    parser.add_argument(
+        '--profile-tasks', dest='profile_tasks', action='store',
+        type=str, metavar='TASKS',
+        help=(
+            'comma separated names of the tasks run under cProfile '
+            '(default: all)'))
+    parser.add_argument(
+        '--profile-every', dest='profile_every', action='store',
+        type=int, metavar='RUNS',
+        help=(
+            'runs of a task between two dumps of its profile, 0 to disable '
+            'cProfile (default: {})').format(PROFILE_EVERY))
+    parser.add_argument(
+        '--tracemalloc-interval', dest='tracemalloc_interval',
+        action='store', type=float, metavar='SECONDS',
+        help='seconds between two memory snapshots, 0 to disable')
 
     args = parser.parse_args(remaining_args)
     return args
 
 
-def main():
-    # Initializes the default logger
-    logging.basicConfig(
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        level=logging.INFO)
-    logger = logging.getLogger(APPLICATION_NAME)
+def build_pipeline(args, logger, device_tag=False, wrapper=None):
+    """
+    Creates the pipeline with a worker for each configured sink. The device
+    name is added to the InfluxDB tags when device_tag is set, and each sink
+    is replaced by wrapper(sink) when a wrapper is given.
+    """
+    def _spill_path(name):
+        return os.path.join(
+            args.spill_dir, '{:s}.{:s}.spill'.format(APPLICATION_NAME, name))
+
+    def _wrap(sink):
+        return sink if wrapper is None else wrapper(sink)
+
+    _pipeline = pipeline.Pipeline(logger)
+    _selection = select_derived_metrics(
+        args.influxdb_derived, args.mqtt_derived)
+
+    # The readings of the UDP kinds are not written over HTTP
+    _http_kinds = None
+    if args.influxdb_udp_port:
+        _udp_kinds = [
+            _k.strip() for _k in args.influxdb_udp_kinds.split(',')
+            if _k.strip()] or list(records.RECORD_TYPES)
+        for _kind in _udp_kinds:
+            if _kind not in records.RECORD_TYPES:
+                raise ValueError("Unknown kind '{:s}'".format(_kind))
+        _http_kinds = [
+            _k for _k in records.RECORD_TYPES if _k not in _udp_kinds]
+
+        _pipeline.add_sink(
+            _wrap(sinks.InfluxDBUDPSink(
+                logger,
+                host=args.influxdb_host,
+                port=args.influxdb_udp_port,
+                precision=args.timestamp_precision,
+                device_tag=device_tag,
+                datagram_size=args.influxdb_udp_size,
+                fields=_selection.influxdb_fields)),
+            kinds=_udp_kinds,
+            queue_size=args.queue_size,
+            policy=args.influxdb_overflow,
+            precision=args.timestamp_precision,
+            spill_path=_spill_path(sinks.InfluxDBUDPSink.NAME))
+
+    if _http_kinds is None or _http_kinds:
+        _pipeline.add_sink(
+            _wrap(sinks.InfluxDBSink(
+                logger,
+                host=args.influxdb_host,
+                port=args.influxdb_port,
+                username=args.influxdb_username,
+                password=args.influxdb_password,
+                database=args.influxdb_database,
+                precision=args.timestamp_precision,
+                device_tag=device_tag,
+                fields=_selection.influxdb_fields)),
+            kinds=_http_kinds,
+            queue_size=args.queue_size,
+            policy=args.influxdb_overflow,
+            precision=args.timestamp_precision,
+            spill_path=_spill_path(sinks.InfluxDBSink.NAME))
+
+    _pipeline.add_sink(
+        _wrap(sinks.MQTTSink(
+            logger,
+            host=args.mqtt_local_host,
+            port=args.mqtt_local_port,
+            client_id=args.mqtt_client_id or '{:s}-{:s}'.format(
+                APPLICATION_NAME, DEVICE_NAME),
+            qos=sinks.parse_mqtt_qos(args.mqtt_qos),
+            inflight=args.mqtt_inflight,
+            queue_limit=args.mqtt_queue_limit,
+            batch_threshold=args.mqtt_batch_threshold,
+            batch_size=args.mqtt_batch_size,
+            batch_layout=args.mqtt_batch_layout,
+            fields=_selection.mqtt_fields)),
+        queue_size=args.queue_size,
+        policy=args.mqtt_overflow,
+        precision=args.timestamp_precision,
+        spill_path=_spill_path(sinks.MQTTSink.NAME))
+
+    if args.output_file:
+        _pipeline.add_sink(
+            _wrap(sinks.FileSink(
+                logger, args.output_file, args.timestamp_precision)),
+            queue_size=args.queue_size,
+            policy=args.output_overflow,
+            precision=args.timestamp_precision,
+            spill_path=_spill_path(sinks.FileSink.NAME))
+
+    # Only the latest values matter, the oldest are dropped
+    if args.local_region:
+        _pipeline.add_sink(
+            _wrap(sinks.LatestValueSink(
+                logger, args.local_region, args.local_slots,
+                args.local_slot_size, _selection.mqtt_fields)),
+            queue_size=args.queue_size,
+            policy=pipeline.DROP_OLDEST)
+
+    return _pipeline
+
+
+def log_pipeline_stats(logger, p_pipeline, elapsed):
+    """
+    Logs the readings handled by each sink, its throughput and health.
+    """
+    for _worker in p_pipeline.workers:
+        logger.info(
+            "Sink '%s': %d delivered (%.1f/s), %d dropped, %d failed, "
+            "%d pending in %.1f secs, circuit %s", _worker.sink_name,
+            _worker.delivered, _worker.delivered / elapsed if elapsed else 0,
+            _worker.dropped, _worker.failed, _worker.backlog, elapsed,
+            _worker.breaker.state)
+        if _worker.sink_stats:
+            logger.info(
+                "Sink '%s': %s", _worker.sink_name, _worker.sink_stats)
+
+
+def start_pipeline_stats(logger, p_pipeline, interval):
+    """
+    Logs the stats of the pipeline every interval seconds, since the call,
+    from a background thread. Returns the event stopping it.
+    """
+    _start = time.monotonic()
+    _stopped = threading.Event()
+
+    def _run():
+        while not _stopped.wait(interval):
+            log_pipeline_stats(logger, p_pipeline, time.monotonic() - _start)
+
+    if interval > 0:
+        threading.Thread(
+            target=_run, name='pipeline-stats', daemon=True).start()
+    return _stopped
+
+
+def build_userdata(args, logger, p_pipeline, **kwargs):
+    """
+    Creates the userdata of the tasks from the configuration. The keyword
+    arguments override the entries with the same name.
+    """
+    v_latitude, v_longitude = map(float, args.gps_location.split(','))
+    v_i2c_targets = parse_i2c_targets(args.i2c_targets, args.i2c_bus)
+
+    _userdata = {
+        'LOGGER'     : logger,
+        'LATITUDE'   : v_latitude,
+        'LONGITUDE'  : v_longitude,
+        'DEVICE'     : DEVICE_NAME,
+        'PIPELINE'   : p_pipeline,
+        'I2C_TARGETS': v_i2c_targets,
+        'I2C_TAGGED' : bool(args.i2c_targets),
+        'HKP_TIMEOUT': args.hkp_timeout,
+        'TIMESTAMP_PRECISION': args.timestamp_precision,
+        'WALL_CLOCK'   : time.time_ns,
+        'SENSOR_READER': read_htu21d,
+        'HKP_COLLECTORS': housekeeping.PARAMETER_FUNCTION_MAP,
+        'DERIVED_METRICS': select_derived_metrics(
+            args.influxdb_derived, args.mqtt_derived).metrics
+    }
+    _userdata.update(kwargs)
+
+    if 'I2C_POLLERS' not in _userdata:
+        _userdata['I2C_POLLERS'] = create_i2c_pollers(
+            _userdata['I2C_TARGETS'])
+    if 'HKP_COLLECTOR' not in _userdata:
+        _userdata['HKP_COLLECTOR'] = housekeeping.Collector(
+            _userdata['HKP_COLLECTORS'], _userdata['HKP_TIMEOUT'], logger)
+
+    return _userdata
+
+
+def simulation_userdata(source, clock):
+    """
+    Returns the userdata entries reading the values from a simulated source.
+    """
+    return {
+        'WALL_CLOCK'   : clock.time_ns,
+        'SENSOR_READER': lambda _t: source.read_htu21d(format_i2c_target(_t)),
+        'HKP_COLLECTORS': source.housekeeping_collectors()
+    }
+
+
+def task_clock(args):
+    """
+    Returns the time and delay functions of the scheduler and the userdata
+    overrides, reading from the simulated source in simulation mode.
+    """
+    if args.simulate:
+        _clock = simulation.VirtualClock(args.speed)
+        _source = simulation.create_source(args.simulate, _clock)
+        return _clock.time, _clock.sleep, simulation_userdata(_source, _clock)
+
+    return time.monotonic, time.sleep, dict()
+
+
+def create_profiler(args, logger, worker=None):
+    """
+    Returns the profiler of the tasks, if enabled. The profiler of a worker
+    process writes into its own subdirectory, named after the worker.
+    """
+    if not args.profile_dir:
+        return None
+
+    _directory = args.profile_dir
+    if worker is not None:
+        _directory = os.path.join(_directory, worker)
+
+    return profiling.Profiler(
+        _directory, logger,
+        tasks=[_t.strip() for _t in args.profile_tasks.split(',')
+               if _t.strip()],
+        every=args.profile_every,
+        tracemalloc_interval=args.tracemalloc_interval)
+
+
+WORKER_TASKS = {            # Task of each worker and its interval option
+    'htu21d': (htu21d_task, 'htu_interval'),
+    'housekeeping': (housekeeping.acquire, 'hkp_interval')
+}
+
+
+def run_worker(name, connection, heartbeat, args):
+    """
+    Runs the task of a worker process in supervised mode, sending the
+    readings to the supervisor. The heartbeat is beaten by the scheduler.
+    """
+    # The workers are stopped by the supervisor
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal_handler)
+
+    _log_listener = logging_utils.start_logging(
+        logging.INFO, rate_limit=args.log_rate_limit)
+    logger = logging.getLogger('{:s}.{:s}'.format(APPLICATION_NAME, name))
+    logger.setLevel(args.logging_level)
+
+    v_timefunc, v_delayfunc, v_overrides = task_clock(args)
+    _userdata = build_userdata(
+        args, logger, supervisor.WorkerPipeline(connection), **v_overrides)
+
+    _task, _interval = WORKER_TASKS[name]
+    _scheduler = continuous_scheduler.MainScheduler(
+        v_timefunc, heartbeat.delayfunc(v_delayfunc),
+        create_profiler(args, logger, name))
+    _scheduler.add_task(_task, 0, getattr(args, _interval), 0, _userdata)
+
+    try:
+        _scheduler.start(args.duration or None)
+    finally:
+        _userdata['HKP_COLLECTOR'].shutdown()
+        _log_listener.stop()
 
+
+def main():
     # Checks the Python Interpeter version
     if (sys.version_info < (3, 0)):
         # ###TODO: Print error message here
@@ -271,6 +878,10 @@ def main():
 
     args = configuration_parser()
 
+    # Initializes the default logger, writing from a background thread
+    _log_listener = logging_utils.start_logging(
+        logging.INFO, rate_limit=args.log_rate_limit)
+    logger = logging.getLogger(APPLICATION_NAME)
     logger.setLevel(args.logging_level)
 
     signal.signal(signal.SIGINT, signal_handler)
@@ -278,55 +889,51 @@ def main():
     logger.info("Starting {:s}".format(APPLICATION_NAME))
     logger.debug(vars(args))
 
-    v_mqtt_topic = 'DeviceStatus/' + 'EDGE'
-    v_latitude, v_longitude = map(float, args.gps_location.split(','))
-
-    v_influxdb_host = args.influxdb_host
-    v_influxdb_port = args.influxdb_port
-
-    v_influxdb_database = args.influxdb_database
-    v_influxdb_username = args.influxdb_username
-    v_influxdb_password = args.influxdb_password
-
-    _client = influxdb.InfluxDBClient(
-        host=v_influxdb_host,
-        port=v_influxdb_port,
-        username=v_influxdb_username,
-        password=v_influxdb_password,
-        database=v_influxdb_database
-    )
-
-    _dbs = _client.get_list_database()
-    if v_influxdb_database not in [_d['name'] for _d in _dbs]:
+    if args.simulate:
         logger.info(
-            "InfluxDB database '{:s}' not found. Creating a new one."
-            .format(v_influxdb_database))
-        _client.create_database(v_influxdb_database)
-
-    _client.close()
+            "Simulation from '%s' at speed %s", args.simulate, args.speed)
+    elif HTU21D is None:
+        logger.error("HTU21D sensor library not found")
+        sys.exit(-1)
 
-    _userdata = {
-        'LOGGER'     : logger,
-        'LATITUDE'   : v_latitude,
-        'LONGITUDE'  : v_longitude,
-        'MQTT_TOPIC' : v_mqtt_topic,
-        'MQTT_LOCAL_HOST'  : args.mqtt_local_host,
-        'MQTT_LOCAL_PORT'  : args.mqtt_local_port,
-        'I2C_BUS'    : args.i2c_bus,
-
-        'INFLUXDB_HOST': v_influxdb_host,
-        'INFLUXDB_PORT': v_influxdb_port,
-        'INFLUXDB_USER': v_influxdb_username,
-        'INFLUXDB_PASS': v_influxdb_password,
-        'INFLUXDB_DB'  : v_influxdb_database
-    }
+    _pipeline = build_pipeline(args, logger)
+    _pipeline.start()
 
-    _main_scheduler = continuous_scheduler.MainScheduler()
-    _main_scheduler.add_task(
-        housekeeping.acquire, 0, args.hkp_interval, 0, _userdata)
-    _main_scheduler.add_task(
-        htu21d_task, 0, args.htu_interval, 0, _userdata)
-    _main_scheduler.start()
+    _start = time.monotonic()
+    _stats = start_pipeline_stats(logger, _pipeline, args.stats_interval)
+    try:
+        if args.process_mode == SUPERVISED:
+            _supervisor = supervisor.Supervisor(
+                logger, args.heartbeat_timeout)
+            for _name in WORKER_TASKS:
+                _supervisor.add_worker(_name, run_worker, args)
+
+            # The profilers run in the workers
+            signal.signal(
+                profiling.SAMPLING_SIGNAL,
+                _supervisor.signal_workers if args.profile_dir
+                else signal.SIG_IGN)
+            _supervisor.run(_pipeline.put)
+        else:
+            v_timefunc, v_delayfunc, v_overrides = task_clock(args)
+            _userdata = build_userdata(
+                args, logger, _pipeline, **v_overrides)
+
+            _main_scheduler = continuous_scheduler.MainScheduler(
+                v_timefunc, v_delayfunc, create_profiler(args, logger))
+            _main_scheduler.add_task(
+                housekeeping.acquire, 0, args.hkp_interval, 0, _userdata)
+            _main_scheduler.add_task(
+                htu21d_task, 0, args.htu_interval, 0, _userdata)
+            try:
+                _main_scheduler.start(args.duration or None)
+            finally:
+                _userdata['HKP_COLLECTOR'].shutdown()
+    finally:
+        _stats.set()
+        _pipeline.stop()
+        log_pipeline_stats(logger, _pipeline, time.monotonic() - _start)
+        _log_listener.stop()
 
 
 if __name__ == "__main__":
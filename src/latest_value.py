@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Latest value region: a memory mapped file, e.g. in /dev/shm, holding the
+newest message of each MQTT topic (and sensor target) for the consumers on
+the same device, without going through the broker.
+
+The file starts with a header (magic, number of slots, size of a slot) and
+is followed by the slots. Each slot holds a sequence counter, the length of
+the payload and the payload, a JSON object with the name of the slot and the
+message. The counter is odd while the slot is written: a reader copies the
+slot and retries when the counter was odd or changed meanwhile (seqlock).
+
+The seqlock alone has no memory barrier, which is unsound on weakly ordered
+CPUs such as ARMv7, so each slot is also locked while written (exclusive)
+and copied (shared) with an fcntl record lock. The lock system calls order
+the memory accesses and exclude the writer of another process; the threads
+of the writer process, which the record locks do not exclude, rely on the
+seqlock under the interpreter lock.
+
+The region is created in a temporary file moved in place, so the readers of
+a previous region keep a valid mapping and reopen the path when replaced.
+
+Run as a script it prints the latest values, e.g.:
+
+    python src/latest_value.py /dev/shm/HTU21D_publisher.latest --watch 1
+"""
+
+import os
+import json
+import mmap
+import time
+import fcntl
+import struct
+import argparse
+
+MAGIC = b'LVR1'
+HEADER = struct.Struct('<4sII')     # Magic, number of slots, slot size
+SLOT_HEADER = struct.Struct('<QI4x')    # Sequence counter, payload length
+
+SLOTS = 64              # Default number of slots
+SLOT_SIZE = 4096        # Default size in bytes of a slot
+READ_RETRIES = 100      # Reads of a slot being written before giving up
+
+
+class LatestValueWriter(object):
+    """
+    Creates the region, replacing a previous one, and writes the slots. The
+    slots are allocated to the names in order of appearance, there must be
+    a single writer.
+    """
+
+    def __init__(self, path, slots=SLOTS, slot_size=SLOT_SIZE):
+        if slot_size <= SLOT_HEADER.size:
+            raise ValueError("Slot size of {:d} bytes too small".format(
+                slot_size))
+
+        self._slots = slots
+        self._slot_size = slot_size
+        self._index = dict()
+
+        # A region mapped by the readers must not be truncated under them
+        _tmp_path = '{:s}.{:d}.tmp'.format(path, os.getpid())
+        self._file = os.fdopen(os.open(
+            _tmp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o666), 'w+b')
+        try:
+            self._file.truncate(HEADER.size + slots * slot_size)
+            self._map = mmap.mmap(self._file.fileno(), 0)
+            HEADER.pack_into(self._map, 0, MAGIC, slots, slot_size)
+            os.replace(_tmp_path, path)
+        except BaseException:
+            self._file.close()
+            os.remove(_tmp_path)
+            raise
+
+    def _offset(self, name):
+        _index = self._index.get(name)
+        if _index is None:
+            if len(self._index) == self._slots:
+                raise IndexError("No free slot for '{:s}'".format(name))
+            _index = self._index[name] = len(self._index)
+        return HEADER.size + _index * self._slot_size
+
+    def write(self, name, value):
+        _payload = json.dumps({'name': name, 'value': value}).encode('utf-8')
+        if len(_payload) > self._slot_size - SLOT_HEADER.size:
+            raise ValueError(
+                "Value of '{:s}' larger than a slot ({:d} bytes)".format(
+                    name, len(_payload)))
+
+        _offset = self._offset(name)
+        _fd = self._file.fileno()
+
+        fcntl.lockf(_fd, fcntl.LOCK_EX, self._slot_size, _offset)
+        try:
+            _seq = SLOT_HEADER.unpack_from(self._map, _offset)[0]
+
+            SLOT_HEADER.pack_into(self._map, _offset, _seq + 1, 0)
+            _start = _offset + SLOT_HEADER.size
+            self._map[_start:_start + len(_payload)] = _payload
+            SLOT_HEADER.pack_into(
+                self._map, _offset, _seq + 2, len(_payload))
+        finally:
+            fcntl.lockf(_fd, fcntl.LOCK_UN, self._slot_size, _offset)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+class LatestValueReader(object):
+    """
+    Reads the slots of a region, locking each one only while copying it.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(
+                self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except BaseException:
+            self._file.close()
+            raise
+
+        _magic, self._slots, self._slot_size = HEADER.unpack_from(self._map)
+        if _magic != MAGIC:
+            self.close()
+            raise ValueError("Not a latest value region '{:s}'".format(path))
+
+    @property
+    def replaced(self):
+        """
+        Whether the region was replaced by a new writer, or removed.
+        """
+        try:
+            return not os.path.samestat(
+                os.stat(self._path), os.fstat(self._file.fileno()))
+        except FileNotFoundError:
+            return True
+
+    def _read_slot(self, index):
+        _offset = HEADER.size + index * self._slot_size
+        _start = _offset + SLOT_HEADER.size
+
+        _fd = self._file.fileno()
+
+        for _i in range(READ_RETRIES):
+            fcntl.lockf(_fd, fcntl.LOCK_SH, self._slot_size, _offset)
+            try:
+                _seq, _length = SLOT_HEADER.unpack_from(self._map, _offset)
+                if not _seq % 2:
+                    _payload = self._map[_start:_start + _length]
+                    if SLOT_HEADER.unpack_from(
+                            self._map, _offset)[0] == _seq:
+                        return _seq, _payload
+            finally:
+                fcntl.lockf(_fd, fcntl.LOCK_UN, self._slot_size, _offset)
+
+            # Gives the writer, possibly a thread of this process, the time
+            # to complete the write
+            time.sleep(0)
+
+        raise TimeoutError("Slot {:d} is being written".format(index))
+
+    def read(self):
+        """
+        Returns the latest value of each name and the number of its updates.
+        """
+        _values = dict()
+
+        for _index in range(self._slots):
+            _seq, _payload = self._read_slot(_index)
+            if not _seq:
+                break
+            _slot = json.loads(_payload)
+            _values[_slot['name']] = (_seq // 2, _slot['value'])
+
+        return _values
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Print the values of a latest value region.')
+    parser.add_argument('path', help='file of the region')
+    parser.add_argument(
+        '--watch', dest='watch', action='store', type=float, metavar='SECS',
+        help='print the updated values every SECS seconds')
+    args = parser.parse_args()
+
+    _reader = LatestValueReader(args.path)
+    _last = dict()
+
+    try:
+        while True:
+            if _reader.replaced and os.path.exists(args.path):
+                _reader.close()
+                _reader = LatestValueReader(args.path)
+                _last.clear()
+
+            for _name, (_seq, _value) in sorted(_reader.read().items()):
+                if _last.get(_name) != _seq:
+                    _last[_name] = _seq
+                    print(_name, json.dumps(_value), flush=True)
+            if not args.watch:
+                break
+            time.sleep(args.watch)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        _reader.close()
+
+
+if __name__ == "__main__":
+    main()
+
+# vim:ts=4:expandtab
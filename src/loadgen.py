@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Load generator: runs a fleet of virtual edge devices in one process, each one
+with its own location, topic and jittered schedule, through the same tasks and
+sinks of the handler, and reports the throughput and end-to-end latency of
+each sink.
+
+The options after '--' are passed to the handler, e.g.:
+
+    python src/loadgen.py --devices 1000 --duration 60 -- --mqtt-host broker
+"""
+
+import sys
+import time
+import random
+import signal
+import logging
+import argparse
+import threading
+import concurrent.futures
+
+import continuous_scheduler
+import housekeeping
+import htu21d_publisher
+import logging_utils
+import pipeline
+import simulation
+import stats_utils
+
+APPLICATION_NAME = 'HTU21D_loadgen'
+
+DEVICES = 10            # Default number of virtual devices
+DURATION = 60           # Default seconds of load
+JITTER = 0.05           # Default relative jitter of the periods
+SPREAD = 0.5            # Degrees of the area around the GPS location
+REPORT_INTERVAL = 10    # Seconds between two reports
+
+
+class MeteredSink(object):
+    """
+    Wraps a sink counting the readings written and measuring their
+    end-to-end latency, from the acquisition to the end of the write.
+    """
+
+    def __init__(self, sink, precision):
+        self.NAME = sink.NAME
+        self._sink = sink
+        self._ticks = pipeline.TIMESTAMP_PRECISIONS[precision][0]
+        self._lock = threading.Lock()
+
+        self.written = 0
+        self.latencies = list()
+
+    def write(self, readings, backlog=0):
+        self._sink.write(readings, backlog)
+
+        _now = time.time_ns() / 10 ** 9
+        with self._lock:
+            self.written += len(readings)
+            self.latencies.extend(
+                _now - _r.timestamp / self._ticks for _r in readings)
+
+    @property
+    def stats(self):
+        return getattr(self._sink, 'stats', None)
+
+    def close(self):
+        self._sink.close()
+
+    def collect(self):
+        """
+        Returns and resets the readings written and their latencies.
+        """
+        with self._lock:
+            _written, self.written = self.written, 0
+            _latencies, self.latencies = self.latencies, list()
+        return _written, _latencies
+
+
+def report(logger, metered, elapsed):
+    for _sink in metered:
+        _written, _latencies = _sink.collect()
+        logger.info(
+            "Sink '%s': %d readings (%.1f/s), latency p50 %.1f ms, "
+            "p95 %.1f ms, p99 %.1f ms", _sink.NAME, _written,
+            _written / elapsed if elapsed else 0,
+            stats_utils.percentile(_latencies, 0.50) * 1000,
+            stats_utils.percentile(_latencies, 0.95) * 1000,
+            stats_utils.percentile(_latencies, 0.99) * 1000)
+
+
+def fleet_userdata(v_handler, logger, p_pipeline, devices, executor,
+                   rng=random):
+    """
+    Returns the userdata of each virtual device, with its own name, location,
+    synthetic source and housekeeping collector (on the given executor).
+    The sources follow the real time, the rest is shared by the fleet, e.g.
+    the pollers of the simulated sensors.
+    """
+    _clock = simulation.RealClock()
+    _latitude, _longitude = map(float, v_handler.gps_location.split(','))
+
+    # The collectors are created for each device below
+    _shared = htu21d_publisher.build_userdata(
+        v_handler, logger, p_pipeline, HKP_COLLECTOR=None)
+
+    _fleet = list()
+    for _i in range(devices):
+        _userdata = dict(_shared, **htu21d_publisher.simulation_userdata(
+            simulation.SyntheticSource(_clock), _clock))
+        _userdata.update(
+            DEVICE='EDGE{:05d}'.format(_i),
+            LATITUDE=_latitude + rng.uniform(-SPREAD, SPREAD),
+            LONGITUDE=_longitude + rng.uniform(-SPREAD, SPREAD),
+            HKP_COLLECTOR=housekeeping.Collector(
+                _userdata['HKP_COLLECTORS'], v_handler.hkp_timeout, logger,
+                executor=executor))
+        _fleet.append(_userdata)
+
+    return _fleet
+
+
+def configuration_parser(p_args=None):
+    parser = argparse.ArgumentParser(
+        description=(
+            'Run a fleet of virtual edge devices against the configured '
+            'MQTT broker and InfluxDB. The options after \'--\' are passed '
+            'to the handler.'),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument(
+        '--devices', dest='devices', action='store',
+        type=int, default=DEVICES,
+        help='number of virtual devices (default: {})'.format(DEVICES))
+    parser.add_argument(
+        '--duration', dest='duration', action='store',
+        type=float, default=DURATION,
+        help='seconds of load (default: {})'.format(DURATION))
+    parser.add_argument(
+        '--jitter', dest='jitter', action='store',
+        type=float, default=JITTER,
+        help='relative jitter of the periods of each device (default: {})'
+             .format(JITTER))
+    parser.add_argument(
+        '--report-interval', dest='report_interval', action='store',
+        type=float, default=REPORT_INTERVAL,
+        help='seconds between two reports (default: {})'
+             .format(REPORT_INTERVAL))
+    parser.add_argument(
+        'handler_args', nargs=argparse.REMAINDER,
+        help='options of the handler')
+
+    args = parser.parse_args(p_args)
+
+    # Microseconds timestamps for the latency and a MQTT session of its own,
+    # unless set otherwise
+    _handler_args = [_a for _a in args.handler_args if _a != '--']
+    args.handler = htu21d_publisher.configuration_parser(
+        ['--timestamp-precision', 'us', '--mqtt-client-id', APPLICATION_NAME]
+        + _handler_args)
+
+    return args
+
+
+def main():
+    args = configuration_parser()
+    v_handler = args.handler
+
+    _log_listener = logging_utils.start_logging(
+        logging.INFO, rate_limit=v_handler.log_rate_limit)
+    logger = logging.getLogger(APPLICATION_NAME)
+    logger.setLevel(v_handler.logging_level)
+
+    signal.signal(signal.SIGINT, htu21d_publisher.signal_handler)
+
+    logger.info(
+        "Starting %d virtual devices for %s secs", args.devices,
+        args.duration)
+
+    _metered = list()
+
+    def _wrapper(sink):
+        _metered.append(MeteredSink(sink, v_handler.timestamp_precision))
+        return _metered[-1]
+
+    _pipeline = htu21d_publisher.build_pipeline(
+        v_handler, logger, device_tag=True, wrapper=_wrapper)
+    _pipeline.start()
+
+    _random = random.Random()
+    _main_scheduler = continuous_scheduler.MainScheduler()
+
+    # Each device has its own housekeeping collector, i.e. its own pending
+    # runs and last values, on a pool of threads shared by all of them
+    _hkp_executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=len(housekeeping.PARAMETER_FUNCTION_MAP),
+        thread_name_prefix='housekeeping')
+    _fleet = fleet_userdata(
+        v_handler, logger, _pipeline, args.devices, _hkp_executor, _random)
+
+    for _userdata in _fleet:
+        for _task, _interval in [
+                (housekeeping.acquire, v_handler.hkp_interval),
+                (htu21d_publisher.htu21d_task, v_handler.htu_interval)]:
+            _main_scheduler.add_task(
+                _task, _random.uniform(0, _interval),
+                _interval * (1 + _random.uniform(-args.jitter, args.jitter)),
+                0, _userdata)
+
+    _last = [time.monotonic()]
+
+    def _report():
+        _now = time.monotonic()
+        report(logger, _metered, _now - _last[0])
+        _last[0] = _now
+
+    _main_scheduler.add_task(
+        _report, args.report_interval, args.report_interval, 1)
+
+    _start = time.monotonic()
+    _stats = htu21d_publisher.start_pipeline_stats(
+        logger, _pipeline, v_handler.stats_interval)
+    try:
+        _main_scheduler.start(args.duration)
+    finally:
+        _stats.set()
+        for _userdata in _fleet:
+            _userdata['HKP_COLLECTOR'].shutdown()
+        _hkp_executor.shutdown(wait=False)
+        _pipeline.stop()
+        _report()
+        htu21d_publisher.log_pipeline_stats(
+            logger, _pipeline, time.monotonic() - _start)
+        _log_listener.stop()
+
+
+if __name__ == "__main__":
+    main()
+
+# vim:ts=4:expandtab
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import time
+import queue
+import logging
+import threading
+import logging.handlers
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+RATE_LIMIT_INTERVAL = 60    # Seconds a repeated message is suppressed for
+RATE_LIMIT_ENTRIES = 1000   # Distinct messages tracked before pruning
+FLUSH_INTERVAL = 1          # Max seconds between two checks of the windows
+
+REPEATED_MESSAGE = "%s (repeated %d times in the last %d secs)"
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through the first occurrence of a message of the given level or
+    above and suppresses its repetitions for the given interval. The first
+    occurrence after the interval reports how many were suppressed, or
+    flush() does when there is none.
+    """
+
+    def __init__(self, interval=RATE_LIMIT_INTERVAL, level=logging.WARNING):
+        super().__init__()
+        self.interval = interval
+        self._level = level
+        self._seen = dict()
+        self._lock = threading.Lock()
+
+    def _prune(self, now):
+        for _key in [_k for _k, (_t, _n) in self._seen.items()
+                     if now - _t >= self.interval]:
+            del self._seen[_key]
+
+    def filter(self, record):
+        if record.levelno < self._level or self.interval <= 0:
+            return True
+
+        _key = (record.name, record.levelno, record.getMessage())
+        _now = time.monotonic()
+
+        with self._lock:
+            _entry = self._seen.get(_key)
+            if _entry is not None and _now - _entry[0] < self.interval:
+                _entry[1] += 1
+                return False
+
+            if len(self._seen) >= RATE_LIMIT_ENTRIES:
+                self._prune(_now)
+
+            _suppressed = _entry[1] if _entry is not None else 0
+            self._seen[_key] = [_now, 0]
+
+        if _suppressed:
+            record.msg = REPEATED_MESSAGE
+            record.args = (_key[2], _suppressed, _now - _entry[0])
+
+        return True
+
+    def flush(self, force=False):
+        """
+        Forgets the messages whose interval has expired, or all of them when
+        forced, e.g. on exit. Returns the records reporting how many times
+        each one was suppressed meanwhile.
+        """
+        _now = time.monotonic()
+        _records = list()
+
+        with self._lock:
+            for _key, (_time, _suppressed) in list(self._seen.items()):
+                if not force and _now - _time < self.interval:
+                    continue
+                del self._seen[_key]
+
+                if _suppressed:
+                    _records.append(logging.makeLogRecord({
+                        'name': _key[0],
+                        'levelno': _key[1],
+                        'levelname': logging.getLevelName(_key[1]),
+                        'msg': REPEATED_MESSAGE,
+                        'args': (_key[2], _suppressed, _now - _time)}))
+
+        return _records
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues the records as they are: the message is merged with its arguments
+    and formatted by the handlers of the listener, in its thread. The
+    arguments must not be changed once logged.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class LogListener(logging.handlers.QueueListener):
+    """
+    Writes the records of the queue handler from a background thread and
+    reports the repetitions suppressed by its rate limit filter once their
+    interval expires, and on stop.
+    """
+
+    def __init__(self, queue, queue_handler, rate_limit, *handlers):
+        super().__init__(queue, *handlers)
+        self._queue_handler = queue_handler
+        self._rate_limit = rate_limit
+        self._stopped = threading.Event()
+        self._flusher = None
+
+    def _flush(self, force=False):
+        # Straight to the queue, the reports are not rate limited
+        for _record in self._rate_limit.flush(force):
+            self._queue_handler.emit(_record)
+
+    def _run_flusher(self):
+        _interval = min(self._rate_limit.interval, FLUSH_INTERVAL)
+        while not self._stopped.wait(_interval):
+            self._flush()
+
+    def start(self):
+        super().start()
+        if self._rate_limit.interval > 0:
+            self._stopped.clear()
+            self._flusher = threading.Thread(
+                target=self._run_flusher, name='log-flusher', daemon=True)
+            self._flusher.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        self._flush(force=True)
+        super().stop()
+
+
+def start_logging(level, rate_limit=RATE_LIMIT_INTERVAL):
+    """
+    Configures the root logger to hand the records to a background thread,
+    which formats and writes them, so the tasks never wait for the log
+    output. Repeated messages of level
+    WARNING and above are rate limited. Returns the listener to stop on exit,
+    which reports the repetitions still suppressed.
+    """
+    _queue = queue.SimpleQueue()
+
+    _handler = LazyQueueHandler(_queue)
+    _rate_limit = RateLimitFilter(rate_limit)
+    _handler.addFilter(_rate_limit)
+
+    _stream = logging.StreamHandler()
+    _stream.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    logging.basicConfig(level=level, handlers=[_handler])
+
+    _listener = LogListener(_queue, _handler, _rate_limit, _stream)
+    _listener.start()
+
+    return _listener
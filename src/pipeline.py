@@ -0,0 +1,478 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import os
+import json
+import time
+import shutil
+import datetime
+import threading
+import collections
+
+import records
+
+QUEUE_SIZE = 1000   # Default number of readings buffered for each sink
+BATCH_SIZE = 100    # Number of readings handed to a sink at once
+MAX_BATCH_SIZE = 1000   # Max number of readings of a batch grown by backlog
+RETRY_INTERVAL = 5  # Seconds before retrying a failed delivery
+BREAKER_THRESHOLD = 3       # Consecutive failures opening the circuit
+BREAKER_MAX_BACKOFF = 300   # Max seconds between two probes of a dead sink
+
+DROP_OLDEST = 'drop-oldest'
+BLOCK = 'block'
+SPILL = 'spill'
+
+OVERFLOW_POLICIES = [DROP_OLDEST, BLOCK, SPILL]
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+# Resolution of the timestamps: ticks per second and ISO format timespec
+TIMESTAMP_PRECISIONS = {
+    's': (1, 'seconds'),
+    'ms': (10 ** 3, 'milliseconds'),
+    'us': (10 ** 6, 'microseconds'),
+    'ns': (10 ** 9, 'microseconds')
+}
+
+# InfluxDB time precision matching each timestamp precision
+INFLUXDB_PRECISIONS = {'s': 's', 'ms': 'ms', 'us': 'u', 'ns': 'n'}
+
+
+def wall_clock(precision='s', time_ns=time.time_ns):
+    """
+    Returns the current wall clock time as an integer timestamp in the given
+    precision and as a date in ISO format.
+    """
+    _ns = time_ns()
+    _ticks, _timespec = TIMESTAMP_PRECISIONS[precision]
+
+    _date = datetime.datetime.fromtimestamp(
+        _ns // 10 ** 9, tz=datetime.timezone.utc).replace(
+            microsecond=(_ns // 10 ** 3) % 10 ** 6)
+
+    return _ns // (10 ** 9 // _ticks), _date.isoformat(timespec=_timespec)
+
+
+def convert_timestamp(timestamp, precision, to):
+    """
+    Converts an integer timestamp from a precision to another one.
+    """
+    return (
+        timestamp * TIMESTAMP_PRECISIONS[to][0] //
+        TIMESTAMP_PRECISIONS[precision][0])
+
+
+def dump_reading(reading, precision):
+    """
+    Returns the JSON form of a reading, with the precision of its timestamp.
+    """
+    return json.dumps(reading.as_dict(precision))
+
+
+def load_reading(line, precision):
+    """
+    Creates a reading from its JSON form, with the timestamp converted to the
+    given precision. A reading without precision, written by a release not
+    storing it, is taken as already in the given one.
+    """
+    _dict = json.loads(line)
+    _reading = records.from_dict(_dict)
+
+    _precision = _dict.get('precision') or precision
+    if _precision != precision and _reading.timestamp is not None:
+        _reading.timestamp = convert_timestamp(
+            _reading.timestamp, _precision, precision)
+
+    return _reading
+
+
+class RejectedError(Exception):
+    """
+    Raised by a sink refusing the readings themselves, e.g. malformed, so
+    their delivery would fail again however many times retried.
+    """
+
+
+class SpillFile(object):
+    """
+    Append only file of readings, stored as JSON lines, used when a sink
+    queue overflows and read back when the sink catches up. The timestamps
+    are read back in the given precision, whatever the one they were stored
+    with, e.g. by a previous run.
+    """
+
+    def __init__(self, path, precision='s'):
+        self._path = path
+        self._precision = precision
+        self._offset = 0
+        self._pending = 0
+
+        if os.path.exists(self._path):
+            with open(self._path, 'r') as _f:
+                self._pending = sum(1 for _l in _f)
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def append(self, reading):
+        with open(self._path, 'a') as _f:
+            _f.write(dump_reading(reading, self._precision) + '\n')
+        self._pending += 1
+
+    def read(self, count):
+        _readings = list()
+
+        with open(self._path, 'r') as _f:
+            _f.seek(self._offset)
+            while len(_readings) < count:
+                _line = _f.readline()
+                if not _line:
+                    break
+                _readings.append(load_reading(_line, self._precision))
+            self._offset = _f.tell()
+
+        self._pending -= len(_readings)
+        if self._pending == 0:
+            os.remove(self._path)
+            self._offset = 0
+
+        return _readings
+
+    def restore(self, readings):
+        """
+        Puts the readings back in front of the ones still to be read, e.g.
+        the ones taken from the file but not delivered on exit.
+        """
+        if not readings:
+            return
+
+        with open(self._path + '.tmp', 'w') as _out:
+            for _reading in readings:
+                _out.write(dump_reading(_reading, self._precision) + '\n')
+            if self._pending:
+                with open(self._path, 'r') as _f:
+                    _f.seek(self._offset)
+                    shutil.copyfileobj(_f, _out)
+        os.replace(self._path + '.tmp', self._path)
+
+        self._offset = 0
+        self._pending += len(readings)
+
+
+class CircuitBreaker(object):
+    """
+    Health of a sink. A failed delivery is retried after the retry interval
+    until threshold consecutive failures open the circuit: the deliveries
+    are then suspended for a backoff, doubling at each further failure up
+    to max_backoff. Once the backoff has elapsed the circuit is half open,
+    the next delivery probes the sink and closes the circuit on success.
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD,
+                 retry_interval=RETRY_INTERVAL,
+                 max_backoff=BREAKER_MAX_BACKOFF, clock=time.monotonic):
+        self._threshold = threshold
+        self._retry_interval = retry_interval
+        self._max_backoff = max_backoff
+        self._clock = clock
+        self._retry_at = 0
+
+        self.failures = 0
+
+    @property
+    def state(self):
+        if self.failures < self._threshold:
+            return CLOSED
+        if self._clock() < self._retry_at:
+            return OPEN
+        return HALF_OPEN
+
+    def failure(self):
+        """
+        Records a failed delivery, returns the seconds before the next one.
+        """
+        self.failures += 1
+
+        _delay = self._retry_interval
+        if self.failures >= self._threshold:
+            _delay = min(
+                _delay * 2 ** (self.failures - self._threshold),
+                self._max_backoff)
+
+        self._retry_at = self._clock() + _delay
+        return _delay
+
+    def success(self):
+        """
+        Records a successful delivery, returns whether it closed the circuit.
+        """
+        _was_open = self.failures >= self._threshold
+        self.failures = 0
+        return _was_open
+
+
+class SinkWorker(threading.Thread):
+    """
+    Delivers the readings to a sink from its own thread, buffering them in a
+    bounded queue. When the queue is full, the readings are handled
+    according to the overflow policy:
+        * DROP_OLDEST: the oldest reading in the queue is discarded;
+        * BLOCK: the producer waits until there is room in the queue;
+        * SPILL: the readings are appended to a spill file and queued again
+        when the sink catches up.
+
+    A batch whose delivery fails is put back in front of the queue and
+    retried as scheduled by the circuit breaker of the sink, so the readings
+    accumulate while the sink is unavailable and are delivered as a backlog
+    when it comes back. The batches start at batch_size readings and, while
+    the sink is behind, double at each full batch delivered up to
+    max_batch_size, so a backlog is delivered in fewer and larger writes.
+    Each batch is written with the backlog it was taken from, i.e. the
+    readings of the batch and the ones left behind.
+    A batch rejected by the sink (RejectedError) is not
+    retried, so it cannot hold back the newer readings, and is counted as
+    failed. Once stopped, the remaining readings are not delivered to a sink
+    whose circuit is open, nor is a failed batch retried: they are counted
+    as failed or, with the SPILL policy, saved in front of the spill file
+    along with the queued ones, for the next run. Once stopped, the spill
+    file is no longer read back.
+    """
+
+    def __init__(self, sink, logger, queue_size=QUEUE_SIZE,
+                 policy=DROP_OLDEST, spill_path=None, batch_size=BATCH_SIZE,
+                 max_batch_size=MAX_BATCH_SIZE, precision='s',
+                 retry_interval=RETRY_INTERVAL,
+                 breaker_threshold=BREAKER_THRESHOLD,
+                 max_backoff=BREAKER_MAX_BACKOFF):
+        super().__init__(name='sink-{:s}'.format(sink.NAME), daemon=True)
+
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(
+                "Unknown overflow policy '{:s}'".format(policy))
+        if policy == SPILL and spill_path is None:
+            raise ValueError("Spill policy requires a spill file")
+
+        self._sink = sink
+        self._logger = logger
+        self._queue_size = queue_size
+        self._policy = policy
+        self._batch_size = batch_size
+        self._max_batch_size = max(batch_size, max_batch_size)
+        self._batch_limit = batch_size
+
+        self.breaker = CircuitBreaker(
+            breaker_threshold, retry_interval, max_backoff)
+
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._running = True
+
+        self._spill = None
+        if policy == SPILL:
+            self._spill = SpillFile(spill_path, precision)
+
+        self.delivered = 0
+        self.dropped = 0
+        self.failed = 0
+
+    @property
+    def sink_name(self):
+        return self._sink.NAME
+
+    @property
+    def sink_stats(self):
+        """
+        Counters kept by the sink itself, if any, e.g. the points sent and
+        dropped by a fire and forget sink, as a message.
+        """
+        return getattr(self._sink, 'stats', None)
+
+    @property
+    def backlog(self):
+        _backlog = len(self._queue)
+        if self._spill is not None:
+            _backlog += self._spill.pending
+        return _backlog
+
+    def put(self, reading):
+        with self._cond:
+            if self._policy == BLOCK:
+                while len(self._queue) >= self._queue_size and self._running:
+                    self._cond.wait()
+            elif self._policy == SPILL:
+                # Once spilling, keep on until the spill file is drained to
+                # preserve the order of the readings
+                if (self._spill.pending or
+                        len(self._queue) >= self._queue_size):
+                    self._spill.append(reading)
+                    return
+            elif len(self._queue) >= self._queue_size:
+                self._queue.popleft()
+                self.dropped += 1
+
+            self._queue.append(reading)
+            self._cond.notify_all()
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue and self._running:
+                if self._spill is not None and self._spill.pending:
+                    self._queue.extend(self._spill.read(self._queue_size))
+                else:
+                    self._cond.wait()
+
+            _batch = list()
+            while self._queue and len(_batch) < self._batch_limit:
+                _batch.append(self._queue.popleft())
+            self._cond.notify_all()
+
+        return _batch
+
+    def run(self):
+        while True:
+            # An empty batch is returned only when stopped and the queue is
+            # drained, the spill file is left to the next run
+            _batch = self._next_batch()
+            if not _batch:
+                break
+
+            # A dead sink is not waited for on exit
+            if not self._running and self.breaker.state == OPEN:
+                self._undelivered(_batch)
+                continue
+
+            try:
+                self._sink.write(_batch, len(_batch) + self.backlog)
+                self.delivered += len(_batch)
+                self._grow(len(_batch))
+            except RejectedError as ex:
+                self._logger.error(
+                    "Sink '%s': %d readings rejected, %s", self._sink.NAME,
+                    len(_batch), ex)
+                with self._cond:
+                    self.failed += len(_batch)
+            except Exception as ex:
+                self._logger.error("Sink '%s': %s", self._sink.NAME, ex)
+                self._retry(_batch)
+            else:
+                if self.breaker.success():
+                    self._logger.info(
+                        "Sink '%s': circuit closed", self._sink.NAME)
+
+        try:
+            self._sink.close()
+        except Exception as ex:
+            self._logger.error(ex)
+
+    def _grow(self, delivered):
+        """
+        Doubles the batch limit after a full batch while readings are left
+        behind, resets it once the sink has caught up.
+        """
+        if delivered == self._batch_limit and self.backlog:
+            self._batch_limit = min(
+                self._batch_limit * 2, self._max_batch_size)
+        elif delivered < self._batch_limit:
+            self._batch_limit = self._batch_size
+
+    def _retry(self, batch):
+        self._batch_limit = self._batch_size
+        _delay = self.breaker.failure()
+        if self.breaker.state == OPEN:
+            self._logger.warning(
+                "Sink '%s': circuit open after %d failures, next attempt in "
+                "%.1f secs", self._sink.NAME, self.breaker.failures, _delay)
+
+        with self._cond:
+            if not self._running:
+                self._undelivered(batch)
+                return
+
+            self._queue.extendleft(reversed(batch))
+            if self._policy == DROP_OLDEST:
+                while len(self._queue) > self._queue_size:
+                    self._queue.popleft()
+                    self.dropped += 1
+
+            # Producers notify on every reading, waits the whole delay
+            _deadline = time.monotonic() + _delay
+            while self._running:
+                _remaining = _deadline - time.monotonic()
+                if _remaining <= 0:
+                    break
+                self._cond.wait(_remaining)
+
+    def _undelivered(self, batch):
+        """
+        Counts a batch not delivered on exit as failed or, with the SPILL
+        policy, saves it in front of the spill file with the queued readings.
+        """
+        with self._cond:
+            if self._spill is None:
+                self.failed += len(batch)
+                return
+
+            self._spill.restore(list(batch) + list(self._queue))
+            self._queue.clear()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+
+class Pipeline(object):
+    """
+    Dispatches the readings produced by the tasks to the workers of the
+    sinks, decoupling acquisition from delivery. A sink added with a set of
+    kinds only receives the readings of those kinds.
+    """
+
+    def __init__(self, logger):
+        self._logger = logger
+        self._workers = list()
+        self._kinds = list()
+
+    @property
+    def workers(self):
+        return list(self._workers)
+
+    def add_sink(self, sink, kinds=None, **kwargs):
+        _worker = SinkWorker(sink, self._logger, **kwargs)
+        self._workers.append(_worker)
+        self._kinds.append(None if kinds is None else frozenset(kinds))
+        return _worker
+
+    def put(self, reading):
+        for _worker, _kinds in zip(self._workers, self._kinds):
+            if _kinds is None or reading.KIND in _kinds:
+                _worker.put(reading)
+
+    def start(self):
+        for _worker in self._workers:
+            _worker.start()
+
+    def stop(self, timeout=None):
+        for _worker in self._workers:
+            _worker.stop()
+        for _worker in self._workers:
+            _worker.join(timeout)
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import os
+import sys
+import time
+import signal
+import cProfile
+import functools
+import threading
+import tracemalloc
+import collections
+
+PROFILE_EVERY = 100         # Runs of a task between two stats dumps
+SAMPLING_INTERVAL = 0.01    # Seconds between two stack samples
+SAMPLING_SIGNAL = signal.SIGUSR1    # Signal toggling the sampling profiler
+TRACEMALLOC_FRAMES = 10     # Frames stored for each memory allocation
+TRACEMALLOC_TOP = 10        # Allocation differences logged at each snapshot
+TRACEMALLOC_KEEP = 5        # Latest snapshot files kept in the directory
+
+
+class TaskProfiler(object):
+    """
+    Runs a task under cProfile, accumulating the stats of all the runs and
+    dumping them every given number of runs.
+    """
+
+    def __init__(self, task, directory, every, logger):
+        self._task = task
+        self._path = os.path.join(
+            directory, '{:s}.prof'.format(task.__name__))
+        self._every = every
+        self._logger = logger
+        self._profile = cProfile.Profile()
+        self._runs = 0
+
+        functools.update_wrapper(self, task)
+
+    def __call__(self, *args, **kwargs):
+        try:
+            return self._profile.runcall(self._task, *args, **kwargs)
+        finally:
+            self._runs += 1
+            if self._runs % self._every == 0:
+                self._profile.dump_stats(self._path)
+                self._logger.info(
+                    "Profile of %d runs written to '%s'", self._runs,
+                    self._path)
+
+
+class SamplingProfiler(object):
+    """
+    Samples the stacks of all the threads, or of the given one, at a fixed
+    interval from a background thread, counting the collapsed stacks (the
+    input format of flamegraph.pl) under the name of their thread. Low
+    overhead, it can be left running on field devices.
+    """
+
+    def __init__(self, directory, logger, interval=SAMPLING_INTERVAL):
+        self._directory = directory
+        self._logger = logger
+        self._interval = interval
+        self._thread = None
+        self._running = threading.Event()
+        self._samples = collections.Counter()
+
+    @property
+    def running(self):
+        return self._running.is_set()
+
+    def _sample(self, thread_id):
+        _own = threading.get_ident()
+
+        while self._running.is_set():
+            _names = {_t.ident: _t.name for _t in threading.enumerate()}
+            _frames = sys._current_frames()
+            if thread_id is not None:
+                if thread_id not in _frames:
+                    break
+                _frames = {thread_id: _frames[thread_id]}
+
+            for _ident, _frame in _frames.items():
+                if _ident == _own:
+                    continue
+
+                _stack = list()
+                while _frame is not None:
+                    _code = _frame.f_code
+                    _stack.append('{:s}:{:s}:{:d}'.format(
+                        os.path.basename(_code.co_filename), _code.co_name,
+                        _frame.f_lineno))
+                    _frame = _frame.f_back
+                _stack.append(_names.get(_ident, str(_ident)))
+                self._samples[';'.join(reversed(_stack))] += 1
+
+            time.sleep(self._interval)
+
+    def start(self, thread_id=None):
+        if self.running:
+            return
+
+        self._samples.clear()
+        self._running.set()
+        self._thread = threading.Thread(
+            target=self._sample, args=(thread_id,), name='sampler',
+            daemon=True)
+        self._thread.start()
+        self._logger.info("Sampling profiler started")
+
+    def stop(self):
+        if not self.running:
+            return
+
+        self._running.clear()
+        self._thread.join()
+
+        _path = os.path.join(
+            self._directory,
+            'samples-{:s}.txt'.format(time.strftime('%Y%m%d-%H%M%S')))
+        with open(_path, 'w') as _f:
+            for _stack, _count in self._samples.most_common():
+                _f.write('{:s} {:d}\n'.format(_stack, _count))
+
+        self._logger.info(
+            "Sampling profiler stopped, %d samples written to '%s'",
+            sum(self._samples.values()), _path)
+
+    def toggle(self, *args):
+        # Called from the signal handler: the file is written by a thread
+        if self.running:
+            threading.Thread(target=self.stop, daemon=True).start()
+        else:
+            self.start()
+
+
+class MemoryTracker(object):
+    """
+    Takes periodic tracemalloc snapshots, dumping them and logging the
+    allocations that grew the most since the previous one. Only the latest
+    keep snapshot files of the process are left in the directory: the files
+    are named after its pid, so the processes sharing a directory do not
+    overwrite nor prune each other's snapshots.
+    """
+
+    def __init__(self, directory, logger, keep=TRACEMALLOC_KEEP):
+        self._directory = directory
+        self._logger = logger
+        self._keep = keep
+        self._pid = os.getpid()
+        self._previous = None
+        self._count = 0
+
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+
+    def _path(self, count):
+        return os.path.join(
+            self._directory,
+            'tracemalloc-{:d}-{:04d}.snap'.format(self._pid, count))
+
+    def snapshot(self):
+        _snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__)])
+
+        self._count += 1
+        _path = self._path(self._count)
+        _snapshot.dump(_path)
+
+        if self._count > self._keep:
+            try:
+                os.remove(self._path(self._count - self._keep))
+            except FileNotFoundError:
+                pass
+
+        _current, _peak = tracemalloc.get_traced_memory()
+        self._logger.info(
+            "Traced memory %d KiB (peak %d KiB), snapshot '%s'",
+            _current // 1024, _peak // 1024, _path)
+
+        if self._previous is not None:
+            for _stat in _snapshot.compare_to(
+                    self._previous, 'lineno')[:TRACEMALLOC_TOP]:
+                self._logger.info("Memory growth: %s", _stat)
+
+        self._previous = _snapshot
+
+
+class Profiler(object):
+    """
+    Opt-in profiling of the scheduled tasks, writing into a directory:
+        * the selected tasks (all when none) run under cProfile and their
+        accumulated stats are dumped every given number of runs;
+        * with a tracemalloc interval, memory snapshots are taken
+        periodically;
+        * the sampling profiler of all the threads is toggled at runtime by
+        SAMPLING_SIGNAL.
+    """
+
+    def __init__(self, directory, logger, tasks=None, every=PROFILE_EVERY,
+                 tracemalloc_interval=0):
+        os.makedirs(directory, exist_ok=True)
+
+        self._directory = directory
+        self._logger = logger
+        self._tasks = tasks
+        self._every = every
+
+        self.tracemalloc_interval = tracemalloc_interval
+        self.memory = None
+        if tracemalloc_interval:
+            self.memory = MemoryTracker(directory, logger)
+
+        self.sampler = SamplingProfiler(directory, logger)
+
+    def install_signal(self):
+        signal.signal(SAMPLING_SIGNAL, self.sampler.toggle)
+
+    def wrap(self, task):
+        if not self._every:
+            return task
+        if self._tasks and task.__name__ not in self._tasks:
+            return task
+        return TaskProfiler(task, self._directory, self._every, self._logger)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import operator
+
+RECORD_TYPES = dict()   # Record class of each kind, filled by the subclasses
+
+_NO_TAGS = dict()
+
+
+def _getter(fields):
+    """
+    Returns a function extracting the values of the given fields as a tuple.
+    """
+    if len(fields) == 1:
+        _get = operator.attrgetter(fields[0])
+        return lambda _r: (_get(_r),)
+    if not fields:
+        return lambda _r: ()
+    return operator.attrgetter(*fields)
+
+
+class Record(object):
+    """
+    Reading with a fixed layout: the values are stored in the slots listed in
+    FIELDS, which every subclass must also declare as __slots__ and which
+    include 'timestamp', so no dictionary is built while the record goes
+    through the pipeline.
+
+    The subclasses also declare how each sink serializes them, the getters of
+    the field values of each sink are computed once for the class:
+        * KIND: name of the kind of reading;
+        * INFLUXDB_MEASUREMENT, INFLUXDB_TAGS and INFLUXDB_FIELDS;
+        * MQTT_TOPIC (formatted with the device name) and MQTT_FIELDS, of
+        which the MQTT_OPTIONAL ones are left out when None.
+    The sinks can be given other fields by the configuration, see
+    SinkFields.
+    """
+    __slots__ = ('device', 'tags')
+
+    KIND = None
+    FIELDS = ()
+
+    INFLUXDB_MEASUREMENT = None
+    INFLUXDB_TAGS = _NO_TAGS
+    INFLUXDB_FIELDS = ()
+
+    MQTT_TOPIC = None
+    MQTT_FIELDS = ()
+    MQTT_OPTIONAL = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+
+        cls.get_values = staticmethod(_getter(cls.FIELDS))
+        cls.get_influxdb_values = staticmethod(_getter(cls.INFLUXDB_FIELDS))
+        cls.get_mqtt_values = staticmethod(_getter(cls.MQTT_FIELDS))
+
+        RECORD_TYPES[cls.KIND] = cls
+
+    def __init__(self, device, tags=None, **values):
+        self.device = device
+        self.tags = _NO_TAGS if tags is None else tags
+
+        for _field in self.FIELDS:
+            setattr(self, _field, values.get(_field))
+
+    @property
+    def kind(self):
+        return self.KIND
+
+    @property
+    def fields(self):
+        return dict(zip(self.FIELDS, self.get_values(self)))
+
+    def influxdb_fields(self, selected=None):
+        if selected is not None:
+            return selected.values(self)
+        return dict(zip(self.INFLUXDB_FIELDS, self.get_influxdb_values(self)))
+
+    def mqtt_fields(self, selected=None):
+        if selected is not None:
+            _fields = selected.values(self)
+        else:
+            _fields = dict(zip(self.MQTT_FIELDS, self.get_mqtt_values(self)))
+
+        for _field in self.MQTT_OPTIONAL:
+            if _field in _fields and _fields[_field] is None:
+                del _fields[_field]
+        return _fields
+
+    def as_dict(self, precision=None):
+        """
+        Returns the dictionary form of the record, with the precision of its
+        timestamp when given.
+        """
+        return {
+            'kind': self.KIND,
+            'device': self.device,
+            'timestamp': self.timestamp,
+            'precision': precision,
+            'fields': self.fields,
+            'tags': self.tags
+        }
+
+
+class SinkFields(object):
+    """
+    Fields of a record class sent by a sink in place of the ones declared by
+    the class, e.g. selected by the configuration, with their getter computed
+    once.
+    """
+    __slots__ = ('names', '_get')
+
+    def __init__(self, record_type, names):
+        for _name in names:
+            if _name not in record_type.FIELDS:
+                raise ValueError("Unknown field '{:s}' of '{:s}'".format(
+                    _name, record_type.KIND))
+
+        self.names = tuple(names)
+        self._get = _getter(self.names)
+
+    def values(self, record):
+        return dict(zip(self.names, self._get(record)))
+
+
+def from_dict(record):
+    """
+    Creates a record from its dictionary form (see Record.as_dict).
+    """
+    return RECORD_TYPES[record['kind']](
+        record['device'], record['tags'] or None, **record['fields'])
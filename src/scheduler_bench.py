@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Scheduler benchmark: runs periodic tasks on the real clock, under a synthetic
+CPU load, and reports the percentiles of their wake-up lateness (start of a
+run after its deadline) and of their period jitter (deviation of the interval
+between two runs from the period), e.g.:
+
+    python src/scheduler_bench.py --tasks 4 --period 0.1 --load-threads 2
+"""
+
+import os
+import time
+import signal
+import logging
+import argparse
+import threading
+import multiprocessing
+
+import continuous_scheduler
+import logging_utils
+import stats_utils
+
+APPLICATION_NAME = 'scheduler_bench'
+
+TASKS = 2               # Default number of periodic tasks
+PERIOD = 0.1            # Default seconds between two runs of a task
+DURATION = 30           # Default seconds of benchmark
+WORK = 0.001            # Default CPU seconds of each run of a task
+
+
+def _busy(seconds):
+    _end = time.process_time() + seconds
+    while time.process_time() < _end:
+        pass
+
+
+def _spin(stop):
+    while not stop.is_set():
+        _busy(0.01)
+
+
+def _spin_process():
+    # The load processes are stopped by the parent
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while True:
+        _busy(1)
+
+
+class Probe(object):
+    """
+    Periodic task recording the lateness of each run, from the deadline of
+    its wrapper, and the interval from the previous run.
+    """
+
+    def __init__(self, work):
+        self._work = work
+        self._last = None
+
+        self.wrapper = None
+        self.lateness = list()
+        self.intervals = list()
+
+    def __call__(self):
+        _now = time.monotonic()
+        self.lateness.append(_now - self.wrapper.deadline)
+        if self._last is not None:
+            self.intervals.append(_now - self._last)
+        self._last = _now
+
+        _busy(self._work)
+
+
+def report(logger, probes, period):
+    _lateness = [_l for _p in probes for _l in _p.lateness]
+    _jitter = [abs(_i - period) for _p in probes for _i in _p.intervals]
+
+    for _name, _values in [
+            ('Wake-up lateness', _lateness), ('Period jitter', _jitter)]:
+        logger.info(
+            "%s over %d runs: p50 %.3f ms, p95 %.3f ms, "
+            "p99 %.3f ms, max %.3f ms", _name, len(_values),
+            stats_utils.percentile(_values, 0.50) * 1000,
+            stats_utils.percentile(_values, 0.95) * 1000,
+            stats_utils.percentile(_values, 0.99) * 1000,
+            max(_values, default=0) * 1000)
+
+
+def configuration_parser(p_args=None):
+    parser = argparse.ArgumentParser(
+        description=(
+            'Measure the wake-up lateness and jitter of the scheduler under '
+            'synthetic CPU load.'))
+
+    parser.add_argument(
+        '--tasks', dest='tasks', action='store',
+        type=int, default=TASKS,
+        help='number of periodic tasks (default: {})'.format(TASKS))
+    parser.add_argument(
+        '--period', dest='period', action='store',
+        type=float, default=PERIOD,
+        help='seconds between two runs of a task (default: {})'
+             .format(PERIOD))
+    parser.add_argument(
+        '--duration', dest='duration', action='store',
+        type=float, default=DURATION,
+        help='seconds of benchmark (default: {})'.format(DURATION))
+    parser.add_argument(
+        '--work', dest='work', action='store',
+        type=float, default=WORK,
+        help='CPU seconds of each run of a task (default: {})'.format(WORK))
+    parser.add_argument(
+        '--load-threads', dest='load_threads', action='store',
+        type=int, default=0,
+        help=(
+            'busy threads in the process, competing with the scheduler for '
+            'the interpreter lock (default: 0)'))
+    parser.add_argument(
+        '--load-processes', dest='load_processes', action='store',
+        type=int, default=0,
+        help=(
+            'busy processes, competing with the scheduler for the CPUs '
+            '(default: 0, {} CPUs available)'.format(os.cpu_count())))
+
+    return parser.parse_args(p_args)
+
+
+def main():
+    args = configuration_parser()
+
+    _log_listener = logging_utils.start_logging(logging.INFO)
+    logger = logging.getLogger(APPLICATION_NAME)
+
+    logger.info(
+        "%d tasks every %s secs for %s secs, load of %d threads and %d "
+        "processes", args.tasks, args.period, args.duration,
+        args.load_threads, args.load_processes)
+
+    _stop = threading.Event()
+    _threads = [
+        threading.Thread(target=_spin, args=(_stop,), daemon=True)
+        for _i in range(args.load_threads)]
+    _processes = [
+        multiprocessing.Process(target=_spin_process, daemon=True)
+        for _i in range(args.load_processes)]
+    for _load in _threads + _processes:
+        _load.start()
+
+    _scheduler = continuous_scheduler.MainScheduler()
+    _probes = list()
+
+    # The tasks are spread over the period
+    for _i in range(args.tasks):
+        _probe = Probe(args.work)
+        _probe.wrapper = _scheduler.add_task(
+            _probe, args.period * (1 + _i / args.tasks), args.period, 0)
+        _probes.append(_probe)
+
+    try:
+        _scheduler.start(args.duration)
+    finally:
+        _stop.set()
+        for _process in _processes:
+            _process.terminate()
+
+        report(logger, _probes, args.period)
+        _log_listener.stop()
+
+
+if __name__ == "__main__":
+    main()
+
+# vim:ts=4:expandtab
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import json
+import math
+import time
+import random
+import platform
+import threading
+import collections
+
+import housekeeping
+
+SYNTHETIC = 'synthetic'     # Source name of the synthetic generators
+
+DAY = 24 * 60 * 60
+
+
+class VirtualClock(object):
+    """
+    Clock advanced by the sleeps instead of by the real time. Each sleep
+    lasts in real time the virtual interval divided by the speed factor, or
+    nothing when the speed is 0.
+    """
+
+    def __init__(self, speed=1.0, start=None):
+        self._speed = speed
+        self._now = 0.0
+        self._epoch_ns = time.time_ns() if start is None else int(
+            start * 10 ** 9)
+        self._lock = threading.Lock()
+
+    def time(self):
+        return self._now
+
+    def time_ns(self):
+        """
+        Wall clock time in nanoseconds, starting from the creation time.
+        """
+        return self._epoch_ns + int(self._now * 10 ** 9)
+
+    def sleep(self, secs):
+        if secs <= 0:
+            return
+        if self._speed > 0:
+            time.sleep(secs / self._speed)
+        with self._lock:
+            self._now += secs
+
+
+class RealClock(object):
+    """
+    Real time counterpart of VirtualClock, for the sources of a run on the
+    real time scheduler.
+    """
+    time_ns = staticmethod(time.time_ns)
+    sleep = staticmethod(time.sleep)
+    time = staticmethod(time.monotonic)     # Last, it hides the module
+
+
+class SyntheticSource(object):
+    """
+    Generates plausible sensor and housekeeping values: a daily temperature
+    and humidity cycle with noise, and slowly varying system resources.
+    """
+
+    def __init__(self, clock, seed=None):
+        self._clock = clock
+        self._random = random.Random(seed)
+        self._boot = clock.time_ns() / 10 ** 9
+
+    def _day_phase(self):
+        return 2 * math.pi * (self._clock.time_ns() / 10 ** 9 % DAY) / DAY
+
+    def read_htu21d(self, target):
+        """
+        Returns temperature and relative humidity of the sensor with the
+        given target name.
+        """
+        _phase = self._day_phase()
+        _temperature = 20 + 5 * math.sin(_phase) + self._random.gauss(0, 0.1)
+        _humidity = 60 - 15 * math.sin(_phase) + self._random.gauss(0, 0.5)
+
+        return (
+            int(_temperature * 100) / 100,
+            int(_humidity * 100) / 100)
+
+    def housekeeping_collectors(self):
+        _uniform = self._random.uniform
+
+        return {
+            "lastBoot": lambda: time.strftime(
+                '%Y-%m-%d %H:%M:%S', time.localtime(self._boot)),
+            "operatingSystem": platform.system,
+            "kernelRelease": platform.release,
+            "kernelVersion": platform.version,
+            "systemArchitecture": platform.machine,
+            "cpuCount": lambda: 4,
+            "diskTotal": lambda: 29000,
+            "diskFree": lambda: int(_uniform(20000, 21000)),
+            "memoryTotal": lambda: 926,
+            "memoryFree": lambda: int(_uniform(300, 400)),
+            "memoryAvailable": lambda: int(_uniform(500, 600)),
+            "swapTotal": lambda: 99,
+            "swapFree": lambda: int(_uniform(90, 99)),
+            "signal": lambda: int(_uniform(-70, -40)),
+            "tcpLatency": lambda: int(_uniform(10, 50) * 100) / 100,
+            "cpuLoad": lambda: int(_uniform(0, 2) * 100) / 100,
+            "cpuTemp": lambda: int(_uniform(40, 60) * 1000) / 1000,
+            "uptime": lambda: self._clock.time_ns() / 10 ** 9 - self._boot
+        }
+
+
+class TraceSource(object):
+    """
+    Replays the readings recorded in a trace file, i.e. the JSON lines
+    written by the local file sink (--output-file). The readings of each
+    kind and sensor target are returned in order and restart from the first
+    one at the end of the trace. Only their values are replayed, the
+    timestamps come from the clock of the simulation, so the precision they
+    were recorded with does not matter.
+    """
+
+    def __init__(self, path):
+        self._readings = collections.defaultdict(list)
+        self._positions = collections.Counter()
+        self._lock = threading.Lock()
+
+        with open(path, 'r') as _f:
+            for _line in _f:
+                _reading = json.loads(_line)
+                self._readings[(
+                    _reading['kind'],
+                    _reading['tags'].get('target'))].append(
+                        _reading['fields'])
+
+        if not self._readings:
+            raise ValueError("Empty trace file '{:s}'".format(path))
+
+    def _next(self, kind, target=None, name=None):
+        """
+        Returns the next recorded fields of the given kind and target. Each
+        name has its own position, so values read concurrently by different
+        collectors are taken from the same record.
+        """
+        _key = (kind, target)
+        if _key not in self._readings:
+            _key = next(
+                (_k for _k in self._readings if _k[0] == kind), None)
+            if _key is None:
+                return dict()
+
+        with self._lock:
+            _readings = self._readings[_key]
+            _position = self._positions[_key + (name,)]
+            self._positions[_key + (name,)] += 1
+
+        return _readings[_position % len(_readings)]
+
+    def read_htu21d(self, target):
+        _fields = self._next('htu21d', target)
+        return _fields.get('temperature'), _fields.get('relativeHumidity')
+
+    def housekeeping_collectors(self):
+        def _collector(name):
+            return lambda: self._next('housekeeping', name=name).get(name)
+
+        return {
+            _name: _collector(_name)
+            for _name in housekeeping.PARAMETER_FUNCTION_MAP}
+
+
+def create_source(source, clock):
+    """
+    Returns the synthetic source or the trace source for the given file.
+    """
+    if source == SYNTHETIC:
+        return SyntheticSource(clock)
+    return TraceSource(source)
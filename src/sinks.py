@@ -0,0 +1,518 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import json
+import socket
+import influxdb
+import itertools
+import influxdb.exceptions
+import threading
+import influxdb.line_protocol as line_protocol
+import paho.mqtt.client as mqtt
+
+import latest_value
+import pipeline
+
+MQTT_BATCH_THRESHOLD = 100      # Backlog of readings enabling batch mode
+MQTT_BATCH_SIZE = 65536         # Max size in bytes of a batched message
+
+ARRAY = 'array'
+COLUMNAR = 'columnar'
+
+MQTT_BATCH_LAYOUTS = [ARRAY, COLUMNAR]
+
+MQTT_QOS = "WeatherObserved/#=1"    # QoS of the topics, 0 for the others
+MQTT_INFLIGHT = 20              # Max QoS > 0 messages waiting for the ack
+MQTT_QUEUE_LIMIT = 1000         # Max messages queued by the client, 0: none
+MQTT_KEEPALIVE = 60             # Seconds between two pings to the broker
+MQTT_TIMEOUT = 30               # Seconds to wait for the acks of a batch
+
+UDP_DATAGRAM_SIZE = 1400        # Max size in bytes of a UDP datagram
+INFLUXDB_TIMEOUT = 10           # Seconds to wait for an InfluxDB request
+
+_NO_FIELDS = dict()
+
+
+def influxdb_points(readings, device_tag=False, fields=None):
+    """
+    Yields the InfluxDB points of the readings, skipping the failed
+    acquisitions. With device_tag, the points are tagged with the name of
+    the device. The fields of a kind of reading in fields (records.SinkFields
+    by kind) are sent in place of the ones of its class.
+    """
+    fields = fields or _NO_FIELDS
+
+    for _r in readings:
+        _fields = _r.influxdb_fields(fields.get(_r.KIND))
+
+        if all(_v is None for _v in _fields.values()):
+            continue
+
+        _tags = dict(_r.INFLUXDB_TAGS, **_r.tags)
+        if device_tag:
+            _tags['device'] = _r.device
+
+        yield {
+            "measurement": _r.INFLUXDB_MEASUREMENT,
+            "tags": _tags,
+            "time": _r.timestamp,
+            "fields": _fields
+        }
+
+
+class InfluxDBSink(object):
+    """
+    Writes the readings into InfluxDB, one request for each batch. With
+    device_tag, the points are tagged with the name of the device, with gzip
+    the requests are compressed. The fields sent can be selected for each
+    kind of reading (see influxdb_points).
+
+    The database is created, if not present, before the first write, so
+    an unreachable InfluxDB only fails the writes. The failed requests are
+    not retried by the client, but by the worker of the sink, except the
+    ones rejected as malformed (400 Bad Request).
+    """
+    NAME = 'influxdb'
+
+    def __init__(self, logger, host, port, username, password, database,
+                 precision='s', device_tag=False, timeout=INFLUXDB_TIMEOUT,
+                 gzip=False, fields=None):
+        self._logger = logger
+        self._database = database
+        self._database_checked = False
+        self._device_tag = device_tag
+        self._fields = fields
+        self._time_precision = pipeline.INFLUXDB_PRECISIONS[precision]
+        self._client = influxdb.InfluxDBClient(
+            host=host,
+            port=port,
+            username=username,
+            password=password,
+            database=database,
+            timeout=timeout,
+            retries=1,
+            gzip=gzip
+        )
+
+    def _check_database(self):
+        _dbs = self._client.get_list_database()
+        if self._database not in [_d['name'] for _d in _dbs]:
+            self._logger.info(
+                "InfluxDB database '%s' not found. Creating a new one.",
+                self._database)
+            self._client.create_database(self._database)
+        self._database_checked = True
+
+    def write(self, readings, backlog=0):
+        if not self._database_checked:
+            self._check_database()
+
+        _json_data = list(influxdb_points(
+            readings, self._device_tag, self._fields))
+
+        if _json_data:
+            try:
+                self._client.write_points(
+                    _json_data, time_precision=self._time_precision)
+            except influxdb.exceptions.InfluxDBClientError as ex:
+                if ex.code == 400:
+                    raise pipeline.RejectedError(ex.content) from ex
+                raise
+            self._logger.debug("Insert data into InfluxDB: %s", _json_data)
+
+    def close(self):
+        self._client.close()
+
+
+class InfluxDBUDPSink(object):
+    """
+    Sends the readings to the UDP listener of InfluxDB as line protocol,
+    packing the points into datagrams of at most datagram_size bytes.
+
+    Fire and forget: the write never waits for InfluxDB nor fails, the
+    points that cannot be sent are counted as dropped, see stats. The
+    timestamps are sent in nanoseconds, the default precision of the
+    listener.
+    """
+    NAME = 'influxdb-udp'
+
+    def __init__(self, logger, host, port, precision='s', device_tag=False,
+                 datagram_size=UDP_DATAGRAM_SIZE, fields=None):
+        self._logger = logger
+        self._address = (host, port)
+        self._device_tag = device_tag
+        self._fields = fields
+        self._datagram_size = datagram_size
+        self._scale = 10 ** 9 // pipeline.TIMESTAMP_PRECISIONS[precision][0]
+        self._socket = socket.socket(
+            socket.getaddrinfo(host, port, type=socket.SOCK_DGRAM)[0][0],
+            socket.SOCK_DGRAM)
+
+        self.sent = 0
+        self.dropped = 0
+
+    @property
+    def stats(self):
+        return "{:d} points sent, {:d} dropped".format(
+            self.sent, self.dropped)
+
+    def _pack(self, points):
+        """
+        Yields the datagrams of the points and the number of points in each
+        one. A point larger than a datagram is dropped.
+        """
+        _lines = list()
+        _size = 0
+
+        for _p in points:
+            _line = line_protocol.make_line(
+                _p['measurement'], tags=_p['tags'], fields=_p['fields'],
+                time=_p['time'] * self._scale).encode('utf-8')
+
+            if len(_line) > self._datagram_size:
+                self._logger.warning(
+                    "Point of %d bytes larger than a datagram", len(_line))
+                self.dropped += 1
+                continue
+
+            if _lines and _size + len(_line) > self._datagram_size:
+                yield b'\n'.join(_lines), len(_lines)
+                _lines = list()
+                _size = 0
+
+            _lines.append(_line)
+            _size += len(_line) + 1
+
+        if _lines:
+            yield b'\n'.join(_lines), len(_lines)
+
+    def write(self, readings, backlog=0):
+        for _datagram, _count in self._pack(
+                influxdb_points(readings, self._device_tag, self._fields)):
+            try:
+                self._socket.sendto(_datagram, self._address)
+            except OSError as ex:
+                self._logger.warning("Sink '%s': %s", self.NAME, ex)
+                self.dropped += _count
+            else:
+                self.sent += _count
+
+    def close(self):
+        self._socket.close()
+
+
+def parse_mqtt_qos(qos):
+    """
+    Parses a list of TOPIC_FILTER=QOS separated by commas or spaces into a
+    list of (topic filter, QoS) pairs.
+    """
+    _filters = list()
+
+    for _item in qos.replace(',', ' ').split():
+        _filter, _sep, _qos = _item.rpartition('=')
+        if not _sep or not _filter or _qos not in ('0', '1', '2'):
+            raise ValueError("Invalid topic QoS '{:s}'".format(_item))
+        _filters.append((_filter, int(_qos)))
+
+    return _filters
+
+
+class MQTTSink(object):
+    """
+    Publishes the readings to the MQTT broker over a persistent session: the
+    client keeps its connection, reconnecting when lost, and the broker keeps
+    the session of client_id across reconnections.
+
+    The QoS of each topic is the one of the first matching topic filter (0
+    when none matches). The QoS > 0 messages are pipelined, up to inflight
+    of them waiting for the ack, and a batch is published once all the
+    messages of the previous one are acknowledged. Once published, they are
+    redelivered by the client over reconnections. The client queues up to
+    queue_limit messages, the ones beyond that and the QoS 0 ones published
+    while disconnected are counted as lost.
+
+    When the backlog exceeds the batch threshold, the readings for the same
+    topic are packed into messages up to batch_size bytes, as a JSON array of
+    readings (ARRAY layout) or as a JSON object with a list of values for
+    each field (COLUMNAR layout). The fields sent can be selected for each
+    kind of reading (records.SinkFields by kind).
+    """
+    NAME = 'mqtt'
+
+    def __init__(self, logger, host, port, client_id='',
+                 qos=parse_mqtt_qos(MQTT_QOS), inflight=MQTT_INFLIGHT,
+                 queue_limit=MQTT_QUEUE_LIMIT, timeout=MQTT_TIMEOUT,
+                 batch_threshold=MQTT_BATCH_THRESHOLD,
+                 batch_size=MQTT_BATCH_SIZE, batch_layout=ARRAY, fields=None):
+        if batch_layout not in MQTT_BATCH_LAYOUTS:
+            raise ValueError(
+                "Unknown batch layout '{:s}'".format(batch_layout))
+
+        self._logger = logger
+        self._host = host
+        self._port = port
+        self._qos_filters = qos
+        self._qos = dict()
+        self._timeout = timeout
+        self._batch_threshold = batch_threshold
+        self._batch_size = batch_size
+        self._batch_layout = batch_layout
+        self._fields = fields or _NO_FIELDS
+
+        self._connected = threading.Event()
+        self._attempted = threading.Event()
+        self._acks = threading.Condition()
+        self._unacked = set()
+        self._untracked = set()
+        self._early_acks = set()
+
+        self.lost = 0
+
+        # A persistent session needs a client id
+        self._client = mqtt.Client(
+            mqtt.CallbackAPIVersion.VERSION2, client_id=client_id,
+            clean_session=not client_id)
+        self._client.max_inflight_messages_set(inflight)
+        self._client.max_queued_messages_set(queue_limit)
+        self._client.on_connect = self._on_connect
+        self._client.on_disconnect = self._on_disconnect
+        self._client.on_connect_fail = self._on_connect_fail
+        self._client.on_publish = self._on_publish
+
+        self._client.connect_async(host, port, MQTT_KEEPALIVE)
+        self._client.loop_start()
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        self._attempted.set()
+        if reason_code.is_failure:
+            self._logger.error(
+                "Sink '%s': connection refused, %s", self.NAME, reason_code)
+            return
+
+        self._logger.info(
+            "Sink '%s': connected to '%s:%d' (session present: %s)",
+            self.NAME, self._host, self._port, flags.session_present)
+        self._connected.set()
+
+    def _on_connect_fail(self, client, userdata):
+        self._attempted.set()
+
+    def _on_disconnect(self, client, userdata, flags, reason_code,
+                       properties):
+        self._connected.clear()
+        with self._acks:
+            self._acks.notify_all()
+
+        if reason_code.is_failure:
+            self._logger.warning(
+                "Sink '%s': disconnected, %s", self.NAME, reason_code)
+
+    def _on_publish(self, client, userdata, mid, reason_code, properties):
+        # Called with the lock of the client held, it must not wait. It may
+        # run before publish() returns the mid, which is then tracked later.
+        with self._acks:
+            if mid in self._unacked:
+                self._unacked.remove(mid)
+                self._acks.notify_all()
+            elif mid in self._untracked:
+                self._untracked.remove(mid)
+            else:
+                self._early_acks.add(mid)
+
+    def _track(self, mid, qos):
+        """
+        Records a published message: the QoS > 0 ones are waited for, the
+        QoS 0 ones only have their callback discarded, so no stale mid can
+        match a later message once the mids wrap around.
+        """
+        with self._acks:
+            if mid in self._early_acks:
+                self._early_acks.remove(mid)
+            elif qos:
+                self._unacked.add(mid)
+            else:
+                self._untracked.add(mid)
+
+    def _wait_acks(self, timeout):
+        """
+        Waits for the acknowledgements while connected, returns whether
+        there are none left.
+        """
+        with self._acks:
+            self._acks.wait_for(
+                lambda: not self._unacked or not self._connected.is_set(),
+                timeout)
+            return not self._unacked
+
+    def _topic_qos(self, topic):
+        _qos = self._qos.get(topic)
+        if _qos is None:
+            _qos = self._qos[topic] = next((
+                _q for _f, _q in self._qos_filters
+                if mqtt.topic_matches_sub(_f, topic)), 0)
+        return _qos
+
+    def _messages(self, readings):
+        for _r in readings:
+            yield (
+                _r.MQTT_TOPIC.format(_r.device),
+                _r.mqtt_fields(self._fields.get(_r.KIND)))
+
+    def _pack(self, messages):
+        """
+        Packs the messages of a topic into payloads of at most batch_size
+        bytes (a single message larger than that is sent alone).
+        """
+        _chunk = list()
+        _chunk_size = 2
+
+        for _message in messages:
+            _encoded = json.dumps(_message)
+            if _chunk and _chunk_size + len(_encoded) + 1 > self._batch_size:
+                yield self._payload(_chunk)
+                _chunk = list()
+                _chunk_size = 2
+
+            _chunk.append((_message, _encoded))
+            _chunk_size += len(_encoded) + 1
+
+        if _chunk:
+            yield self._payload(_chunk)
+
+    def _payload(self, chunk):
+        if self._batch_layout == ARRAY:
+            return '[' + ','.join(_e for _m, _e in chunk) + ']'
+
+        _keys = list()
+        for _m, _e in chunk:
+            _keys.extend(_k for _k in _m if _k not in _keys)
+
+        return json.dumps(
+            {_k: [_m.get(_k) for _m, _e in chunk] for _k in _keys})
+
+    def write(self, readings, backlog=0):
+        _msgs = list()
+
+        if self._batch_threshold and backlog >= self._batch_threshold:
+            _messages = sorted(
+                self._messages(readings), key=lambda _tm: _tm[0])
+            for _topic, _group in itertools.groupby(
+                    _messages, key=lambda _tm: _tm[0]):
+                for _payload in self._pack(_m for _t, _m in _group):
+                    _msgs.append({'topic': _topic, 'payload': _payload})
+
+            self._logger.debug(
+                "Batch of %d readings in %d messages, backlog %d",
+                len(readings), len(_msgs), backlog)
+        else:
+            for _topic, _message in self._messages(readings):
+                _payload = json.dumps(_message)
+                self._logger.debug(
+                    "Message topic:'%s', broker:'%s:%d', message:'%s'",
+                    _topic, self._host, self._port, _payload)
+                _msgs.append({'topic': _topic, 'payload': _payload})
+
+        # The batch is retried, without queuing it, while the client is
+        # disconnected or the messages of the previous one are not
+        # acknowledged. Only the first batch waits for the connection.
+        self._attempted.wait(self._timeout)
+        if not self._connected.is_set():
+            raise ConnectionError(
+                "Not connected to '{:s}:{:d}'".format(self._host, self._port))
+        if not self._wait_acks(self._timeout):
+            raise TimeoutError(
+                "{:d} messages not acknowledged".format(len(self._unacked)))
+
+        for _msg in _msgs:
+            _qos = self._topic_qos(_msg['topic'])
+            _info = self._client.publish(
+                _msg['topic'], _msg['payload'], qos=_qos)
+
+            # The QoS > 0 messages are queued by the client when disconnected
+            if _info.rc == mqtt.MQTT_ERR_SUCCESS or (
+                    _qos and _info.rc == mqtt.MQTT_ERR_NO_CONN):
+                self._track(_info.mid, _qos)
+            else:
+                self.lost += 1
+                self._logger.warning(
+                    "Sink '%s': message to '%s' lost, %s", self.NAME,
+                    _msg['topic'], mqtt.error_string(_info.rc))
+
+    def close(self):
+        if not self._wait_acks(self._timeout):
+            self._logger.warning(
+                "Sink '%s': %d messages not acknowledged", self.NAME,
+                len(self._unacked))
+        self._client.disconnect()
+        self._client.loop_stop()
+
+
+class FileSink(object):
+    """
+    Appends the readings to a local file as JSON lines, each one with the
+    precision of its timestamp.
+    """
+    NAME = 'file'
+
+    def __init__(self, logger, path, precision='s'):
+        self._logger = logger
+        self._precision = precision
+        self._file = open(path, 'a')
+
+    def write(self, readings, backlog=0):
+        for _r in readings:
+            self._file.write(
+                pipeline.dump_reading(_r, self._precision) + '\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class LatestValueSink(object):
+    """
+    Publishes the newest MQTT message of each topic, and of each sensor
+    target, in a latest value region for the local consumers, with the
+    fields of the MQTT sink.
+    """
+    NAME = 'local'
+
+    def __init__(self, logger, path, slots=latest_value.SLOTS,
+                 slot_size=latest_value.SLOT_SIZE, fields=None):
+        self._logger = logger
+        self._fields = fields or _NO_FIELDS
+        self._writer = latest_value.LatestValueWriter(path, slots, slot_size)
+
+    def write(self, readings, backlog=0):
+        # Only the newest message of each slot is written
+        _latest = dict()
+        for _r in readings:
+            _name = _r.MQTT_TOPIC.format(_r.device)
+            if 'target' in _r.tags:
+                _name += '/' + _r.tags['target']
+            _latest[_name] = _r
+
+        for _name, _r in _latest.items():
+            try:
+                self._writer.write(
+                    _name, _r.mqtt_fields(self._fields.get(_r.KIND)))
+            except (IndexError, ValueError) as ex:
+                self._logger.warning("Sink '%s': %s", self.NAME, ex)
+
+    def close(self):
+        self._writer.close()
@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Statistics shared by the benchmark tools, e.g. the percentiles of the
+latencies reported by the load generator and the scheduler benchmark.
+"""
+
+
+def percentile(values, fraction):
+    """
+    Returns the value below which the given fraction of the values falls
+    (nearest rank), 0.0 when there are none.
+    """
+    if not values:
+        return 0.0
+    _values = sorted(values)
+    return _values[min(len(_values) - 1, int(fraction * len(_values)))]
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Supervised mode: the tasks run in worker processes, which send their readings
+to the sinks of the supervisor process over a pipe each. A worker that exits
+with an error, or misses its heartbeat, is killed and started again.
+
+The workers are spawned, not forked, so they do not inherit the threads of
+the sinks. Each one has its own pipe: a killed worker can only leave a
+truncated message in its own pipe, which is replaced on restart.
+
+The pipes are always read as soon as the readings arrive, into a local queue
+handed to the sinks by a separate thread: a sink waiting for room in its
+queue (BLOCK policy) must not fill the pipes, which would stop the workers,
+and their heartbeats, in the middle of a send.
+"""
+
+import os
+import time
+import queue
+import threading
+import collections
+import multiprocessing
+import multiprocessing.connection
+
+HEARTBEAT_TIMEOUT = 30  # Seconds without a heartbeat before a restart
+CHECK_INTERVAL = 1      # Seconds between two checks of the workers
+STOP_TIMEOUT = 5        # Seconds a worker is given to exit when stopped
+
+_STOP = object()        # Ends the dispatch of the readings
+
+
+class Heartbeat(object):
+    """
+    Time of the last sign of life of a worker, in shared memory. The worker
+    beats from its scheduler thread, between the tasks and while waiting for
+    the next one (see delayfunc), so a task stalling the thread stops the
+    beats.
+    """
+
+    def __init__(self, context, interval):
+        self._value = context.Value('d', time.monotonic(), lock=False)
+        self.interval = interval
+
+    @property
+    def age(self):
+        return time.monotonic() - self._value.value
+
+    def beat(self):
+        self._value.value = time.monotonic()
+
+    def delayfunc(self, sleep):
+        """
+        Wraps the delay function of a scheduler, beating at least once every
+        interval while waiting.
+        """
+        def _sleep(secs):
+            self.beat()
+            while secs > 0:
+                _chunk = min(secs, self.interval)
+                sleep(_chunk)
+                self.beat()
+                secs -= _chunk
+        return _sleep
+
+
+class WorkerPipeline(object):
+    """
+    Stands for the pipeline in a worker process, sending the readings to the
+    supervisor.
+    """
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def put(self, reading):
+        self._connection.send(reading)
+
+
+class _Worker(object):
+
+    def __init__(self, name, target, args, heartbeat):
+        self.name = name
+        self.target = target
+        self.args = args
+        self.heartbeat = heartbeat
+        self.process = None
+        self.reader = None
+
+
+class Supervisor(object):
+    """
+    Starts the workers and receives their readings, from the calling thread,
+    until all of them have finished (exited with code 0). The readings are
+    handed to the sinks from a dispatcher thread.
+    Each worker runs target(name, connection, heartbeat, *args) and must
+    call heartbeat.beat() at least every heartbeat.interval seconds.
+    """
+
+    def __init__(self, logger, heartbeat_timeout=HEARTBEAT_TIMEOUT):
+        self._context = multiprocessing.get_context('spawn')
+        self._logger = logger
+        self._timeout = heartbeat_timeout
+        self._workers = list()
+
+        self.restarts = collections.Counter()
+
+    def add_worker(self, name, target, *args):
+        self._workers.append(_Worker(
+            name, target, args,
+            Heartbeat(self._context, self._timeout / 3)))
+
+    def _start(self, worker):
+        worker.reader, _writer = self._context.Pipe(duplex=False)
+        worker.heartbeat.beat()
+        worker.process = self._context.Process(
+            target=worker.target, name=worker.name, daemon=True,
+            args=(worker.name, _writer, worker.heartbeat) + worker.args)
+        worker.process.start()
+
+        # The reader gets EOF when the worker exits
+        _writer.close()
+        self._logger.info(
+            "Worker '%s' started (pid %d)", worker.name, worker.process.pid)
+
+    def _receive(self, worker, put):
+        try:
+            put(worker.reader.recv())
+        except (EOFError, OSError):
+            worker.reader.close()
+            worker.reader = None
+            worker.process.join(STOP_TIMEOUT)
+
+    def _check(self, worker, put):
+        """
+        Restarts the worker when failed, returns whether it is running.
+        """
+        _process = worker.process
+        if _process.is_alive():
+            if worker.heartbeat.age <= self._timeout:
+                return True
+            _reason = "missed its heartbeat for {:.1f} secs".format(
+                worker.heartbeat.age)
+            _process.kill()
+            _process.join()
+        elif _process.exitcode == 0:
+            self._logger.info("Worker '%s' finished", worker.name)
+            self._drain(worker, put)
+            return False
+        else:
+            _reason = "exited with code {:d}".format(_process.exitcode)
+            self._drain(worker, put)
+
+        self._logger.warning(
+            "Worker '%s' %s, restarting", worker.name, _reason)
+        self.restarts[worker.name] += 1
+        if worker.reader is not None:
+            worker.reader.close()
+        self._start(worker)
+        return True
+
+    def _drain(self, worker, put):
+        while worker.reader is not None and worker.reader.poll():
+            self._receive(worker, put)
+
+    def signal_workers(self, signum, frame=None):
+        """
+        Sends a signal to the running workers, e.g. forwarding the one
+        received by the supervisor as a signal handler.
+        """
+        for _worker in self._workers:
+            if _worker.process is None or not _worker.process.is_alive():
+                continue
+            try:
+                os.kill(_worker.process.pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _dispatch(self, readings, put):
+        while True:
+            _reading = readings.get()
+            if _reading is _STOP:
+                break
+            try:
+                put(_reading)
+            except Exception as ex:
+                self._logger.error("Reading not dispatched: %s", ex)
+
+    def run(self, put):
+        # The pipes are drained into the queue, whatever the sinks do
+        _readings = queue.SimpleQueue()
+        _dispatcher = threading.Thread(
+            target=self._dispatch, args=(_readings, put),
+            name='supervisor-dispatch', daemon=True)
+        _dispatcher.start()
+        put = _readings.put
+
+        _running = list(self._workers)
+        for _worker in _running:
+            self._start(_worker)
+
+        try:
+            _next_check = time.monotonic() + CHECK_INTERVAL
+            while _running:
+                _readers = {
+                    _w.reader: _w for _w in _running if _w.reader is not None}
+                for _reader in multiprocessing.connection.wait(
+                        list(_readers), CHECK_INTERVAL):
+                    self._receive(_readers[_reader], put)
+
+                if time.monotonic() >= _next_check:
+                    for _worker in list(_running):
+                        if not self._check(_worker, put):
+                            _running.remove(_worker)
+                    _next_check = time.monotonic() + CHECK_INTERVAL
+        finally:
+            try:
+                self._stop(_running, put)
+            finally:
+                _readings.put(_STOP)
+                _dispatcher.join()
+
+    def _stop(self, workers, put):
+        for _worker in workers:
+            _worker.process.terminate()
+        for _worker in workers:
+            _worker.process.join(STOP_TIMEOUT)
+            if _worker.process.is_alive():
+                _worker.process.kill()
+                _worker.process.join()
+
+            self._drain(_worker, put)
+            if _worker.reader is not None:
+                _worker.reader.close()
+
+        for _worker in self._workers:
+            if self.restarts[_worker.name]:
+                self._logger.warning(
+                    "Worker '%s' restarted %d times", _worker.name,
+                    self.restarts[_worker.name])
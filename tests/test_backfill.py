@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+This module tests:
+    * the chunks read from the files of readings and their offsets, and the
+    precision of their timestamps;
+    * that an interrupted backfill resumes from its checkpoint;
+    * that the missing derived metrics are computed.
+"""
+
+import io
+import os
+import json
+import unittest
+
+from unittest.mock import Mock
+from backfill import Backfill, Checkpoint, read_chunks
+from htu21d_publisher import HTU21DRecord
+
+
+def _line(index, precision='s'):
+    return (json.dumps(HTU21DRecord(
+        'EDGE', timestamp=index, temperature=20.0,
+        relativeHumidity=50.0).as_dict(precision)) + '\n').encode('utf-8')
+
+
+class FailingSink(object):
+    """
+    Records the timestamps of the readings written, failing the chunk with
+    the given timestamp.
+    """
+
+    def __init__(self, written, fail_at=None):
+        self._written = written
+        self._fail_at = fail_at
+
+    def write(self, readings, backlog=0):
+        _timestamps = [_r.timestamp for _r in readings]
+        if self._fail_at in _timestamps:
+            raise ConnectionError("InfluxDB unreachable")
+        self._written.extend(readings)
+
+    def close(self):
+        pass
+
+
+class TestBackfill(unittest.TestCase):
+    """
+    Checks the backfill of a file of readings.
+    """
+
+    def setUp(self):
+        self._path = '/tmp/test_backfill.jsonl'
+        self._checkpoint = self._path + '.checkpoint'
+
+        with open(self._path, 'wb') as _f:
+            for _i in range(25):
+                _f.write(_line(_i))
+
+        for _path in [self._path, self._checkpoint]:
+            self.addCleanup(
+                lambda _p=_path: os.path.exists(_p) and os.remove(_p))
+
+    def test_chunks(self):
+        """
+        Checks the chunks and their offsets, an incomplete last line being
+        left out.
+        """
+        _data = _line(0) + b'\n' + _line(1) + _line(2) + _line(3)[:-5]
+        _chunks = list(read_chunks(io.BytesIO(_data), 0, 2))
+
+        self.assertEqual(
+            [[_r.timestamp for _r in _c] for _c, _o in _chunks], [[0, 1], [2]])
+        self.assertEqual(_chunks[0][1], len(_line(0) + b'\n' + _line(1)))
+        self.assertEqual(_chunks[1][1], len(_data) - len(_line(3)) + 5)
+
+        _chunks = list(read_chunks(io.BytesIO(_data), _chunks[0][1], 2))
+        self.assertEqual([_r.timestamp for _r in _chunks[0][0]], [2])
+
+    def test_precision(self):
+        """
+        Checks that the timestamps are converted to the precision of the
+        handler.
+        """
+        _data = _line(1, 's') + _line(2000, 'ms') + _line(3000000, 'us')
+        _chunks = list(read_chunks(io.BytesIO(_data), 0, 10, 'ms'))
+
+        self.assertEqual(
+            [_r.timestamp for _r in _chunks[0][0]], [1000, 2000, 3000])
+
+    def test_resume(self):
+        """
+        Checks that a failed backfill stops at the last chunk written in
+        order, and resumes from there.
+        """
+        _written = list()
+        _backfill = Backfill(
+            Mock(), lambda: FailingSink(_written, fail_at=12), (),
+            chunk_size=5, concurrency=2)
+
+        with self.assertRaises(ConnectionError):
+            _backfill.run(self._path, Checkpoint(self._checkpoint))
+        self.assertEqual(
+            Checkpoint(self._checkpoint).offset, len(_line(0)) * 10)
+
+        _backfill = Backfill(
+            Mock(), lambda: FailingSink(_written), (), chunk_size=5)
+        _backfill.run(self._path, Checkpoint(self._checkpoint))
+
+        self.assertEqual(_backfill.written, 15)
+        self.assertEqual(
+            sorted(set(_r.timestamp for _r in _written)), list(range(25)))
+        self.assertEqual(
+            Checkpoint(self._checkpoint).offset, os.path.getsize(self._path))
+
+    def test_derived(self):
+        """
+        Checks that the derived metrics missing from the readings are
+        computed.
+        """
+        _written = list()
+        _backfill = Backfill(
+            Mock(), lambda: FailingSink(_written), ('dewpoint',))
+        _backfill.run(self._path, Checkpoint(self._checkpoint))
+
+        self.assertEqual(len(_written), 25)
+        self.assertEqual(_written[0].dewpoint, 9.25)
+        self.assertIsNone(_written[0].heatIndex)
+
+
+if __name__ == '__main__':
+    unittest.main()
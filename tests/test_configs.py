@@ -22,7 +22,8 @@ This module tests:
     work as expected;
     * the specific section overrides the GENERAL one;
     * the specific options work as expected;
-    * the command line options override the configuration file.
+    * the command line options override the configuration file;
+    * the parsing of the I2C sensor targets.
 """
 
 import os
@@ -31,6 +32,7 @@ import unittest
 
 from unittest.mock import Mock
 from htu21d_publisher import configuration_parser
+from htu21d_publisher import parse_i2c_targets, format_i2c_target
 from htu21d_publisher import APPLICATION_NAME
 from htu21d_publisher import (
     MQTT_LOCAL_HOST,
@@ -39,7 +41,9 @@ from htu21d_publisher import (
     INFLUXDB_PORT,
     GPS_LOCATION,
     I2C_BUS_NUM,
-    ACQUISITION_INTERVAL)
+    ACQUISITION_INTERVAL,
+    HOUSEKEEPING_TIMEOUT,
+    HTU21D_ADDRESS)
 
 
 COMMANDLINE_PARAMETERS = {
@@ -420,9 +424,11 @@ class TestSpecificOptions(unittest.TestCase):
 
     def setUp(self):
         self._default_interval = 60
+        self._default_timeout = HOUSEKEEPING_TIMEOUT
         self._default_i2c_bus = 1
 
         self._test_interval = 10
+        self._test_timeout = 2.5
         self._test_i2c_bus = 5
 
         self._config_file = '/tmp/config.ini'
@@ -430,6 +436,7 @@ class TestSpecificOptions(unittest.TestCase):
         _f.write("[{:s}]\n".format(APPLICATION_NAME))
         _f.write("htu_interval = {}\n".format(self._test_interval))
         _f.write("hkp_interval = {}\n".format(self._test_interval))
+        _f.write("hkp_timeout = {}\n".format(self._test_timeout))
         _f.write("i2c_bus = {}\n".format(self._test_i2c_bus))
         _f.close()
 
@@ -441,6 +448,7 @@ class TestSpecificOptions(unittest.TestCase):
 
         self.assertIn('htu_interval', _args)
         self.assertIn('hkp_interval', _args)
+        self.assertIn('hkp_timeout', _args)
         self.assertIn('i2c_bus', _args)
 
     def test_specific_default(self):
@@ -451,6 +459,7 @@ class TestSpecificOptions(unittest.TestCase):
 
         self.assertEqual(self._default_interval, _args.htu_interval)
         self.assertEqual(self._default_interval, _args.hkp_interval)
+        self.assertEqual(self._default_timeout, _args.hkp_timeout)
         self.assertEqual(self._default_i2c_bus, _args.i2c_bus)
 
     def test_specific_options(self):
@@ -462,11 +471,43 @@ class TestSpecificOptions(unittest.TestCase):
 
         self.assertEqual(self._test_interval, _args.htu_interval)
         self.assertEqual(self._test_interval, _args.hkp_interval)
+        self.assertEqual(self._test_timeout, _args.hkp_timeout)
         self.assertEqual(self._test_i2c_bus, _args.i2c_bus)
 
     def tearDown(self):
         os.remove(self._config_file)
 
 
+class TestI2CTargets(unittest.TestCase):
+    """
+    Checks the parsing of the I2C sensor targets.
+    """
+
+    def test_default(self):
+        """
+        Checks that an empty list stands for the sensor on the default bus.
+        """
+        _targets = parse_i2c_targets('', 3)
+
+        self.assertEqual(len(_targets), 1)
+        self.assertEqual(_targets[0].bus, 3)
+        self.assertIsNone(_targets[0].channel)
+        self.assertEqual(_targets[0].address, HTU21D_ADDRESS)
+
+    def test_targets(self):
+        """
+        Checks the parsing of buses, multiplexer channels and addresses.
+        """
+        _targets = parse_i2c_targets('1, 3:0 3:7@0x41', I2C_BUS_NUM)
+
+        self.assertEqual(
+            [tuple(_t) for _t in _targets],
+            [(1, None, HTU21D_ADDRESS), (3, 0, HTU21D_ADDRESS),
+             (3, 7, 0x41)])
+        self.assertEqual(
+            [format_i2c_target(_t) for _t in _targets],
+            ['1@0x40', '3:0@0x40', '3:7@0x41'])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+This module tests:
+    * the values of the derived metrics;
+    * that the batches give the same values as the single readings;
+    * that NumPy gives the same values as the math module;
+    * the derived metrics selected for each sink.
+"""
+
+import unittest
+from unittest.mock import patch
+
+import derived
+from htu21d_publisher import HTU21DRecord, select_derived_metrics
+
+
+class TestDerived(unittest.TestCase):
+    """
+    Checks the derived metrics computed from temperature and humidity.
+    """
+
+    def test_values(self):
+        """
+        Checks the metrics against reference values.
+        """
+        _values = derived.compute([20, 30], [50, 70])
+
+        self.assertEqual(_values['dewpoint'], [9.25, 23.92])
+        self.assertEqual(_values['absoluteHumidity'], [8.62, 21.18])
+        self.assertEqual(_values['heatIndex'], [19.36, 35.03])
+        self.assertEqual(_values['vaporPressureDeficit'], [1.16, 1.27])
+
+    def test_batch(self):
+        """
+        Checks that a batch, computed with NumPy when available, gives the
+        values of the single readings.
+        """
+        _temperatures = [-10 + _i * 0.5 for _i in range(100)]
+        _humidities = [(_i * 7) % 101 for _i in range(100)]
+
+        _batch = derived.compute(_temperatures, _humidities)
+        for _i in range(0, 100, 9):
+            _single = derived.compute(
+                [_temperatures[_i]], [_humidities[_i]])
+            for _metric in derived.METRICS:
+                self.assertAlmostEqual(
+                    _batch[_metric][_i], _single[_metric][0], delta=0.011)
+
+    def test_apply(self):
+        """
+        Checks that only the given metrics are set, and not on the failed
+        acquisitions.
+        """
+        _records = [
+            HTU21DRecord('EDGE', temperature=20, relativeHumidity=50),
+            HTU21DRecord('EDGE')]
+
+        derived.apply(_records, ('dewpoint', 'heatIndex'))
+
+        self.assertEqual(_records[0].dewpoint, 9.25)
+        self.assertEqual(_records[0].heatIndex, 19.36)
+        self.assertIsNone(_records[0].absoluteHumidity)
+        self.assertIsNone(_records[1].dewpoint)
+
+    @unittest.skipUnless(derived.numpy, 'NumPy is not installed')
+    def test_numpy(self):
+        """
+        Checks that NumPy and the math module give the same values.
+        """
+        _temperatures = [
+            -20 + _i * 0.7 for _i in range(derived.NUMPY_MIN_BATCH * 2)]
+        _humidities = [(_i * 13) % 101 for _i in range(len(_temperatures))]
+
+        _numpy = derived.compute(_temperatures, _humidities)
+        with patch.object(derived, 'numpy', None):
+            _math = derived.compute(_temperatures, _humidities)
+
+        for _metric in derived.METRICS:
+            self.assertEqual(len(_numpy[_metric]), len(_temperatures))
+            for _n, _m in zip(_numpy[_metric], _math[_metric]):
+                self.assertAlmostEqual(_n, _m, delta=0.011)
+
+    def test_select(self):
+        """
+        Checks the derived metrics sent to InfluxDB and MQTT, and that the
+        record class is left unchanged.
+        """
+        _influxdb_fields = HTU21DRecord.INFLUXDB_FIELDS
+        _mqtt_fields = HTU21DRecord.MQTT_FIELDS
+
+        _selection = select_derived_metrics('heatIndex', 'dewpoint, heatIndex')
+        self.assertEqual(_selection.metrics, ('dewpoint', 'heatIndex'))
+
+        _record = HTU21DRecord(
+            'EDGE', temperature=20, relativeHumidity=50, dewpoint=9.25,
+            heatIndex=19.36, target='1@0x40')
+        self.assertEqual(
+            _record.influxdb_fields(_selection.influxdb_fields['htu21d']), {
+                'temperature': 20, 'relativeHumidity': 50, 'heatIndex': 19.36})
+        self.assertEqual(
+            list(_record.mqtt_fields(_selection.mqtt_fields['htu21d']))[-3:],
+            ['dewpoint', 'heatIndex', 'target'])
+
+        select_derived_metrics('', 'vaporPressureDeficit')
+        self.assertEqual(HTU21DRecord.INFLUXDB_FIELDS, _influxdb_fields)
+        self.assertEqual(HTU21DRecord.MQTT_FIELDS, _mqtt_fields)
+        self.assertEqual(
+            set(_record.influxdb_fields()), set(_influxdb_fields))
+
+        with self.assertRaises(ValueError):
+            select_derived_metrics('dewpoint', 'humidex')
+
+
+if __name__ == '__main__':
+    unittest.main()
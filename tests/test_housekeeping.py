@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+This module tests:
+    * that the housekeeping collectors run concurrently;
+    * that a collector missing its time budget is reported as stale with its
+    last known value;
+    * that each collector instance keeps its own last known values.
+"""
+
+import time
+import threading
+import unittest
+
+from unittest.mock import Mock
+from housekeeping import Collector
+
+
+class TestCollector(unittest.TestCase):
+    """
+    Checks the time budget of the housekeeping collectors.
+    """
+
+    def setUp(self):
+        self._logger = Mock()
+        self._release = threading.Event()
+        self._calls = 0
+        self._collectors = list()
+
+    def tearDown(self):
+        self._release.set()
+        for _collector in self._collectors:
+            _collector.shutdown()
+
+    def _collector(self, collectors, timeout):
+        self._collectors.append(Collector(collectors, timeout, self._logger))
+        return self._collectors[-1]
+
+    def _slow(self):
+        self._calls += 1
+        if self._calls > 1:
+            self._release.wait()
+        return self._calls
+
+    def test_concurrent(self):
+        """
+        Checks that the collection time is bounded by the slowest collector.
+        """
+        _collectors = {
+            'concurrent_{:d}'.format(_i): lambda: time.sleep(0.2) or 1
+            for _i in range(5)}
+
+        _start = time.monotonic()
+        _values, _stale = self._collector(_collectors, 1.0).collect()
+        _elapsed = time.monotonic() - _start
+
+        self.assertLess(_elapsed, 0.8)
+        self.assertEqual(_stale, [])
+        self.assertEqual(set(_values.values()), {1})
+
+    def test_stale(self):
+        """
+        Checks that a late collector is reported with its last value and is
+        not restarted while still running.
+        """
+        _collector = self._collector(
+            {'stale_slow': self._slow, 'stale_fast': lambda: 42}, 0.1)
+
+        _values, _stale = _collector.collect()
+        self.assertEqual(_values, {'stale_slow': 1, 'stale_fast': 42})
+        self.assertEqual(_stale, [])
+
+        _start = time.monotonic()
+        _values, _stale = _collector.collect()
+        self.assertLess(time.monotonic() - _start, 0.5)
+        self.assertEqual(_values, {'stale_slow': 1, 'stale_fast': 42})
+        self.assertEqual(_stale, ['stale_slow'])
+
+        _values, _stale = _collector.collect()
+        self.assertEqual(_stale, ['stale_slow'])
+        self.assertEqual(self._calls, 2)
+
+        self._release.set()
+        time.sleep(0.1)
+        _values, _stale = _collector.collect()
+        self.assertEqual(_values['stale_slow'], 3)
+        self.assertEqual(_stale, [])
+
+    def test_failure(self):
+        """
+        Checks that a failing collector is reported as None.
+        """
+        def _fail():
+            raise OSError('failure')
+
+        _values, _stale = self._collector({'failure': _fail}, 0.1).collect()
+        self.assertEqual(_values, {'failure': None})
+        self.assertEqual(_stale, [])
+        self._logger.error.assert_called()
+
+    def test_instances(self):
+        """
+        Checks that the last known values of a collector are not shared with
+        another instance of the same collectors.
+        """
+        _first = self._collector({'instance': self._slow}, 0.1)
+        _second = self._collector({'instance': self._slow}, 0.1)
+
+        self.assertEqual(_first.collect(), ({'instance': 1}, []))
+        self.assertEqual(_second.collect(), ({'instance': None}, ['instance']))
+        self.assertEqual(_first.collect(), ({'instance': 1}, ['instance']))
+
+
+if __name__ == '__main__':
+    unittest.main()
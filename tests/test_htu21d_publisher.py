@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+This module tests:
+    * that the multiplexer channel of a sensor is deselected after each
+    read;
+    * that a worker process sends its readings and beats its heartbeat,
+    and profiles its task into its own directory;
+    * the stats of the sinks, logged periodically.
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+
+from unittest.mock import Mock, call, patch
+from htu21d_publisher import (
+    HTU21DRecord, I2CTarget, configuration_parser, create_profiler,
+    log_pipeline_stats, read_htu21d, run_worker, start_pipeline_stats)
+from pipeline import Pipeline
+from supervisor import Heartbeat
+
+
+class TestReadHTU21D(unittest.TestCase):
+    """
+    Checks the reads of the sensors behind the I2C multiplexer.
+    """
+
+    def setUp(self):
+        _patcher = patch('htu21d_publisher.I2C')
+        self._mux = _patcher.start().get_i2c_device.return_value
+        self.addCleanup(_patcher.stop)
+
+        _patcher = patch('htu21d_publisher.HTU21D')
+        self._sensor = _patcher.start().HTU21D.return_value
+        self.addCleanup(_patcher.stop)
+
+        self._sensor.read_temperature.return_value = 21.456
+        self._sensor.read_humidity.return_value = 55.123
+
+    def test_deselect(self):
+        """
+        Checks that the channel is selected for the read and deselected
+        after it.
+        """
+        self.assertEqual(
+            read_htu21d(I2CTarget(1, 3, 0x40)), (21.45, 55.12))
+        self.assertEqual(
+            self._mux.writeRaw8.call_args_list, [call(1 << 3), call(0)])
+
+    def test_deselect_failure(self):
+        """
+        Checks that the channel is deselected when the sensor does not
+        respond.
+        """
+        self._sensor.read_humidity.side_effect = IOError('no ack')
+
+        self.assertEqual(read_htu21d(I2CTarget(1, 3, 0x40)), (None, None))
+        self.assertEqual(self._mux.writeRaw8.call_args_list[-1], call(0))
+
+    def test_no_channel(self):
+        """
+        Checks that the multiplexer is not used for a sensor on the bus.
+        """
+        read_htu21d(I2CTarget(1, None, 0x40))
+        self.assertFalse(self._mux.writeRaw8.called)
+
+
+class TestRunWorker(unittest.TestCase):
+    """
+    Checks the sensor task run by a worker process in supervised mode.
+    """
+
+    def test_readings(self):
+        """
+        Checks that the simulated readings are sent over the pipe and that
+        the heartbeat is beaten.
+        """
+        _context = multiprocessing.get_context('spawn')
+        _reader, _writer = _context.Pipe(duplex=False)
+        _heartbeat = Heartbeat(_context, 1)
+        _args = configuration_parser([
+            '--simulate', 'synthetic', '--speed', '0', '--duration', '10',
+            '--htu-interval', '1', '--process-mode', 'supervised'])
+
+        _start = time.monotonic()
+        _process = _context.Process(
+            target=run_worker, daemon=True,
+            args=('htu21d', _writer, _heartbeat, _args))
+        _process.start()
+        _writer.close()
+
+        _readings = list()
+        try:
+            while _reader.poll(30):
+                _readings.append(_reader.recv())
+        except EOFError:
+            pass
+        _process.join(30)
+
+        self.assertEqual(_process.exitcode, 0)
+        self.assertGreaterEqual(len(_readings), 10)
+        for _reading in _readings:
+            self.assertIsInstance(_reading, HTU21DRecord)
+            self.assertIsNotNone(_reading.temperature)
+        self.assertLess(_heartbeat.age, time.monotonic() - _start)
+
+    def test_profiler(self):
+        """
+        Checks that the profiler of a worker writes into the subdirectory
+        named after it.
+        """
+        _directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, _directory)
+        _args = configuration_parser([
+            '--profile-dir', _directory, '--process-mode', 'supervised'])
+
+        _profiler = create_profiler(_args, Mock(), 'htu21d')
+        _profiler.sampler.start()
+        _profiler.sampler.stop()
+
+        _files = os.listdir(os.path.join(_directory, 'htu21d'))
+        self.assertEqual(len(_files), 1)
+        self.assertTrue(_files[0].startswith('samples-'))
+
+
+class TestPipelineStats(unittest.TestCase):
+    """
+    Checks the stats logged for each sink.
+    """
+
+    def setUp(self):
+        self._logger = Mock()
+        self._pipeline = Pipeline(self._logger)
+        self._pipeline.add_sink(Mock(NAME='influxdb-udp', stats='3 sent'))
+        self._pipeline.add_sink(Mock(NAME='mqtt', spec=['NAME']))
+
+    def _logged(self):
+        return [_c[0] for _c in self._logger.info.call_args_list]
+
+    def test_sink_stats(self):
+        """
+        Checks that the counters of a sink are logged after the ones of its
+        worker, by the name of the sink.
+        """
+        log_pipeline_stats(self._logger, self._pipeline, 10)
+
+        _logged = self._logged()
+        self.assertEqual(len(_logged), 3)
+        self.assertEqual(_logged[0][1], 'influxdb-udp')
+        self.assertEqual(_logged[1][1:], ('influxdb-udp', '3 sent'))
+        self.assertEqual(_logged[2][1], 'mqtt')
+
+    def test_periodic(self):
+        """
+        Checks that the stats are logged at each interval until stopped.
+        """
+        _stopped = start_pipeline_stats(self._logger, self._pipeline, 0.05)
+        time.sleep(0.18)
+        _stopped.set()
+        time.sleep(0.1)
+
+        _count = len(self._logged())
+        self.assertGreaterEqual(_count, 3)
+        self.assertEqual(_count % 3, 0)
+        time.sleep(0.1)
+        self.assertEqual(len(self._logged()), _count)
+
+
+if __name__ == '__main__':
+    unittest.main()
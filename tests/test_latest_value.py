@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+This module tests:
+    * the values written to and read from a latest value region;
+    * that a reader never sees a partially written value, also from
+    another process;
+    * that a new region does not truncate the one mapped by the readers;
+    * the slots of the readings published by the local sink.
+"""
+
+import os
+import time
+import fcntl
+import threading
+import unittest
+import multiprocessing
+
+from unittest.mock import Mock
+from latest_value import (
+    LatestValueReader,
+    LatestValueWriter,
+    HEADER)
+from htu21d_publisher import HTU21DRecord
+from sinks import LatestValueSink
+
+
+def _lock_slot(path, locked, seconds):
+    """
+    Holds the lock of the first slot, as a writer in another process.
+    """
+    with open(path, 'r+b') as _f:
+        fcntl.lockf(_f.fileno(), fcntl.LOCK_EX, 128, HEADER.size)
+        locked.set()
+        time.sleep(seconds)
+
+
+class TestLatestValue(unittest.TestCase):
+    """
+    Checks the latest value region.
+    """
+
+    def setUp(self):
+        self._path = '/tmp/test_latest_value.region'
+
+    def tearDown(self):
+        if os.path.exists(self._path):
+            os.remove(self._path)
+
+    def test_values(self):
+        """
+        Checks that the latest value of each name is read, with the number
+        of its updates.
+        """
+        _writer = LatestValueWriter(self._path, slots=2, slot_size=128)
+        _reader = LatestValueReader(self._path)
+
+        self.assertEqual(_reader.read(), {})
+
+        _writer.write('a', {'value': 1})
+        _writer.write('b', {'value': 2})
+        _writer.write('a', {'value': 3})
+        self.assertEqual(
+            _reader.read(), {'a': (2, {'value': 3}), 'b': (1, {'value': 2})})
+
+        with self.assertRaises(IndexError):
+            _writer.write('c', {'value': 4})
+        with self.assertRaises(ValueError):
+            _writer.write('a', {'value': 'x' * 128})
+
+        _reader.close()
+        _writer.close()
+
+    def test_concurrent(self):
+        """
+        Checks that the values read during the writes are consistent.
+        """
+        _writer = LatestValueWriter(self._path, slots=1, slot_size=4096)
+        _reader = LatestValueReader(self._path)
+        _writer.write('a', {'count': 0, 'padding': ''})
+
+        def _write():
+            for _i in range(1, 20001):
+                _writer.write('a', {'count': _i, 'padding': 'x' * (_i % 2000)})
+
+        _thread = threading.Thread(target=_write)
+        _thread.start()
+
+        _reads = list()
+        while _thread.is_alive():
+            _updates, _value = _reader.read()['a']
+            self.assertEqual(_value['count'], _updates - 1)
+            self.assertEqual(len(_value['padding']), _value['count'] % 2000)
+            _reads.append(_updates)
+        _thread.join()
+
+        self.assertEqual(_reads, sorted(_reads))
+        self.assertEqual(_reader.read()['a'][0], 20001)
+
+        _reader.close()
+        _writer.close()
+
+    def test_process_lock(self):
+        """
+        Checks that a slot is not read while locked by another process.
+        """
+        _writer = LatestValueWriter(self._path, slots=1, slot_size=128)
+        _writer.write('a', {'value': 1})
+        _reader = LatestValueReader(self._path)
+
+        _context = multiprocessing.get_context('spawn')
+        _locked = _context.Event()
+        _process = _context.Process(
+            target=_lock_slot, args=(self._path, _locked, 0.3))
+        _process.start()
+        self.assertTrue(_locked.wait(10))
+
+        _start = time.monotonic()
+        self.assertEqual(_reader.read(), {'a': (1, {'value': 1})})
+        self.assertGreater(time.monotonic() - _start, 0.1)
+        _process.join()
+
+        _reader.close()
+        _writer.close()
+
+    def test_replace(self):
+        """
+        Checks that a new region leaves the mapping of the readers of the
+        previous one valid, and that they detect it.
+        """
+        _writer = LatestValueWriter(self._path, slots=2, slot_size=128)
+        _writer.write('a', {'value': 1})
+        _reader = LatestValueReader(self._path)
+        self.assertFalse(_reader.replaced)
+        _writer.close()
+
+        _writer = LatestValueWriter(self._path, slots=1, slot_size=64)
+        self.assertTrue(_reader.replaced)
+        self.assertEqual(_reader.read(), {'a': (1, {'value': 1})})
+        _new_reader = LatestValueReader(self._path)
+        self.assertEqual(_new_reader.read(), {})
+        _new_reader.close()
+        self.assertEqual(
+            [_f for _f in os.listdir(os.path.dirname(self._path))
+             if _f.startswith('test_latest_value.region.')], [])
+
+        _reader.close()
+        _writer.close()
+
+    def test_sink(self):
+        """
+        Checks that the local sink keeps the latest message of each topic
+        and sensor target.
+        """
+        _sink = LatestValueSink(Mock(), self._path)
+        _sink.write([
+            HTU21DRecord('EDGE', timestamp=_i, temperature=20.0 + _i)
+            for _i in range(3)] + [
+            HTU21DRecord('EDGE', {'target': '3:1@0x40'}, timestamp=3,
+                         target='3:1@0x40')])
+
+        _values = LatestValueReader(self._path).read()
+        self.assertEqual(sorted(_values), [
+            'WeatherObserved/EDGE.HTU21D',
+            'WeatherObserved/EDGE.HTU21D/3:1@0x40'])
+
+        _updates, _message = _values['WeatherObserved/EDGE.HTU21D']
+        self.assertEqual(_updates, 1)
+        self.assertEqual(_message['temperature'], 22.0)
+        _sink.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+This module tests:
+    * the readings counted and the latencies measured by the metered sinks;
+    * the report of each sink;
+    * the userdata of the virtual devices.
+"""
+
+import time
+import unittest
+import concurrent.futures
+
+from unittest.mock import Mock, patch
+from htu21d_publisher import HTU21DRecord, configuration_parser
+from loadgen import MeteredSink, fleet_userdata, report
+
+
+def _reading(age):
+    return HTU21DRecord(
+        'EDGE', timestamp=int((time.time() - age) * 10 ** 6))
+
+
+class TestMeteredSink(unittest.TestCase):
+    """
+    Checks the counts and latencies of a wrapped sink.
+    """
+
+    def setUp(self):
+        self._sink = Mock()
+        self._sink.NAME = 'mock'
+        self._metered = MeteredSink(self._sink, 'us')
+
+    def test_write(self):
+        """
+        Checks that the readings are written to the wrapped sink, counted and
+        timed from their acquisition.
+        """
+        _readings = [_reading(0.5), _reading(1.0)]
+        self._metered.write(_readings, 7)
+
+        self._sink.write.assert_called_once_with(_readings, 7)
+        self.assertEqual(self._metered.NAME, 'mock')
+
+        _written, _latencies = self._metered.collect()
+        self.assertEqual(_written, 2)
+        self.assertAlmostEqual(_latencies[0], 0.5, delta=0.1)
+        self.assertAlmostEqual(_latencies[1], 1.0, delta=0.1)
+
+        self.assertEqual(self._metered.collect(), (0, []))
+
+    def test_failure(self):
+        """
+        Checks that the readings of a failed write are not counted.
+        """
+        self._sink.write.side_effect = ConnectionError('down')
+
+        with self.assertRaises(ConnectionError):
+            self._metered.write([_reading(0)])
+        self.assertEqual(self._metered.collect(), (0, []))
+
+    def test_close(self):
+        self._metered.close()
+        self._sink.close.assert_called_once_with()
+
+    def test_stats(self):
+        """
+        Checks that the counters of the wrapped sink are passed through.
+        """
+        self._sink.stats = '3 points sent, 0 dropped'
+        self.assertEqual(self._metered.stats, '3 points sent, 0 dropped')
+        self.assertIsNone(
+            MeteredSink(Mock(NAME='mock', spec=['NAME']), 'us').stats)
+
+
+class TestReport(unittest.TestCase):
+    """
+    Checks the report logged for each sink.
+    """
+
+    def test_report(self):
+        """
+        Checks the throughput and latencies logged, and that the counts are
+        reset.
+        """
+        _logger = Mock()
+        _metered = MeteredSink(Mock(NAME='mock'), 'us')
+        _metered.written = 20
+        _metered.latencies = [0.001 * _i for _i in range(1, 21)]
+
+        report(_logger, [_metered], 10)
+
+        _args = _logger.info.call_args[0]
+        self.assertEqual(_args[1:3], ('mock', 20))
+        self.assertAlmostEqual(_args[3], 2.0)
+        self.assertAlmostEqual(_args[4], 11.0)
+        self.assertAlmostEqual(_args[5], 20.0)
+        self.assertAlmostEqual(_args[6], 20.0)
+        self.assertEqual(_metered.collect(), (0, []))
+
+    def test_no_elapsed(self):
+        _logger = Mock()
+        report(_logger, [MeteredSink(Mock(NAME='mock'), 'us')], 0)
+        self.assertEqual(_logger.info.call_args[0][3], 0)
+
+
+class TestFleetUserdata(unittest.TestCase):
+    """
+    Checks the userdata of the virtual devices.
+    """
+
+    def setUp(self):
+        self._executor = concurrent.futures.ThreadPoolExecutor(2)
+        self.addCleanup(self._executor.shutdown)
+
+    @patch('htu21d_publisher.create_i2c_pollers')
+    def test_devices(self, create_i2c_pollers):
+        """
+        Checks that each device has its own name, source and collector, and
+        that the pollers are created once for the fleet.
+        """
+        _fleet = fleet_userdata(
+            configuration_parser([]), Mock(), Mock(), 3, self._executor)
+        self.addCleanup(
+            lambda: [_u['HKP_COLLECTOR'].shutdown() for _u in _fleet])
+
+        self.assertEqual(
+            [_u['DEVICE'] for _u in _fleet],
+            ['EDGE00000', 'EDGE00001', 'EDGE00002'])
+        self.assertEqual(len(set(id(_u['HKP_COLLECTOR']) for _u in _fleet)), 3)
+        self.assertEqual(
+            len(set(id(_u['SENSOR_READER']) for _u in _fleet)), 3)
+        create_i2c_pollers.assert_called_once()
+        for _userdata in _fleet:
+            self.assertIs(
+                _userdata['I2C_POLLERS'], create_i2c_pollers.return_value)
+
+    def test_real_time(self):
+        """
+        Checks that the synthetic values follow the real time.
+        """
+        _fleet = fleet_userdata(
+            configuration_parser([]), Mock(), Mock(), 1, self._executor)
+        self.addCleanup(_fleet[0]['HKP_COLLECTOR'].shutdown)
+
+        _uptime = _fleet[0]['HKP_COLLECTORS']['uptime']
+        _first = _uptime()
+        time.sleep(0.05)
+        self.assertGreaterEqual(_uptime() - _first, 0.04)
+        self.assertAlmostEqual(
+            _fleet[0]['WALL_CLOCK']() / 10 ** 9, time.time(), delta=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
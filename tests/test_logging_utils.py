@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+This module tests:
+    * that the repeated messages are rate limited;
+    * that the messages below the threshold level are not rate limited;
+    * that the suppressed repetitions are reported when their interval
+    expires and on exit;
+    * that the messages are formatted by the listener thread.
+"""
+
+import time
+import queue
+import logging
+import unittest
+import threading
+import logging.handlers
+
+from logging_utils import LazyQueueHandler, LogListener, RateLimitFilter
+
+
+def _record(level, msg, *args):
+    return logging.LogRecord('test', level, __file__, 0, msg, args, None)
+
+
+class TestRateLimitFilter(unittest.TestCase):
+    """
+    Checks the suppression of the repeated messages.
+    """
+
+    def test_repeated(self):
+        """
+        Checks that the repetitions are suppressed and then reported.
+        """
+        _filter = RateLimitFilter(interval=0.1)
+
+        self.assertTrue(_filter.filter(_record(logging.ERROR, 'down %s', 1)))
+        for _i in range(5):
+            self.assertFalse(
+                _filter.filter(_record(logging.ERROR, 'down %s', 1)))
+        self.assertTrue(_filter.filter(_record(logging.ERROR, 'down %s', 2)))
+
+        time.sleep(0.1)
+        _last = _record(logging.ERROR, 'down %s', 1)
+        self.assertTrue(_filter.filter(_last))
+        self.assertIn('down 1 (repeated 5 times', _last.getMessage())
+
+    def test_level(self):
+        """
+        Checks that the messages below WARNING are not suppressed.
+        """
+        _filter = RateLimitFilter(interval=10)
+
+        for _i in range(5):
+            self.assertTrue(_filter.filter(_record(logging.INFO, 'info')))
+
+    def test_flush(self):
+        """
+        Checks that the repetitions are reported once their interval has
+        expired, or all of them when forced.
+        """
+        _filter = RateLimitFilter(interval=0.1)
+
+        for _msg in ['first', 'first', 'first', 'second', 'second', 'third']:
+            _filter.filter(_record(logging.ERROR, _msg))
+
+        self.assertEqual(_filter.flush(), [])
+        time.sleep(0.1)
+        _filter.filter(_record(logging.ERROR, 'third'))
+        _filter.filter(_record(logging.ERROR, 'third'))
+
+        _reports = _filter.flush()
+        self.assertEqual(
+            [_r.getMessage()[:28] for _r in _reports],
+            ['first (repeated 2 times in t', 'second (repeated 1 times in '])
+        self.assertEqual(_reports[0].levelno, logging.ERROR)
+        self.assertEqual(_reports[0].name, 'test')
+
+        self.assertEqual(
+            [_r.getMessage()[:27] for _r in _filter.flush(force=True)],
+            ['third (repeated 1 times in '])
+        self.assertEqual(_filter.flush(force=True), [])
+
+
+class TestLogListener(unittest.TestCase):
+    """
+    Checks the reports of the suppressed repetitions written by the
+    listener.
+    """
+
+    def setUp(self):
+        self._queue = queue.SimpleQueue()
+        self._filter = RateLimitFilter(interval=0.2)
+        self._handler = logging.handlers.QueueHandler(self._queue)
+        self._handler.addFilter(self._filter)
+
+        self._written = list()
+        _target = logging.Handler()
+        _target.emit = lambda _r: self._written.append(_r.getMessage())
+
+        self._listener = LogListener(
+            self._queue, self._handler, self._filter, _target)
+        self._listener.start()
+
+    def _log(self, msg, count):
+        for _i in range(count):
+            self._handler.handle(_record(logging.WARNING, msg))
+
+    def test_expired(self):
+        """
+        Checks that the repetitions are reported once their interval expires,
+        without a further occurrence.
+        """
+        self._log('timeout', 4)
+        time.sleep(0.5)
+        self.assertEqual(len(self._written), 2)
+        self.assertIn('timeout (repeated 3 times', self._written[1])
+        self._listener.stop()
+
+    def test_stop(self):
+        """
+        Checks that the repetitions are reported on stop.
+        """
+        self._log('timeout', 3)
+        self._listener.stop()
+        self.assertEqual(len(self._written), 2)
+        self.assertIn('timeout (repeated 2 times', self._written[1])
+
+
+class TestLazyQueueHandler(unittest.TestCase):
+    """
+    Checks that the records are formatted by the listener.
+    """
+
+    def test_listener_thread(self):
+        """
+        Checks that the arguments are merged and formatted in the thread of
+        the listener, not in the one logging.
+        """
+        _queue = queue.SimpleQueue()
+        _threads = list()
+
+        class _Argument(object):
+            def __str__(self):
+                _threads.append(threading.current_thread())
+                return 'argument'
+
+        _written = list()
+        _target = logging.Handler()
+        _target.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+        _target.emit = lambda _r: _written.append(_target.format(_r))
+
+        _listener = logging.handlers.QueueListener(_queue, _target)
+        _listener.start()
+        LazyQueueHandler(_queue).handle(
+            _record(logging.INFO, 'with %s', _Argument()))
+        _listener.stop()
+
+        self.assertEqual(_written, ['INFO with argument'])
+        self.assertEqual(len(_threads), 1)
+        self.assertIsNot(_threads[0], threading.current_thread())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,438 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+This module tests:
+    * that the readings are delivered to every sink of the pipeline, or
+    only to the sinks of their kind;
+    * the overflow policies of the sink workers, and that the spilled
+    readings are read back as records;
+    * that the failed deliveries are retried, and the rejected ones are
+    not;
+    * that the batches grow with the backlog;
+    * the circuit breaker of the sinks, and that the readings of a dead
+    sink are kept in its spill file on exit;
+    * the precision of the timestamps, and their conversion when the
+    readings are read back.
+"""
+
+import os
+import time
+import datetime
+import threading
+import unittest
+
+from unittest.mock import Mock
+from records import Record
+from pipeline import (
+    CircuitBreaker,
+    Pipeline,
+    RejectedError,
+    SinkWorker,
+    SpillFile,
+    dump_reading,
+    load_reading,
+    wall_clock,
+    DROP_OLDEST,
+    BLOCK,
+    SPILL,
+    CLOSED,
+    OPEN,
+    HALF_OPEN)
+
+
+class ListSink(object):
+    NAME = 'list'
+
+    def __init__(self):
+        self.readings = list()
+        self.release = threading.Event()
+        self.release.set()
+        self.closed = False
+
+    def write(self, readings, backlog=0):
+        self.release.wait()
+        self.readings.extend(readings)
+
+    def close(self):
+        self.closed = True
+
+
+class TestRecord(Record):
+    FIELDS = ('timestamp', 'value')
+    __slots__ = FIELDS
+
+    KIND = 'test'
+
+
+def _reading(index):
+    return TestRecord('EDGE', timestamp=index, value=index)
+
+
+class TestPipeline(unittest.TestCase):
+    """
+    Checks the delivery of the readings to the sinks.
+    """
+
+    def setUp(self):
+        self._logger = Mock()
+        self._spill_path = '/tmp/test_pipeline.spill'
+
+    def test_delivery(self):
+        """
+        Checks that every sink receives all the readings in order.
+        """
+        _sinks = [ListSink(), ListSink()]
+        _pipeline = Pipeline(self._logger)
+        for _sink in _sinks:
+            _pipeline.add_sink(_sink)
+
+        _pipeline.start()
+        for _i in range(500):
+            _pipeline.put(_reading(_i))
+        _pipeline.stop()
+
+        for _sink in _sinks:
+            self.assertEqual(
+                [_r.timestamp for _r in _sink.readings], list(range(500)))
+            self.assertTrue(_sink.closed)
+        for _worker in _pipeline.workers:
+            self.assertEqual(_worker.sink_name, 'list')
+
+    def test_kinds(self):
+        """
+        Checks that a sink added with a set of kinds only receives those.
+        """
+        _all, _other = ListSink(), ListSink()
+        _pipeline = Pipeline(self._logger)
+        _pipeline.add_sink(_all)
+        _pipeline.add_sink(_other, kinds=['other'])
+
+        _pipeline.start()
+        for _i in range(10):
+            _pipeline.put(_reading(_i))
+        _pipeline.stop()
+
+        self.assertEqual(len(_all.readings), 10)
+        self.assertEqual(_other.readings, [])
+
+    def test_drop_oldest(self):
+        """
+        Checks that the oldest readings are discarded on overflow.
+        """
+        _sink = ListSink()
+        _worker = SinkWorker(_sink, self._logger, queue_size=10,
+                             policy=DROP_OLDEST)
+
+        for _i in range(25):
+            _worker.put(_reading(_i))
+
+        self.assertEqual(_worker.dropped, 15)
+        _worker.start()
+        _worker.stop()
+        _worker.join()
+        self.assertEqual(
+            [_r.timestamp for _r in _sink.readings], list(range(15, 25)))
+
+    def test_block(self):
+        """
+        Checks that the producer waits for the sink on overflow.
+        """
+        _sink = ListSink()
+        _sink.release.clear()
+        _worker = SinkWorker(_sink, self._logger, queue_size=10,
+                             policy=BLOCK, batch_size=10)
+        _worker.start()
+
+        _producer = threading.Thread(
+            target=lambda: [_worker.put(_reading(_i)) for _i in range(25)])
+        _producer.start()
+        _producer.join(0.2)
+        self.assertTrue(_producer.is_alive())
+
+        _sink.release.set()
+        _producer.join()
+        _worker.stop()
+        _worker.join()
+        self.assertEqual(_worker.dropped, 0)
+        self.assertEqual(
+            [_r.timestamp for _r in _sink.readings], list(range(25)))
+
+    def test_spill(self):
+        """
+        Checks that the readings are spilled to disk on overflow and
+        delivered in order when the sink catches up.
+        """
+        _sink = ListSink()
+        _worker = SinkWorker(_sink, self._logger, queue_size=10,
+                             policy=SPILL, spill_path=self._spill_path)
+
+        for _i in range(25):
+            _worker.put(_reading(_i))
+
+        self.assertTrue(os.path.exists(self._spill_path))
+        self.assertEqual(_worker.backlog, 25)
+
+        # The spill file is not read back once stopped
+        _worker.start()
+        _deadline = time.monotonic() + 5
+        while _worker.delivered < 25 and time.monotonic() < _deadline:
+            time.sleep(0.01)
+        _worker.stop()
+        _worker.join()
+        self.assertEqual(
+            [_r.timestamp for _r in _sink.readings], list(range(25)))
+        self.assertEqual(
+            [_r.value for _r in _sink.readings], list(range(25)))
+        self.assertTrue(
+            all(isinstance(_r, TestRecord) for _r in _sink.readings))
+        self.assertFalse(os.path.exists(self._spill_path))
+
+    def test_retry(self):
+        """
+        Checks that a failed batch is delivered again, before the newer
+        readings.
+        """
+        _sink = ListSink()
+        _sink.write = Mock(side_effect=[OSError('failure'), None, None])
+        _worker = SinkWorker(_sink, self._logger, batch_size=5,
+                             retry_interval=0.01)
+
+        for _i in range(10):
+            _worker.put(_reading(_i))
+
+        _worker.start()
+        _worker.stop()
+        _worker.join()
+
+        _batches = [
+            [_r.timestamp for _r in _c[0][0]]
+            for _c in _sink.write.call_args_list]
+        self.assertEqual(_batches, [
+            [0, 1, 2, 3, 4], [0, 1, 2, 3, 4], [5, 6, 7, 8, 9]])
+        self.assertEqual(_worker.delivered, 10)
+
+    def test_batch_growth(self):
+        """
+        Checks that the batches double while the sink is behind, up to the
+        max batch size, and shrink back once it has caught up.
+        """
+        _sink = ListSink()
+        _sink.write = Mock()
+        _worker = SinkWorker(_sink, self._logger, queue_size=100,
+                             batch_size=5, max_batch_size=20)
+
+        for _i in range(60):
+            _worker.put(_reading(_i))
+
+        _worker.start()
+        _worker.stop()
+        _worker.join()
+
+        self.assertEqual(
+            [len(_c[0][0]) for _c in _sink.write.call_args_list],
+            [5, 10, 20, 20, 5])
+        self.assertEqual(_worker.delivered, 60)
+
+    def test_rejected(self):
+        """
+        Checks that a rejected batch is counted as failed and not retried,
+        and does not count against the circuit breaker.
+        """
+        _sink = ListSink()
+        _sink.write = Mock(side_effect=[RejectedError('malformed'), None])
+        _worker = SinkWorker(_sink, self._logger, batch_size=5,
+                             retry_interval=60)
+
+        for _i in range(10):
+            _worker.put(_reading(_i))
+
+        _start = time.monotonic()
+        _worker.start()
+        _worker.stop()
+        _worker.join()
+
+        self.assertLess(time.monotonic() - _start, 1)
+        self.assertEqual(_sink.write.call_count, 2)
+        self.assertEqual(
+            [_r.timestamp for _r in _sink.write.call_args[0][0]],
+            [5, 6, 7, 8, 9])
+        self.assertEqual(_worker.failed, 5)
+        self.assertEqual(_worker.delivered, 5)
+        self.assertEqual(_worker.breaker.failures, 0)
+
+    def test_dead_sink(self):
+        """
+        Checks that the readings are not delivered on exit to a sink whose
+        circuit is open.
+        """
+        _sink = ListSink()
+        _sink.write = Mock(side_effect=OSError('failure'))
+        _worker = SinkWorker(_sink, self._logger, batch_size=5,
+                             retry_interval=0.01, breaker_threshold=2,
+                             max_backoff=60)
+
+        for _i in range(20):
+            _worker.put(_reading(_i))
+
+        _worker.start()
+        time.sleep(0.5)
+        self.assertEqual(_worker.breaker.state, OPEN)
+
+        _start = time.monotonic()
+        _worker.stop()
+        _worker.join()
+
+        self.assertLess(time.monotonic() - _start, 1)
+        self.assertEqual(_sink.write.call_count, _worker.breaker.failures)
+        self.assertEqual(_worker.failed, 20)
+
+    def test_dead_sink_spill(self):
+        """
+        Checks that the readings not delivered on exit are kept in order in
+        the spill file, whether the circuit is open or a batch fails once
+        stopped.
+        """
+        for _threshold, _running in [(2, 0.5), (100, 0)]:
+            _sink = ListSink()
+            _sink.write = Mock(side_effect=OSError('failure'))
+            _worker = SinkWorker(
+                _sink, self._logger, queue_size=10, policy=SPILL,
+                spill_path=self._spill_path, batch_size=5,
+                retry_interval=0.01, breaker_threshold=_threshold,
+                max_backoff=60)
+
+            for _i in range(25):
+                _worker.put(_reading(_i))
+
+            _worker.start()
+            time.sleep(_running)
+            _worker.stop()
+            _worker.join()
+
+            self.assertGreater(_sink.write.call_count, 0)
+            self.assertEqual(_worker.failed, 0)
+            self.assertEqual(_worker.backlog, 25)
+            self.assertEqual(
+                [_r.timestamp for _r in
+                 SpillFile(self._spill_path).read(100)], list(range(25)))
+            self.assertFalse(os.path.exists(self._spill_path))
+
+    def tearDown(self):
+        if os.path.exists(self._spill_path):
+            os.remove(self._spill_path)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    """
+    Checks the states of the circuit breaker.
+    """
+
+    def setUp(self):
+        self._now = 0.0
+        self._breaker = CircuitBreaker(
+            threshold=3, retry_interval=5, max_backoff=30,
+            clock=lambda: self._now)
+
+    def test_backoff(self):
+        """
+        Checks that the circuit opens after the threshold, with a backoff
+        doubling up to the max.
+        """
+        self.assertEqual(
+            [self._breaker.failure() for _i in range(7)],
+            [5, 5, 5, 10, 20, 30, 30])
+        self.assertEqual(self._breaker.state, OPEN)
+
+        self._now += 30
+        self.assertEqual(self._breaker.state, HALF_OPEN)
+
+    def test_close(self):
+        """
+        Checks that a success closes the circuit and resets the backoff.
+        """
+        self._breaker.failure()
+        self.assertEqual(self._breaker.state, CLOSED)
+        self.assertFalse(self._breaker.success())
+
+        for _i in range(4):
+            self._breaker.failure()
+        self._now += 10
+        self.assertTrue(self._breaker.success())
+        self.assertEqual(self._breaker.state, CLOSED)
+        self.assertEqual(self._breaker.failure(), 5)
+
+
+class TestWallClock(unittest.TestCase):
+    """
+    Checks the precision of the timestamps.
+    """
+
+    def test_precisions(self):
+        """
+        Checks that the timestamp and the date are consistent for each
+        precision.
+        """
+        for _precision, _ticks in [('s', 1), ('ms', 10 ** 3),
+                                   ('us', 10 ** 6), ('ns', 10 ** 9)]:
+            _timestamp, _date = wall_clock(_precision)
+
+            self.assertIsInstance(_timestamp, int)
+            self.assertAlmostEqual(_timestamp / _ticks, time.time(), delta=1)
+            self.assertAlmostEqual(
+                datetime.datetime.fromisoformat(_date).timestamp(),
+                _timestamp / _ticks, delta=1e-6 if _ticks > 1 else 0)
+
+    def test_date_format(self):
+        """
+        Checks that the dates have a fractional part only when needed.
+        """
+        self.assertNotIn('.', wall_clock('s')[1])
+        self.assertEqual(len(wall_clock('ms')[1].split('.')[1]), 9)
+        self.assertEqual(len(wall_clock('us')[1].split('.')[1]), 12)
+
+    def test_conversion(self):
+        """
+        Checks that the timestamps are read back in the requested precision,
+        and taken as in it when stored without precision.
+        """
+        _line = dump_reading(_reading(1500), 'ms')
+
+        self.assertEqual(load_reading(_line, 'us').timestamp, 1500000)
+        self.assertEqual(load_reading(_line, 's').timestamp, 1)
+        self.assertEqual(load_reading(_line, 'ms').value, 1500)
+
+        _legacy = '{"kind": "test", "device": "EDGE", "timestamp": 7, ' \
+            '"fields": {"timestamp": 7, "value": 7}, "tags": {}}'
+        self.assertEqual(load_reading(_legacy, 'ns').timestamp, 7)
+
+    def test_spill_conversion(self):
+        """
+        Checks that a spill file left by a run with another precision is
+        read back in the current one.
+        """
+        _path = '/tmp/test_pipeline_precision.spill'
+        self.addCleanup(lambda: os.path.exists(_path) and os.remove(_path))
+
+        SpillFile(_path, 's').append(_reading(2))
+        self.assertEqual(
+            [_r.timestamp for _r in SpillFile(_path, 'ms').read(10)], [2000])
+
+
+if __name__ == '__main__':
+    unittest.main()
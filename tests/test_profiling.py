@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+This module tests:
+    * that only the selected tasks are profiled;
+    * that the profiles and the samples are written to the directory, the
+    samples of all the threads;
+    * that only the latest memory snapshots are kept.
+"""
+
+import os
+import time
+import pstats
+import shutil
+import threading
+import unittest
+import tracemalloc
+
+from unittest.mock import Mock
+from profiling import MemoryTracker, Profiler, SamplingProfiler
+
+
+def profiled_task():
+    return sum(range(1000))
+
+
+def other_task():
+    pass
+
+
+class TestProfiler(unittest.TestCase):
+    """
+    Checks the profiling of the tasks.
+    """
+
+    def setUp(self):
+        self._directory = '/tmp/test_profiling'
+        self._logger = Mock()
+
+    def test_wrap(self):
+        """
+        Checks that the selected task is profiled and its stats dumped every
+        given number of runs.
+        """
+        _profiler = Profiler(
+            self._directory, self._logger, tasks=['profiled_task'], every=5)
+
+        self.assertIs(_profiler.wrap(other_task), other_task)
+
+        _task = _profiler.wrap(profiled_task)
+        self.assertEqual(_task.__name__, 'profiled_task')
+        for _i in range(4):
+            self.assertEqual(_task(), 499500)
+
+        _path = os.path.join(self._directory, 'profiled_task.prof')
+        self.assertFalse(os.path.exists(_path))
+        _task()
+        self.assertTrue(os.path.exists(_path))
+        _calls = {
+            _func[2]: _stats[1]
+            for _func, _stats in pstats.Stats(_path).stats.items()}
+        self.assertEqual(_calls['profiled_task'], 5)
+
+    def test_sampling(self):
+        """
+        Checks that the samples are written when the sampler is stopped.
+        """
+        os.makedirs(self._directory)
+        _sampler = SamplingProfiler(self._directory, self._logger, 0.001)
+
+        _sampler.toggle()
+        _end = time.monotonic() + 0.1
+        while time.monotonic() < _end:
+            profiled_task()
+        _sampler.stop()
+
+        _files = os.listdir(self._directory)
+        self.assertEqual(len(_files), 1)
+        with open(os.path.join(self._directory, _files[0])) as _f:
+            self.assertIn('test_sampling', _f.read())
+
+    def test_sampling_threads(self):
+        """
+        Checks that the stacks of the other threads are sampled too, under
+        the name of their thread.
+        """
+        os.makedirs(self._directory)
+        _sampler = SamplingProfiler(self._directory, self._logger, 0.001)
+
+        _stop = threading.Event()
+        _worker = threading.Thread(
+            target=lambda: _stop.wait(1), name='test-worker')
+        _worker.start()
+
+        _sampler.start()
+        time.sleep(0.05)
+        _sampler.stop()
+        _stop.set()
+        _worker.join()
+
+        with open(os.path.join(
+                self._directory, os.listdir(self._directory)[0])) as _f:
+            _stacks = [_l.rsplit(' ', 1)[0] for _l in _f]
+
+        self.assertTrue(any(
+            _s.startswith('test-worker;') and ':wait:' in _s
+            for _s in _stacks))
+        self.assertTrue(any(_s.startswith('MainThread;') for _s in _stacks))
+        self.assertFalse(any(_s.startswith('sampler;') for _s in _stacks))
+
+    def test_memory(self):
+        """
+        Checks that the snapshots are dumped and only the latest ones kept,
+        leaving the ones of the other processes.
+        """
+        os.makedirs(self._directory)
+        _other = os.path.join(self._directory, 'tracemalloc-1-0001.snap')
+        open(_other, 'w').close()
+
+        _tracker = MemoryTracker(self._directory, self._logger, keep=2)
+        self.addCleanup(tracemalloc.stop)
+
+        _data = list()
+        for _i in range(4):
+            _data.append(bytearray(10000))
+            _tracker.snapshot()
+
+        _pid = os.getpid()
+        self.assertEqual(sorted(os.listdir(self._directory)), sorted([
+            'tracemalloc-1-0001.snap',
+            'tracemalloc-{:d}-0003.snap'.format(_pid),
+            'tracemalloc-{:d}-0004.snap'.format(_pid)]))
+        self.assertIsInstance(
+            tracemalloc.Snapshot.load(os.path.join(
+                self._directory, 'tracemalloc-{:d}-0004.snap'.format(_pid))),
+            tracemalloc.Snapshot)
+        self.assertTrue(any(
+            _c[0][0] == "Memory growth: %s"
+            for _c in self._logger.info.call_args_list))
+
+    def tearDown(self):
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+This module tests:
+    * the fields of the records sent to each sink;
+    * the dictionary form of the records written to the files.
+"""
+
+import unittest
+
+from records import from_dict
+from housekeeping import HousekeepingRecord
+from htu21d_publisher import HTU21DRecord
+
+
+class TestRecords(unittest.TestCase):
+    """
+    Checks the layout of the records.
+    """
+
+    def setUp(self):
+        self._record = HTU21DRecord(
+            'EDGE', timestamp=10, temperature=20.5, relativeHumidity=50.0,
+            dewpoint=9.7)
+
+    def test_slots(self):
+        """
+        Checks that the records have no per instance dictionary.
+        """
+        self.assertFalse(hasattr(self._record, '__dict__'))
+        self.assertFalse(hasattr(HousekeepingRecord('EDGE'), '__dict__'))
+
+        with self.assertRaises(AttributeError):
+            self._record.pressure = 1013
+
+    def test_sink_fields(self):
+        """
+        Checks the fields sent to InfluxDB and MQTT, the sensor target being
+        left out when not set.
+        """
+        self.assertEqual(self._record.influxdb_fields(), {
+            'temperature': 20.5, 'relativeHumidity': 50.0, 'dewpoint': 9.7,
+            'absoluteHumidity': None, 'heatIndex': None,
+            'vaporPressureDeficit': None})
+        self.assertNotIn('target', self._record.mqtt_fields())
+        self.assertNotIn('dewpoint', self._record.mqtt_fields())
+
+        self._record.target = '1@0x40'
+        self.assertEqual(self._record.mqtt_fields()['target'], '1@0x40')
+
+    def test_dict(self):
+        """
+        Checks that a record is rebuilt from its dictionary form.
+        """
+        self._record.tags = {'target': '1@0x40'}
+        _dict = self._record.as_dict('ms')
+
+        self.assertEqual(_dict['kind'], 'htu21d')
+        self.assertEqual(_dict['timestamp'], 10)
+        self.assertEqual(_dict['precision'], 'ms')
+
+        _record = from_dict(_dict)
+        self.assertIsInstance(_record, HTU21DRecord)
+        self.assertEqual(_record.fields, self._record.fields)
+        self.assertEqual(_record.tags, {'target': '1@0x40'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+This module tests, on a virtual clock:
+    * that the periodic tasks run on their deadlines without drifting;
+    * that the missed runs of a late task are skipped;
+    * the priorities of the tasks and the duration of the run.
+"""
+
+import time
+import unittest
+
+from continuous_scheduler import MainScheduler
+from simulation import VirtualClock
+
+
+class SchedulerHarness(object):
+    """
+    Runs the scheduler on a virtual clock, recording the runs of the tasks.
+    A task lasts the given (virtual) seconds, a function of its run number.
+    """
+
+    def __init__(self):
+        self.clock = VirtualClock(speed=0, start=0)
+        self.scheduler = MainScheduler(self.clock.time, self.clock.sleep)
+        self.runs = list()
+
+    def add_task(self, name, delay, period, priority=0, duration=None):
+        _count = [0]
+        _wrapper = None
+
+        def _task():
+            self.runs.append(
+                (name, self.clock.time(), self.clock.time() -
+                 _wrapper.deadline))
+            if duration is not None:
+                self.clock.sleep(duration(_count[0]))
+            _count[0] += 1
+
+        _wrapper = self.scheduler.add_task(_task, delay, period, priority)
+
+    def times(self, name):
+        return [_t for _n, _t, _l in self.runs if _n == name]
+
+    def lateness(self, name):
+        return [_l for _n, _t, _l in self.runs if _n == name]
+
+
+class TestScheduler(unittest.TestCase):
+    """
+    Checks the timing of the scheduler.
+    """
+
+    def setUp(self):
+        self._harness = SchedulerHarness()
+
+    def test_periods(self):
+        """
+        Checks that thousands of periods are run in milliseconds, on the
+        deadlines, when the tasks last a fraction of the period.
+        """
+        self._harness.add_task('task', 0, 0.5, duration=lambda _n: 0.3)
+
+        _start = time.monotonic()
+        self._harness.scheduler.start(10000)
+
+        self.assertLess(time.monotonic() - _start, 1)
+        self.assertEqual(
+            self._harness.times('task'),
+            [_i * 0.5 for _i in range(20000)])
+        self.assertEqual(max(self._harness.lateness('task')), 0)
+
+    def test_overrun(self):
+        """
+        Checks that the runs missed by a late task are skipped, and the next
+        one is on the deadlines of the original schedule.
+        """
+        self._harness.add_task(
+            'task', 0, 10, duration=lambda _n: 25 if _n == 2 else 1)
+        self._harness.scheduler.start(100)
+
+        self.assertEqual(
+            self._harness.times('task'),
+            [0, 10, 20, 50, 60, 70, 80, 90])
+
+    def test_late(self):
+        """
+        Checks the lateness of a task delayed by another one.
+        """
+        self._harness.add_task(
+            'slow', 0, 60, priority=0, duration=lambda _n: 3)
+        self._harness.add_task('fast', 0, 1, priority=1)
+        self._harness.scheduler.start(120)
+
+        # The runs due at 1, 2 and 61, 62 are skipped
+        self.assertEqual(
+            self._harness.times('fast'),
+            [3] + list(range(3, 60)) + [63] + list(range(63, 120)))
+        self.assertEqual(
+            [_l for _l in self._harness.lateness('fast') if _l], [3, 3])
+
+    def test_priorities(self):
+        """
+        Checks that the tasks due at the same time run by priority, and that
+        the scheduler stops before the tasks due at the end of the run.
+        """
+        self._harness.add_task('low', 0, 10, priority=2)
+        self._harness.add_task('high', 0, 10, priority=1)
+        self._harness.scheduler.start(30)
+
+        self.assertEqual(
+            [(_n, _t) for _n, _t, _l in self._harness.runs],
+            [('high', 0), ('low', 0), ('high', 10), ('low', 10),
+             ('high', 20), ('low', 20)])
+        self.assertEqual(self._harness.clock.time(), 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+This module tests:
+    * that the scheduler runs on the virtual clock;
+    * the replay of a trace file.
+"""
+
+import os
+import json
+import time
+import unittest
+
+from continuous_scheduler import MainScheduler
+from simulation import VirtualClock, TraceSource, SyntheticSource
+
+
+class TestVirtualClock(unittest.TestCase):
+    """
+    Checks the scheduler on the virtual clock.
+    """
+
+    def test_accelerated(self):
+        """
+        Checks that a simulated day is run as fast as possible.
+        """
+        _clock = VirtualClock(speed=0, start=0)
+        _runs = list()
+
+        _scheduler = MainScheduler(_clock.time, _clock.sleep)
+        _scheduler.add_task(lambda: _runs.append(_clock.time()), 0, 60, 0)
+
+        _start = time.monotonic()
+        _scheduler.start(24 * 60 * 60)
+
+        self.assertLess(time.monotonic() - _start, 1)
+        self.assertEqual(len(_runs), 24 * 60)
+        self.assertEqual(_runs[-1], 24 * 60 * 60 - 60)
+        self.assertEqual(_clock.time_ns(), 24 * 60 * 60 * 10 ** 9)
+
+    def test_synthetic(self):
+        """
+        Checks that the synthetic values are in a plausible range.
+        """
+        _source = SyntheticSource(VirtualClock(speed=0), seed=1)
+
+        _temperature, _humidity = _source.read_htu21d('1@0x40')
+        self.assertTrue(10 < _temperature < 30)
+        self.assertTrue(0 < _humidity < 100)
+
+
+class TestTraceSource(unittest.TestCase):
+    """
+    Checks the replay of a trace file.
+    """
+
+    def setUp(self):
+        self._trace_file = '/tmp/test_trace.jsonl'
+
+        with open(self._trace_file, 'w') as _f:
+            for _i in range(3):
+                _f.write(json.dumps({
+                    'kind': 'htu21d', 'device': 'EDGE', 'timestamp': _i,
+                    'fields': {'temperature': _i, 'relativeHumidity': 50,
+                               'dewpoint': 10},
+                    'tags': {}}) + '\n')
+                _f.write(json.dumps({
+                    'kind': 'housekeeping', 'device': 'EDGE', 'timestamp': _i,
+                    'fields': {'cpuLoad': _i, 'memoryFree': 100 + _i},
+                    'tags': {}}) + '\n')
+
+    def test_replay(self):
+        """
+        Checks that the readings are replayed in order and cyclically.
+        """
+        _source = TraceSource(self._trace_file)
+
+        self.assertEqual(
+            [_source.read_htu21d('1@0x40')[0] for _i in range(4)],
+            [0, 1, 2, 0])
+
+        _collectors = _source.housekeeping_collectors()
+        for _i in range(3):
+            self.assertEqual(_collectors['cpuLoad'](), _i)
+            self.assertEqual(_collectors['memoryFree'](), 100 + _i)
+        self.assertIsNone(_collectors['swapFree']())
+
+    def tearDown(self):
+        os.remove(self._trace_file)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+This module tests:
+    * the messages published by the MQTT sink;
+    * the batch mode of the MQTT sink, also when draining the backlog of
+    its worker;
+    * the QoS of the MQTT topics and the wait for the acknowledgements, not
+    mistaken for the callbacks of the QoS 0 messages;
+    * that the InfluxDB sink reports the rejected requests;
+    * the datagrams sent by the InfluxDB UDP sink.
+"""
+
+import json
+import socket
+import itertools
+import unittest
+import influxdb.exceptions
+
+from unittest.mock import Mock, patch
+from htu21d_publisher import HTU21DRecord
+from housekeeping import HousekeepingRecord
+from pipeline import RejectedError, SinkWorker
+from sinks import (
+    InfluxDBSink,
+    InfluxDBUDPSink,
+    MQTTSink,
+    parse_mqtt_qos,
+    ARRAY,
+    COLUMNAR)
+
+
+def _reading(index):
+    return HTU21DRecord(
+        'EDGE', timestamp=index, temperature=20.0 + index,
+        relativeHumidity=50.0, dewpoint=9.0)
+
+
+class TestMQTTSink(unittest.TestCase):
+    """
+    Checks the messages published by the MQTT sink.
+    """
+
+    def setUp(self):
+        self._logger = Mock()
+        self._readings = [_reading(_i) for _i in range(50)]
+
+        _patcher = patch('paho.mqtt.client.Client')
+        self._client = _patcher.start().return_value
+        self.addCleanup(_patcher.stop)
+
+        _mids = itertools.count(1)
+        self._client.publish.side_effect = (
+            lambda topic, payload, qos: Mock(rc=0, mid=next(_mids)))
+
+    def _connected(self, sink):
+        sink._on_connect(
+            None, None, Mock(session_present=False), Mock(is_failure=False),
+            None)
+        return sink
+
+    def _published(self, sink, backlog):
+        self._connected(sink)
+        sink.write(self._readings, backlog)
+        return [
+            {'topic': _c[0][0], 'payload': _c[0][1], 'qos': _c[1]['qos']}
+            for _c in self._client.publish.call_args_list]
+
+    def test_single(self):
+        """
+        Checks that a message is published for each reading below the batch
+        threshold.
+        """
+        _sink = MQTTSink(self._logger, 'localhost', 1883, batch_threshold=100)
+        _msgs = self._published(_sink, 10)
+
+        self.assertEqual(len(_msgs), 50)
+        self.assertEqual(_msgs[0]['topic'], 'WeatherObserved/EDGE.HTU21D')
+        self.assertEqual(json.loads(_msgs[0]['payload']), {
+            'dateObserved': None, 'timestamp': 0, 'longitude': None,
+            'latitude': None, 'temperature': 20.0, 'relativeHumidity': 50.0})
+
+    def test_array(self):
+        """
+        Checks that the readings are packed in arrays of bounded size.
+        """
+        _sink = MQTTSink(self._logger, 'localhost', 1883, batch_threshold=100,
+                         batch_size=1024, batch_layout=ARRAY)
+        _msgs = self._published(_sink, 100)
+
+        self.assertGreater(len(_msgs), 1)
+        self.assertLess(len(_msgs), 50)
+
+        _messages = list()
+        for _msg in _msgs:
+            self.assertLessEqual(len(_msg['payload']), 1024)
+            _messages.extend(json.loads(_msg['payload']))
+        self.assertEqual(
+            [_m['timestamp'] for _m in _messages], list(range(50)))
+
+    def test_columnar(self):
+        """
+        Checks that the readings are packed as lists of values per field.
+        """
+        _sink = MQTTSink(self._logger, 'localhost', 1883, batch_threshold=100,
+                         batch_size=65536, batch_layout=COLUMNAR)
+        _msgs = self._published(_sink, 100)
+
+        self.assertEqual(len(_msgs), 1)
+        _payload = json.loads(_msgs[0]['payload'])
+        self.assertEqual(_payload['timestamp'], list(range(50)))
+        self.assertNotIn('dewpoint', _payload)
+
+    def test_worker_backlog(self):
+        """
+        Checks that the backlog of a worker is published in batches down to
+        its last readings.
+        """
+        _sink = self._connected(MQTTSink(
+            self._logger, 'localhost', 1883, qos=parse_mqtt_qos(''),
+            batch_threshold=100, batch_layout=ARRAY))
+        _worker = SinkWorker(_sink, self._logger, queue_size=1000)
+        for _i in range(1000):
+            _worker.put(_reading(_i))
+
+        _worker.start()
+        _worker.stop()
+        _worker.join()
+
+        _payloads = [
+            json.loads(_c[0][1])
+            for _c in self._client.publish.call_args_list]
+        self.assertEqual(_worker.delivered, 1000)
+        self.assertLess(len(_payloads), 10)
+        for _payload in _payloads:
+            self.assertIsInstance(_payload, list)
+        self.assertEqual(
+            [_m['timestamp'] for _p in _payloads for _m in _p],
+            list(range(1000)))
+
+    def test_qos(self):
+        """
+        Checks the QoS of the topics.
+        """
+        _sink = MQTTSink(self._logger, 'localhost', 1883, qos=parse_mqtt_qos(
+            'WeatherObserved/#=1, DeviceStatus/EDGE.HOUSEKEEPING=2'))
+        _msgs = self._published(_sink, 10)
+
+        self.assertEqual(set(_m['qos'] for _m in _msgs), {1})
+        self.assertEqual(
+            _sink._topic_qos('DeviceStatus/EDGE.HOUSEKEEPING'), 2)
+        self.assertEqual(_sink._topic_qos('DeviceStatus/OTHER'), 0)
+
+        with self.assertRaises(ValueError):
+            parse_mqtt_qos('WeatherObserved/#=3')
+
+    def test_acks(self):
+        """
+        Checks that a batch is published only when the messages of the
+        previous one are acknowledged, also before being tracked.
+        """
+        _sink = self._connected(
+            MQTTSink(self._logger, 'localhost', 1883, timeout=0.1))
+
+        _sink.write(self._readings[:10])
+        with self.assertRaises(TimeoutError):
+            _sink.write(self._readings[10:])
+        self.assertEqual(self._client.publish.call_count, 10)
+
+        for _mid in range(1, 11):
+            _sink._on_publish(None, None, _mid, None, None)
+        _sink._on_publish(None, None, 11, None, None)
+
+        _sink.write(self._readings[10:20])
+        self.assertEqual(self._client.publish.call_count, 20)
+        self.assertEqual(len(_sink._unacked), 9)
+
+    def test_qos0_mids(self):
+        """
+        Checks that the callbacks of the QoS 0 messages, before or after
+        publish() returns, do not acknowledge a QoS 1 message reusing their
+        mid once the mids wrap around.
+        """
+        _sink = self._connected(
+            MQTTSink(self._logger, 'localhost', 1883, timeout=0.1))
+        _housekeeping = HousekeepingRecord('EDGE', timestamp=1)
+
+        # Callback run by publish(), before the mid is returned
+        def _early(topic, payload, qos):
+            _sink._on_publish(None, None, 5, None, None)
+            return Mock(rc=0, mid=5)
+
+        self._client.publish.side_effect = _early
+        _sink.write([_housekeeping])
+        self._client.publish.side_effect = (
+            lambda topic, payload, qos: Mock(rc=0, mid=6))
+        _sink.write([_housekeeping])
+        _sink._on_publish(None, None, 6, None, None)
+
+        self.assertEqual(
+            set(_c[1]['qos'] for _c in self._client.publish.call_args_list),
+            {0})
+        self.assertEqual(_sink._early_acks, set())
+        self.assertEqual(_sink._untracked, set())
+
+        for _mid in [5, 6]:
+            self._client.publish.side_effect = (
+                lambda topic, payload, qos, _m=_mid: Mock(rc=0, mid=_m))
+            _sink.write([self._readings[0]])
+            self.assertEqual(_sink._unacked, {_mid})
+
+            with self.assertRaises(TimeoutError):
+                _sink.write([self._readings[1]])
+            _sink._on_publish(None, None, _mid, None, None)
+
+        self.assertEqual(_sink._unacked, set())
+
+    def test_disconnected(self):
+        """
+        Checks that nothing is published while disconnected.
+        """
+        _sink = MQTTSink(self._logger, 'localhost', 1883, timeout=0.1)
+
+        with self.assertRaises(ConnectionError):
+            _sink.write(self._readings)
+        self.assertFalse(self._client.publish.called)
+
+
+class TestInfluxDBSink(unittest.TestCase):
+    """
+    Checks the errors of the InfluxDB sink.
+    """
+
+    def setUp(self):
+        _patcher = patch('influxdb.InfluxDBClient')
+        self._client = _patcher.start().return_value
+        self.addCleanup(_patcher.stop)
+
+        self._client.get_list_database.return_value = [{'name': 'test'}]
+        self._sink = InfluxDBSink(
+            Mock(), 'localhost', 8086, 'root', 'root', 'test')
+
+    def test_rejected(self):
+        """
+        Checks that a malformed request is reported as rejected, and the
+        other failures as they are.
+        """
+        self._client.write_points.side_effect = \
+            influxdb.exceptions.InfluxDBClientError('bad timestamp', 400)
+        with self.assertRaises(RejectedError):
+            self._sink.write([_reading(0)])
+
+        self._client.write_points.side_effect = \
+            influxdb.exceptions.InfluxDBClientError('not found', 404)
+        with self.assertRaises(influxdb.exceptions.InfluxDBClientError):
+            self._sink.write([_reading(0)])
+
+        self._client.write_points.side_effect = \
+            influxdb.exceptions.InfluxDBServerError('unavailable')
+        with self.assertRaises(influxdb.exceptions.InfluxDBServerError):
+            self._sink.write([_reading(0)])
+
+
+class TestInfluxDBUDPSink(unittest.TestCase):
+    """
+    Checks the datagrams received by a local UDP socket.
+    """
+
+    def setUp(self):
+        self._logger = Mock()
+        self._readings = [_reading(_i) for _i in range(50)]
+
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind(('127.0.0.1', 0))
+        self._socket.settimeout(1)
+        self._port = self._socket.getsockname()[1]
+
+    def tearDown(self):
+        self._socket.close()
+
+    def _received(self, count):
+        return [self._socket.recv(65536) for _i in range(count)]
+
+    def test_packing(self):
+        """
+        Checks that the points are packed in datagrams of bounded size, with
+        the timestamps in nanoseconds.
+        """
+        _sink = InfluxDBUDPSink(
+            self._logger, '127.0.0.1', self._port, precision='s',
+            datagram_size=512)
+        _sink.write(self._readings)
+
+        _sink.close()
+        self.assertEqual(_sink.sent, 50)
+        self.assertEqual(_sink.dropped, 0)
+
+        _lines = list()
+        while len(_lines) < 50:
+            _datagram = self._received(1)[0]
+            self.assertLessEqual(len(_datagram), 512)
+            _lines.extend(_datagram.decode('utf-8').split('\n'))
+
+        self.assertEqual(len(_lines), 50)
+        self.assertEqual(
+            _lines[1],
+            'sensors,sensor=htu21d dewpoint=9.0,relativeHumidity=50.0,'
+            'temperature=21.0 1000000000')
+
+    def test_dropped(self):
+        """
+        Checks that the points larger than a datagram are dropped.
+        """
+        _sink = InfluxDBUDPSink(
+            self._logger, '127.0.0.1', self._port, datagram_size=16)
+        _sink.write(self._readings)
+
+        self.assertEqual(_sink.sent, 0)
+        self.assertEqual(_sink.dropped, 50)
+        self.assertEqual(_sink.stats, '0 points sent, 50 dropped')
+        _sink.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
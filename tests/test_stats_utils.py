@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+This module tests:
+    * the percentiles of a list of values.
+"""
+
+import unittest
+
+from stats_utils import percentile
+
+
+class TestPercentile(unittest.TestCase):
+    """
+    Checks the percentiles of a list of values.
+    """
+
+    def test_values(self):
+        _values = list(range(100, 0, -1))
+
+        self.assertEqual(percentile(_values, 0.50), 51)
+        self.assertEqual(percentile(_values, 0.99), 100)
+        self.assertEqual(percentile(_values, 1.0), 100)
+        self.assertEqual(percentile(_values, 0.0), 1)
+
+    def test_empty(self):
+        self.assertEqual(percentile([], 0.5), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
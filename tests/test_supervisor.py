@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+This module tests:
+    * that the readings of the worker processes reach the supervisor;
+    * that a worker is restarted when it fails or misses its heartbeat;
+    * the heartbeats while the scheduler of a worker is waiting;
+    * that the workers are not stalled by a blocking sink;
+    * that the signals are forwarded to the workers.
+"""
+
+import os
+import time
+import signal
+import unittest
+import multiprocessing
+
+from unittest.mock import Mock
+from supervisor import Heartbeat, Supervisor
+
+
+def _counting_worker(name, connection, heartbeat, count):
+    for _i in range(count):
+        heartbeat.beat()
+        connection.send((name, _i))
+
+
+def _bulk_worker(name, connection, heartbeat, sent):
+    # More than the buffer of a pipe
+    for _i in range(200):
+        heartbeat.beat()
+        connection.send((name, _i, b'x' * 1024))
+    sent.set()
+
+
+def _signalled_worker(name, connection, heartbeat):
+    _received = list()
+    signal.signal(signal.SIGUSR1, lambda *args: _received.append(args[0]))
+    connection.send('ready')
+
+    _deadline = time.monotonic() + 10
+    while not _received and time.monotonic() < _deadline:
+        time.sleep(0.01)
+    connection.send(_received)
+
+
+def _failing_worker(name, connection, heartbeat, attempts, failure):
+    # The first attempt fails, the second one finishes
+    _attempt = attempts.value
+    attempts.value += 1
+    connection.send((name, _attempt))
+
+    if _attempt == 0:
+        if failure == 'hang':
+            time.sleep(60)
+        os._exit(1)
+
+
+class TestSupervisor(unittest.TestCase):
+    """
+    Checks the supervision of the worker processes.
+    """
+
+    def test_readings(self):
+        """
+        Checks that all the readings of the workers are received.
+        """
+        _supervisor = Supervisor(Mock())
+        _supervisor.add_worker('a', _counting_worker, 100)
+        _supervisor.add_worker('b', _counting_worker, 50)
+
+        _readings = list()
+        _supervisor.run(_readings.append)
+
+        self.assertEqual(
+            sorted(_readings),
+            [('a', _i) for _i in range(100)] + [('b', _i) for _i in range(50)])
+        self.assertFalse(_supervisor.restarts)
+
+    def test_blocking_put(self):
+        """
+        Checks that a worker sends all its readings while the sinks are
+        blocked.
+        """
+        _sent = multiprocessing.get_context('spawn').Event()
+        _supervisor = Supervisor(Mock())
+        _supervisor.add_worker('a', _bulk_worker, _sent)
+
+        _readings = list()
+
+        def _put(reading):
+            if not _readings:
+                _readings.append(_sent.wait(10))
+            _readings.append(reading)
+
+        _supervisor.run(_put)
+
+        self.assertIs(_readings[0], True)
+        self.assertEqual(
+            [_r[1] for _r in _readings[1:]], list(range(200)))
+
+    def test_signal(self):
+        """
+        Checks that a signal is forwarded to the running workers.
+        """
+        _supervisor = Supervisor(Mock())
+        _supervisor.add_worker('a', _signalled_worker)
+
+        _readings = list()
+
+        def _put(reading):
+            _readings.append(reading)
+            if reading == 'ready':
+                _supervisor.signal_workers(signal.SIGUSR1)
+
+        _supervisor.run(_put)
+
+        self.assertEqual(_readings, ['ready', [signal.SIGUSR1]])
+
+    def _restarted(self, failure):
+        _supervisor = Supervisor(Mock(), heartbeat_timeout=1)
+        _attempts = multiprocessing.get_context('spawn').Value('i', 0)
+        _supervisor.add_worker('a', _failing_worker, _attempts, failure)
+
+        _readings = list()
+        _start = time.monotonic()
+        _supervisor.run(_readings.append)
+
+        self.assertLess(time.monotonic() - _start, 10)
+        self.assertEqual(_readings, [('a', 0), ('a', 1)])
+        self.assertEqual(_supervisor.restarts['a'], 1)
+
+    def test_exit(self):
+        """
+        Checks that a worker exiting with an error is restarted.
+        """
+        self._restarted('exit')
+
+    def test_hang(self):
+        """
+        Checks that a worker missing its heartbeat is killed and restarted.
+        """
+        self._restarted('hang')
+
+
+class TestHeartbeat(unittest.TestCase):
+    """
+    Checks the heartbeats of a worker.
+    """
+
+    def test_delayfunc(self):
+        """
+        Checks that the waits of the scheduler are split to beat every
+        interval.
+        """
+        _heartbeat = Heartbeat(multiprocessing.get_context('spawn'), 1)
+        _sleeps = list()
+        _sleep = _heartbeat.delayfunc(_sleeps.append)
+
+        _sleep(3.5)
+        self.assertEqual(_sleeps, [1, 1, 1, 0.5])
+
+        _sleep(0)
+        self.assertEqual(len(_sleeps), 4)
+        self.assertLess(_heartbeat.age, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()